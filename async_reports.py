@@ -0,0 +1,202 @@
+"""
+Extração de insights via relatórios assíncronos da Meta Ads API.
+
+Fluxo (ver doc-meta.txt, "Trabalhos assíncronos da API de Insights"):
+1. POST /act_X/insights -> report_run_id
+2. GET /<report_run_id> até async_status == "Job Completed"
+3. GET /<report_run_id>/insights paginado para buscar o resultado
+
+Vários relatórios ficam em andamento ao mesmo tempo (um por janela de
+conta), e os resultados são entregues página a página para o callback de
+carga.
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATUS_COMPLETED = "Job Completed"
+STATUS_FAILED = ("Job Failed", "Job Skipped")
+
+# Intervalos de consulta do status (segundos)
+POLL_MIN_INTERVAL = 2
+POLL_MAX_INTERVAL = 30
+
+
+def submit_report_run(client, account_id, params, usage=None):
+    """Cria a geração de relatório e retorna o report_run_id"""
+    response = client.post(
+        f"{account_id}/insights", data=params, account_id=account_id, usage=usage
+    )
+    data = response.json()
+    if response.status_code != 200 or "report_run_id" not in data:
+        raise RuntimeError(f"Falha ao criar relatório: {response.text}")
+    return data["report_run_id"]
+
+
+def get_report_run(client, report_run_id, account_id, usage=None):
+    """Consulta async_status e async_percent_completion do relatório"""
+    response = client.get(report_run_id, account_id=account_id, timeout=30, usage=usage)
+    if response.status_code != 200:
+        raise RuntimeError(f"Falha ao consultar relatório: {response.text}")
+    return response.json()
+
+
+def iter_report_pages(client, report_run_id, account_id, limit=500, usage=None):
+    """Percorre as páginas do resultado do relatório: (linhas, próxima URL)"""
+    url = f"{report_run_id}/insights"
+    params = {"limit": limit}
+    while url:
+        response = client.get(url, params=params, account_id=account_id, usage=usage)
+        if response.status_code != 200:
+            raise RuntimeError(f"Falha ao ler resultado: {response.text}")
+        data = response.json()
+        url = data.get("paging", {}).get("next")
+        yield data.get("data", []), url
+        params = {}
+
+
+def next_poll_interval(started_at, percent, current_interval):
+    """
+    Intervalo adaptativo: estima o tempo restante a partir do progresso
+    reportado; sem progresso, recua exponencialmente.
+    """
+    elapsed = time.monotonic() - started_at
+    if percent and 0 < percent < 100:
+        remaining = elapsed * (100 - percent) / percent
+        interval = remaining / 2
+    else:
+        interval = current_interval * 1.5
+    return min(max(interval, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+
+
+def run_report_runs(
+    client,
+    jobs,
+    on_start,
+    on_page,
+    on_finish,
+    max_in_flight=5,
+    result_limit=500,
+    executor=None,
+    stop=None,
+):
+    """
+    Mantém até max_in_flight relatórios em andamento entre as contas.
+
+    Cada job é um dict com "account_id" e "params" (parâmetros do POST).
+    on_start(job) é chamado quando o relatório fica pronto, imediatamente
+    antes das páginas; on_page(job, page, rows) recebe cada página do
+    resultado e on_finish(job) é chamado após a última. Durante a leitura,
+    job["report_run_id"] e job["next_url"] (cursor da página seguinte)
+    ficam disponíveis para checkpoint, e job["started"] (time.monotonic())
+    marca a criação do relatório.
+    Com um executor, a leitura dos resultados roda em paralelo ao polling.
+    Com `stop` (threading.Event) sinalizado, nenhum relatório novo é criado
+    e as leituras param após a página em andamento.
+    """
+    pending = list(jobs)
+    in_flight = {}
+    streams = []
+
+    while (pending or in_flight) and not (stop and stop.is_set()):
+        while pending and len(in_flight) < max_in_flight:
+            job = pending.pop(0)
+            account_id = job["account_id"]
+            job["started"] = time.monotonic()
+            try:
+                report_run_id = submit_report_run(
+                    client, account_id, job["params"], job.get("usage")
+                )
+            except Exception as e:
+                logger.error(f"❌ Erro ao criar relatório ({account_id}): {e}")
+                continue
+            logger.info(f"📨 Relatório {report_run_id} criado para {account_id}")
+            now = time.monotonic()
+            in_flight[report_run_id] = {
+                "job": job,
+                "started_at": now,
+                "interval": POLL_MIN_INTERVAL,
+                "next_poll": now + POLL_MIN_INTERVAL,
+            }
+
+        if not in_flight:
+            continue
+
+        report_run_id, state = min(
+            in_flight.items(), key=lambda item: item[1]["next_poll"]
+        )
+        wait = state["next_poll"] - time.monotonic()
+        if wait > 0:
+            if stop:
+                stop.wait(wait)
+                if stop.is_set():
+                    break
+            else:
+                time.sleep(wait)
+
+        job = state["job"]
+        account_id = job["account_id"]
+        try:
+            status = get_report_run(client, report_run_id, account_id, job.get("usage"))
+        except Exception as e:
+            logger.error(f"❌ Erro ao consultar relatório ({account_id}): {e}")
+            del in_flight[report_run_id]
+            continue
+
+        async_status = status.get("async_status")
+        percent = status.get("async_percent_completion", 0)
+
+        if async_status == STATUS_COMPLETED and percent == 100:
+            del in_flight[report_run_id]
+            stream_args = (
+                client,
+                report_run_id,
+                job,
+                on_start,
+                on_page,
+                on_finish,
+                result_limit,
+            )
+            if executor:
+                streams.append(executor.submit(_stream_results, *stream_args, stop))
+            else:
+                _stream_results(*stream_args, stop)
+        elif async_status in STATUS_FAILED:
+            del in_flight[report_run_id]
+            logger.error(
+                f"❌ Relatório {report_run_id} ({account_id}) terminou com "
+                f"status '{async_status}': {status.get('error_message', '')}"
+            )
+        else:
+            state["interval"] = next_poll_interval(
+                state["started_at"], percent, state["interval"]
+            )
+            state["next_poll"] = time.monotonic() + state["interval"]
+
+    for stream in streams:
+        stream.result()
+
+
+def _stream_results(
+    client, report_run_id, job, on_start, on_page, on_finish, limit, stop=None
+):
+    account_id = job["account_id"]
+    job["report_run_id"] = report_run_id
+    job["next_url"] = f"{report_run_id}/insights?limit={limit}"
+    try:
+        on_start(job)
+        page = 0
+        for rows, next_url in iter_report_pages(
+            client, report_run_id, account_id, limit, job.get("usage")
+        ):
+            page += 1
+            job["next_url"] = next_url
+            on_page(job, page, rows)
+            if next_url and stop and stop.is_set():
+                logger.warning(f"🛑 Leitura do relatório {report_run_id} ({account_id}) parada")
+                return
+        on_finish(job)
+    except Exception as e:
+        logger.error(f"❌ Erro ao ler relatório {report_run_id} ({account_id}): {e}")
@@ -0,0 +1,243 @@
+"""
+Micro-benchmark das etapas de extração/transformação/carga.
+
+Gera páginas sintéticas (mesmo gerador da fake_graph_api.py, com arrays de
+actions realistas) e mede, em linhas/s e pico de memória (tracemalloc):
+
+- decode:           json.loads do corpo de cada página
+- map_actions:      soma das actions nas colunas de ACTION_MAPPING
+- finalize_columns: rename/reindex para FINAL_COLS
+- transform_page:   transformação completa de uma página
+- load_<método>:    cada estratégia de loader.LOAD_METHODS no staging,
+                    uma transação por página como no ETL
+
+    DB_HOST=localhost DB_PASS=... python benchmark.py --rows 20000
+    python benchmark.py --skip-db --baseline benchmark_results/anterior.json
+
+O resultado vai para benchmark_results/<data>_<commit>.json. Com
+--baseline, etapas que ficaram mais lentas que a tolerância são listadas
+e o script sai com código 1.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import loader
+import main as etl
+from fake_graph_api import FakeGraphAPI
+
+BENCH_ACCOUNT = "act_benchmark"
+BENCH_START = date(2020, 1, 1)
+
+
+def synthetic_pages(total_rows, page_size, rows_per_day, seed):
+    """Corpos JSON (bytes) das páginas, como chegam da API"""
+    api = FakeGraphAPI(rows_per_day=rows_per_day, seed=seed)
+    rows = []
+    day = BENCH_START
+    while len(rows) < total_rows:
+        rows.extend(api.rows_for_day(BENCH_ACCOUNT, day))
+        day += timedelta(days=1)
+    rows = rows[:total_rows]
+    return [
+        json.dumps({"data": rows[i : i + page_size]}).encode("utf-8")
+        for i in range(0, len(rows), page_size)
+    ], day - timedelta(days=1)
+
+
+def run_stage(fn, inputs):
+    for item in inputs:
+        fn(item)
+
+
+def measure(name, fn, make_inputs, rows, repeat):
+    """
+    Mediana de `repeat` passadas cronometradas (sem tracemalloc) e uma
+    passada extra só para o pico de memória. make_inputs gera entradas
+    novas a cada passada, fora do tempo medido.
+    """
+    timings = []
+    for _ in range(repeat):
+        inputs = make_inputs()
+        start = time.perf_counter()
+        run_stage(fn, inputs)
+        timings.append(time.perf_counter() - start)
+
+    inputs = make_inputs()
+    tracemalloc.start()
+    run_stage(fn, inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = statistics.median(timings)
+    result = {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(seconds, 6),
+        "best_seconds": round(min(timings), 6),
+        "rows_per_s": round(rows / seconds, 1) if seconds else None,
+        "peak_mb": round(peak / 1024 / 1024, 3),
+    }
+    print(
+        f"  {name:<18} {result['rows_per_s']:>12,.0f} linhas/s"
+        f"  {seconds * 1000:>9.1f} ms  pico {result['peak_mb']:>8.2f} MB"
+    )
+    return result
+
+
+def load_into_staging(method, since, until):
+    def load(df):
+        with etl.engine.begin() as conn:
+            loader.load_dataframe(conn, df, loader.STAGING_TABLE, method)
+
+    def clean():
+        with etl.engine.begin() as conn:
+            loader.reset_staging(conn, BENCH_ACCOUNT, since, until)
+
+    return load, clean
+
+
+def run_benchmarks(args):
+    pages, until = synthetic_pages(args.rows, args.page_size, args.rows_per_day, args.seed)
+    decoded = [json.loads(body)["data"] for body in pages]
+    rows = sum(len(page) for page in decoded)
+    actions = sum(len(r.get("actions", [])) for page in decoded for r in page)
+    print(f"🧪 {rows} linhas em {len(pages)} páginas ({actions / rows:.1f} actions/linha)")
+
+    def frames():
+        # Entrada de map_actions: página já numérica, como em transform_page
+        out = []
+        for page in decoded:
+            df = pd.DataFrame(page)
+            df["account_id"] = BENCH_ACCOUNT
+            df["nome_conta"] = f"Conta {BENCH_ACCOUNT}"
+            for col in ["impressions", "spend"]:
+                df[col] = pd.to_numeric(df.get(col, 0)).fillna(0)
+            out.append(df)
+        return out
+
+    results = [
+        measure("decode", json.loads, lambda: pages, rows, args.repeat),
+        measure("map_actions", etl.map_actions, frames, rows, args.repeat),
+        measure(
+            "finalize_columns",
+            etl.finalize_columns,
+            lambda: [etl.map_actions(df) for df in frames()],
+            rows,
+            args.repeat,
+        ),
+        measure(
+            "transform_page",
+            lambda page: etl.transform_page(page, BENCH_ACCOUNT),
+            lambda: decoded,
+            rows,
+            args.repeat,
+        ),
+    ]
+
+    if not args.skip_db:
+        transformed = [etl.transform_page(page, BENCH_ACCOUNT) for page in decoded]
+        for method in loader.LOAD_METHODS:
+            load, clean = load_into_staging(method, BENCH_START, until)
+
+            def fresh():
+                clean()
+                return transformed
+
+            try:
+                results.append(measure(f"load_{method}", load, fresh, rows, args.repeat))
+            finally:
+                clean()
+
+    return {
+        "rows": rows,
+        "pages": len(pages),
+        "page_size": args.page_size,
+        "actions_per_row": round(actions / rows, 2),
+        "repeat": args.repeat,
+        "stages": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def compare(report, baseline_path, tolerance):
+    """Etapas cujo rows_per_s caiu mais que `tolerance` em relação ao baseline"""
+    with open(baseline_path) as f:
+        baseline = {s["stage"]: s for s in json.load(f)["stages"]}
+    regressions = []
+    for stage in report["stages"]:
+        before = baseline.get(stage["stage"])
+        if not before or not before.get("rows_per_s") or not stage["rows_per_s"]:
+            continue
+        change = stage["rows_per_s"] / before["rows_per_s"] - 1
+        flag = "🔻" if change < -tolerance else "  "
+        print(f"  {flag} {stage['stage']:<18} {change:+7.1%} (antes {before['rows_per_s']:,.0f} linhas/s)")
+        if change < -tolerance:
+            regressions.append(stage["stage"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do ETL")
+    parser.add_argument("--rows", type=int, default=10000, help="Linhas sintéticas")
+    parser.add_argument("--page-size", type=int, default=25, help="Linhas por página (limit da API)")
+    parser.add_argument("--rows-per-day", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5, help="Passadas por etapa (vale a mediana)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-db", action="store_true", help="Só decode/transformação")
+    parser.add_argument("--output", help="Arquivo JSON (padrão: benchmark_results/<data>_<commit>.json)")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Queda aceitável de linhas/s")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "load_target": None if args.skip_db else f"{etl.DB_HOST}:{etl.DB_PORT}/{etl.DB_NAME}",
+        **run_benchmarks(args),
+    }
+
+    output = args.output or os.path.join(
+        "benchmark_results", f"{datetime.now():%Y%m%dT%H%M%S}_{commit}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Resultado salvo em {output}")
+
+    if args.baseline:
+        regressions = compare(report, args.baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Regressão acima de {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Checkpoints de paginação (etl_checkpoints) para retomar shards interrompidos.
+
+Cada página gravada no staging atualiza, na mesma transação, o checkpoint
+do shard: o cursor da próxima página (paging.next, sem o access_token), o
+report_run_id no modo async e quantas páginas/linhas já estão no staging.
+Se o processo morre (ou uma página falha), a próxima tentativa segue do
+cursor sem limpar o staging nem baixar de novo o que já foi gravado.
+
+next_url NULL significa que todas as páginas estão no staging e só falta
+publicar. A publicação da janela apaga o checkpoint.
+"""
+
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import text
+
+_COLUMNS = (
+    "account_id, since, until, query_signature, run_id, report_run_id, "
+    "next_url, pages, rows, updated_at"
+)
+
+
+def strip_token(url):
+    """Remove o access_token do cursor antes de persistir"""
+    if not url:
+        return url
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "access_token"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def save_checkpoint(
+    conn, account_id, since, until, signature, run_id, next_url, pages, rows,
+    report_run_id=None,
+):
+    conn.execute(
+        text(
+            "INSERT INTO etl_checkpoints (account_id, since, until, query_signature, "
+            "run_id, report_run_id, next_url, pages, rows) "
+            "VALUES (:acc, :s, :u, :sig, :run, :report, :url, :pages, :rows) "
+            "ON CONFLICT (account_id, since, until) DO UPDATE SET "
+            "query_signature = EXCLUDED.query_signature, run_id = EXCLUDED.run_id, "
+            "report_run_id = EXCLUDED.report_run_id, next_url = EXCLUDED.next_url, "
+            "pages = EXCLUDED.pages, rows = EXCLUDED.rows, updated_at = CURRENT_TIMESTAMP"
+        ),
+        {
+            "acc": account_id,
+            "s": since,
+            "u": until,
+            "sig": signature,
+            "run": run_id,
+            "report": report_run_id,
+            "url": strip_token(next_url),
+            "pages": pages,
+            "rows": rows,
+        },
+    )
+
+
+def get_checkpoint(conn, account_id, since, until):
+    row = conn.execute(
+        text(
+            f"SELECT {_COLUMNS} FROM etl_checkpoints "
+            "WHERE account_id = :acc AND since = :s AND until = :u"
+        ),
+        {"acc": account_id, "s": since, "u": until},
+    ).mappings().fetchone()
+    return dict(row) if row else None
+
+
+def pending_checkpoints(conn, accounts=None):
+    """Shards interrompidos, do mais antigo para o mais recente"""
+    rows = conn.execute(
+        text(f"SELECT {_COLUMNS} FROM etl_checkpoints ORDER BY account_id, since")
+    ).mappings().all()
+    return [dict(row) for row in rows if not accounts or row["account_id"] in accounts]
+
+
+def clear_checkpoint(conn, account_id, since, until):
+    conn.execute(
+        text(
+            "DELETE FROM etl_checkpoints "
+            "WHERE account_id = :acc AND since = :s AND until = :u"
+        ),
+        {"acc": account_id, "s": since, "u": until},
+    )
+
+
+def clear_overlapping(conn, account_id, since, until):
+    """
+    Descarta checkpoints de shards que cruzam a janela: o staging dela vai
+    ser limpo, então o cursor deles deixaria de valer.
+    """
+    conn.execute(
+        text(
+            "DELETE FROM etl_checkpoints WHERE account_id = :acc "
+            "AND since <= :u AND until >= :s"
+        ),
+        {"acc": account_id, "s": since, "u": until},
+    )
@@ -8,6 +8,7 @@ import os
 import requests
 import json
 from dotenv import load_dotenv
+from graph_client import GraphClient
 
 load_dotenv()
 
@@ -15,20 +16,19 @@ ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN")
 AD_ACCOUNTS = os.getenv("AD_ACCOUNTS", "").split(",")
 API_VERSION = "v24.0"
 
+client = GraphClient(ACCESS_TOKEN, API_VERSION, timeout=30)
+
 
 def discover_action_types(account_id):
     """Descobre todos os action_types disponíveis em uma conta"""
-    url = f"https://graph.facebook.com/{API_VERSION}/{account_id}/insights"
-
     params = {
-        "access_token": ACCESS_TOKEN,
         "level": "account",
         "date_preset": "last_30d",
         "fields": "actions,action_values",
     }
 
     try:
-        response = requests.get(url, params=params, timeout=30)
+        response = client.get(f"{account_id}/insights", params=params)
         response.raise_for_status()
         data = response.json()
 
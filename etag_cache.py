@@ -0,0 +1,80 @@
+"""
+Cache de ETags das fatias já publicadas (conta, shard, assinatura da consulta).
+
+A Graph API devolve um ETag em cada resposta. Reenviando-o em If-None-Match,
+a Meta responde 304 (sem corpo) quando o resultado não mudou, e a fatia é
+mantida como está: sem transformação e sem escrita no banco.
+
+Só shards de página única são cacheados: o ETag de uma página não diz nada
+sobre as páginas seguintes. Como os shards seguem fronteiras fixas de
+calendário (planner.shard_window), os do meio da janela de atribuição
+repetem a chave a cada execução. As chaves que ficaram para trás da janela
+são apagadas pelo prune.
+"""
+
+import json
+import hashlib
+
+from sqlalchemy import text
+
+
+def query_signature(params, *extra):
+    """
+    Hash dos parâmetros da consulta (sem o período, que já faz parte da
+    chave) e de qualquer configuração que mude o resultado gravado, como o
+    mapeamento de actions.
+    """
+    relevant = {
+        key: value
+        for key, value in params.items()
+        if key not in ("time_range", "access_token")
+    }
+    payload = json.dumps([relevant, *extra], sort_keys=True, default=str)
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def get_etag(conn, account_id, since, until, signature):
+    row = conn.execute(
+        text(
+            "SELECT etag FROM etl_etags WHERE account_id = :acc "
+            "AND since = :s AND until = :u AND query_signature = :sig"
+        ),
+        {"acc": account_id, "s": since, "u": until, "sig": signature},
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_etag(conn, account_id, since, until, signature, etag):
+    conn.execute(
+        text(
+            "INSERT INTO etl_etags (account_id, since, until, query_signature, etag) "
+            "VALUES (:acc, :s, :u, :sig, :etag) "
+            "ON CONFLICT (account_id, since, until, query_signature) DO UPDATE SET "
+            "etag = EXCLUDED.etag, updated_at = CURRENT_TIMESTAMP"
+        ),
+        {"acc": account_id, "s": since, "u": until, "sig": signature, "etag": etag},
+    )
+
+
+def forget_etag(conn, account_id, since, until, signature=None):
+    """Descarta o ETag da fatia (de todas as assinaturas, sem `signature`)"""
+    conn.execute(
+        text(
+            "DELETE FROM etl_etags WHERE account_id = :acc "
+            "AND since = :s AND until = :u "
+            "AND (CAST(:sig AS VARCHAR) IS NULL OR query_signature = :sig)"
+        ),
+        {"acc": account_id, "s": since, "u": until, "sig": signature},
+    )
+
+
+def prune(conn, account_id, keep_since):
+    """
+    Apaga os ETags da conta de shards que começam antes de `keep_since`
+    (início da janela reextraída): dias finalizados não são mais pedidos e
+    o primeiro shard, cortado pela janela, muda de chave a cada dia.
+    """
+    return conn.execute(
+        text("DELETE FROM etl_etags WHERE account_id = :acc AND since < :keep"),
+        {"acc": account_id, "keep": keep_since},
+    ).rowcount
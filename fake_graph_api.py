@@ -0,0 +1,465 @@
+"""
+Servidor local que imita a Graph API de insights, para testes de carga e de
+falha sem token da Meta.
+
+    python fake_graph_api.py --port 8765 --rows-per-day 200 --latency 0.05 \\
+        --throttle-rate 0.02 --server-error-rate 0.02
+
+    GRAPH_BASE_URL=http://localhost:8765/v21.0 META_ACCESS_TOKEN=fake python main.py full-refresh
+
+Atende:
+- GET  /<versão>/act_X/insights        paginação por cursor (after/limit)
+- POST /<versão>/act_X/insights        cria um relatório assíncrono
+- GET  /<versão>/<report_run_id>       async_status / async_percent_completion
+- GET  /<versão>/<report_run_id>/insights
+- POST /<versão>/ com batch=[...]      Batch API
+
+Os dados são determinísticos por (seed, conta, dia): a mesma consulta
+devolve sempre as mesmas linhas, com arrays de actions realistas. Cada
+resposta traz os cabeçalhos de uso (x-fb-ads-insights-throttle,
+x-business-use-case-usage) e ETag. Erros 17, 80000, 5xx e timeouts são
+sorteados conforme as taxas configuradas. Com --row-latency a página
+demora proporcionalmente ao limit, e acima de --max-limit a API responde
+"Please reduce the amount of data you're asking for".
+"""
+
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+PLACEMENTS = [
+    ("facebook", "feed"),
+    ("facebook", "facebook_reels"),
+    ("instagram", "feed"),
+    ("instagram", "instagram_stories"),
+    ("instagram", "instagram_reels"),
+    ("audience_network", "classic"),
+]
+
+# (action_type, probabilidade de aparecer, valor máximo)
+ACTION_TYPES = [
+    ("link_click", 0.9, 60),
+    ("landing_page_view", 0.7, 40),
+    ("lead", 0.3, 8),
+    ("onsite_conversion.lead_grouped", 0.2, 6),
+    ("offsite_conversion.fb_pixel_lead", 0.2, 6),
+    ("onsite_conversion.messaging_conversation_started_7d", 0.4, 10),
+    ("onsite_conversion.messaging_first_reply", 0.3, 8),
+    ("video_view", 0.6, 300),
+    ("post_engagement", 0.8, 120),
+    ("page_engagement", 0.8, 130),
+    ("offsite_conversion.fb_pixel_purchase", 0.05, 3),
+]
+
+
+class FakeGraphAPI:
+    """Estado e configuração do servidor (compartilhado entre as threads)"""
+
+    def __init__(
+        self,
+        rows_per_day=50,
+        latency=0.0,
+        report_seconds=3.0,
+        seed=42,
+        throttle_rate=0.0,
+        ads_throttle_rate=0.0,
+        server_error_rate=0.0,
+        timeout_rate=0.0,
+        timeout_seconds=90.0,
+        calls_per_minute=600,
+        regain_minutes=1,
+        row_latency=0.0,
+        max_limit=None,
+    ):
+        self.rows_per_day = rows_per_day
+        self.latency = latency
+        self.report_seconds = report_seconds
+        self.seed = seed
+        self.throttle_rate = throttle_rate
+        self.ads_throttle_rate = ads_throttle_rate
+        self.server_error_rate = server_error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.calls_per_minute = calls_per_minute
+        self.regain_minutes = regain_minutes
+        self.row_latency = row_latency
+        self.max_limit = max_limit
+
+        self.base_url = None
+        self.reports = {}
+        self.requests = 0
+        self._calls = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # ---- dados -------------------------------------------------------------
+
+    def rows_for_day(self, account_id, day):
+        account_number = int("".join(ch for ch in account_id if ch.isdigit()) or 0)
+        rows = []
+        for i in range(self.rows_per_day):
+            rng = random.Random(f"{self.seed}:{account_id}:{day}:{i}")
+            platform, position = PLACEMENTS[i % len(PLACEMENTS)]
+            # IDs de 18 dígitos, como os reais, únicos por conta
+            base_id = 120200000000000000 + (account_number % 10**6) * 10**6
+            campaign_id = base_id + i // 30
+            adset_id = base_id + 100000 + i // 6
+            impressions = rng.randint(50, 5000)
+            actions = [
+                {"action_type": action_type, "value": str(rng.randint(1, max_value))}
+                for action_type, probability, max_value in ACTION_TYPES
+                if rng.random() < probability
+            ]
+            row = {
+                "campaign_id": str(campaign_id),
+                "campaign_name": f"Campanha {i // 30 + 1}",
+                "adset_id": str(adset_id),
+                "adset_name": f"Conjunto {i // 6 + 1}",
+                "ad_id": str(base_id + 500000 + i),
+                "ad_name": f"Anúncio {i + 1}",
+                "impressions": str(impressions),
+                "spend": f"{impressions * rng.uniform(0.004, 0.03):.2f}",
+                "date_start": str(day),
+                "date_stop": str(day),
+                "publisher_platform": platform,
+                "platform_position": position,
+            }
+            if actions:
+                row["actions"] = actions
+            rows.append(row)
+        return rows
+
+    def rows_for(self, account_id, time_range):
+        since = date.fromisoformat(time_range["since"])
+        until = date.fromisoformat(time_range["until"])
+        rows = []
+        day = since
+        while day <= until:
+            rows.extend(self.rows_for_day(account_id, day))
+            day += timedelta(days=1)
+        return rows
+
+    # ---- uso e falhas ------------------------------------------------------
+
+    def usage_pct(self, account_id):
+        """Chamadas da conta no último minuto em relação à capacidade"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            calls = self._calls.setdefault(account_id, deque())
+            calls.append(now)
+            while calls and calls[0] < now - 60:
+                calls.popleft()
+            total = sum(len(c) for c in self._calls.values())
+        acc_pct = min(100, 100 * len(calls) / self.calls_per_minute)
+        app_pct = min(100, 100 * total / (self.calls_per_minute * 4))
+        return app_pct, acc_pct
+
+    def usage_headers(self, account_id):
+        app_pct, acc_pct = self.usage_pct(account_id)
+        regain = self.regain_minutes if acc_pct >= 100 else 0
+        return {
+            "x-fb-ads-insights-throttle": json.dumps(
+                {"app_id_util_pct": round(app_pct, 2), "acc_id_util_pct": round(acc_pct, 2)}
+            ),
+            "x-business-use-case-usage": json.dumps(
+                {
+                    account_id.replace("act_", ""): [
+                        {
+                            "type": "ads_insights",
+                            "call_count": round(acc_pct),
+                            "total_cputime": round(acc_pct / 2),
+                            "total_time": round(acc_pct / 2),
+                            "estimated_time_to_regain_access": regain,
+                        }
+                    ]
+                }
+            ),
+        }
+
+    def draw_failure(self):
+        """Sorteia uma falha conforme as taxas ("throttle", "ads_throttle", "5xx", "timeout")"""
+        with self._lock:
+            roll = self._rng.random()
+        for kind, rate in (
+            ("throttle", self.throttle_rate),
+            ("ads_throttle", self.ads_throttle_rate),
+            ("5xx", self.server_error_rate),
+            ("timeout", self.timeout_rate),
+        ):
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    def failure_response(self, kind, account_id):
+        headers = self.usage_headers(account_id)
+        if kind == "throttle":
+            return 400, {
+                "error": {
+                    "message": "User request limit reached",
+                    "type": "OAuthException",
+                    "code": 17,
+                    "error_subcode": 2446079,
+                }
+            }, _force_regain(headers, account_id, self.regain_minutes)
+        if kind == "ads_throttle":
+            return 400, {
+                "error": {
+                    "message": "There have been too many calls to this ad-account.",
+                    "type": "OAuthException",
+                    "code": 80000,
+                    "error_subcode": 2446079,
+                }
+            }, _force_regain(headers, account_id, self.regain_minutes)
+        with self._lock:
+            status = self._rng.choice([500, 503])
+        return status, {
+            "error": {
+                "message": "An unknown error has occurred.",
+                "type": "OAuthException",
+                "code": 1,
+                "is_transient": True,
+            }
+        }, headers
+
+    # ---- rotas -------------------------------------------------------------
+
+    def insights_page(self, path, query, account_id, time_range):
+        rows = self.rows_for(account_id, time_range)
+        limit = int(query.get("limit", ["25"])[0])
+        if self.max_limit and limit > self.max_limit:
+            return 500, {
+                "error": {
+                    "message": "Please reduce the amount of data you're asking for, then retry your request",
+                    "type": "OAuthException",
+                    "code": 1,
+                }
+            }, self.usage_headers(account_id)
+        if self.row_latency:
+            time.sleep(limit * self.row_latency)
+        after = query.get("after", [None])[0]
+        offset = int(base64.b64decode(after).decode()) if after else 0
+
+        fields = query.get("fields", [None])[0]
+        page_rows = rows[offset : offset + limit]
+        if fields:
+            keep = set(fields.split(",")) | {
+                "date_start",
+                "date_stop",
+                "publisher_platform",
+                "platform_position",
+            }
+            page_rows = [{k: v for k, v in row.items() if k in keep} for row in page_rows]
+
+        body = {"data": page_rows}
+        if page_rows:
+            body["paging"] = {
+                "cursors": {
+                    "before": _cursor(offset),
+                    "after": _cursor(offset + len(page_rows) - 1),
+                }
+            }
+        if offset + limit < len(rows):
+            next_query = {k: v[0] for k, v in query.items() if k != "after"}
+            next_query["after"] = _cursor(offset + limit)
+            body["paging"]["next"] = f"{self.base_url}{path}?{urlencode(next_query)}"
+        return 200, body, self.usage_headers(account_id)
+
+    def create_report(self, account_id, form):
+        report_id = str(6000000000000 + len(self.reports))
+        with self._lock:
+            self.reports[report_id] = {
+                "account_id": account_id,
+                "time_range": json.loads(form["time_range"][0]),
+                "created": time.monotonic(),
+            }
+        return 200, {"report_run_id": report_id}, self.usage_headers(account_id)
+
+    def report_status(self, report_id):
+        report = self.reports[report_id]
+        elapsed = time.monotonic() - report["created"]
+        percent = min(100, int(100 * elapsed / self.report_seconds)) if self.report_seconds else 100
+        return 200, {
+            "id": report_id,
+            "account_id": report["account_id"].replace("act_", ""),
+            "async_status": "Job Completed" if percent >= 100 else "Job Running",
+            "async_percent_completion": percent,
+        }, self.usage_headers(report["account_id"])
+
+    def route(self, method, raw_path, form=None):
+        """Resolve uma requisição: retorna (status, corpo, cabeçalhos)"""
+        parts = urlsplit(raw_path)
+        query = parse_qs(parts.query)
+        segments = [s for s in parts.path.split("/") if s]
+        if segments and segments[0].startswith("v") and "." in segments[0]:
+            segments = segments[1:]
+
+        if method == "POST" and not segments and form and "batch" in form:
+            return 200, self.batch(json.loads(form["batch"][0])), {}
+        if not segments:
+            return 400, {"error": {"message": "Unknown path", "code": 100}}, {}
+
+        node = segments[0]
+        account_id = node if node.startswith("act_") else self.reports.get(node, {}).get("account_id")
+        if account_id is None:
+            return 404, {"error": {"message": f"Unknown object {node}", "code": 100}}, {}
+
+        failure = self.draw_failure()
+        if failure == "timeout":
+            time.sleep(self.timeout_seconds)
+        elif failure:
+            return self.failure_response(failure, account_id)
+
+        if len(segments) == 1 and method == "GET":
+            return self.report_status(node)
+        if segments[1:] == ["insights"]:
+            if method == "POST":
+                return self.create_report(account_id, form or {})
+            time_range = (
+                json.loads(query["time_range"][0])
+                if node.startswith("act_")
+                else self.reports[node]["time_range"]
+            )
+            return self.insights_page(parts.path, query, account_id, time_range)
+        return 400, {"error": {"message": "Unsupported request", "code": 100}}, {}
+
+    def batch(self, items):
+        results = []
+        for item in items[:50]:
+            status, body, headers = self.route(
+                item.get("method", "GET"), "/" + item["relative_url"].lstrip("/")
+            )
+            results.append(
+                {
+                    "code": status,
+                    "headers": [{"name": k, "value": v} for k, v in headers.items()],
+                    "body": json.dumps(body),
+                }
+            )
+        return results
+
+
+def _cursor(offset):
+    return base64.b64encode(str(offset).encode()).decode()
+
+
+def _force_regain(headers, account_id, minutes):
+    usage = json.loads(headers["x-business-use-case-usage"])
+    for entry in usage[account_id.replace("act_", "")]:
+        entry["call_count"] = 100
+        entry["estimated_time_to_regain_access"] = minutes
+    headers["x-business-use-case-usage"] = json.dumps(usage)
+    return headers
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, method, form=None):
+            if api.latency:
+                time.sleep(api.latency)
+            status, body, headers = api.route(method, self.path, form)
+            payload = json.dumps(body).encode("utf-8")
+            etag = '"%s"' % hashlib.md5(payload).hexdigest()
+            try:
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("ETag", etag)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # Cliente desistiu (ex.: timeout simulado)
+                pass
+
+        def do_GET(self):
+            self._respond("GET")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            self._respond("POST", form)
+
+    return Handler
+
+
+def serve(api, host="127.0.0.1", port=8765):
+    """Cria o servidor (sem iniciar) e ajusta a URL usada no paging.next"""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    api.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def start_in_thread(api, host="127.0.0.1", port=0, api_version="v21.0"):
+    """Sobe o servidor numa thread (porta 0 = livre). Retorna (server, GRAPH_BASE_URL)"""
+    server = serve(api, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{api.base_url}/{api_version}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graph API falsa para testes locais")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rows-per-day", type=int, default=50, help="Linhas por conta/dia")
+    parser.add_argument("--latency", type=float, default=0.0, help="Atraso por requisição (s)")
+    parser.add_argument("--report-seconds", type=float, default=3.0, help="Duração dos relatórios assíncronos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Taxa de erro 17")
+    parser.add_argument("--ads-throttle-rate", type=float, default=0.0, help="Taxa de erro 80000")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Taxa de 500/503")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Taxa de respostas que travam")
+    parser.add_argument("--timeout-seconds", type=float, default=90.0)
+    parser.add_argument("--calls-per-minute", type=int, default=600, help="Capacidade por conta (100%% de uso)")
+    parser.add_argument("--regain-minutes", type=int, default=1, help="Pausa informada nos erros de throttling")
+    parser.add_argument("--row-latency", type=float, default=0.0, help="Atraso por linha pedida no limit (s)")
+    parser.add_argument("--max-limit", type=int, help="Maior limit aceito antes de pedir menos dados")
+    args = parser.parse_args()
+
+    api = FakeGraphAPI(
+        rows_per_day=args.rows_per_day,
+        latency=args.latency,
+        report_seconds=args.report_seconds,
+        seed=args.seed,
+        throttle_rate=args.throttle_rate,
+        ads_throttle_rate=args.ads_throttle_rate,
+        server_error_rate=args.server_error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        calls_per_minute=args.calls_per_minute,
+        regain_minutes=args.regain_minutes,
+        row_latency=args.row_latency,
+        max_limit=args.max_limit,
+    )
+    server = serve(api, args.host, args.port)
+    print(f"🧪 Graph API falsa em {api.base_url}/v21.0 (Ctrl+C para sair)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
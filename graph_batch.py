@@ -0,0 +1,224 @@
+"""
+Transporte via Batch API da Graph API (POST /?batch=[...]).
+
+Até 50 requisições GET independentes (primeiras páginas de vários shards,
+de várias contas) vão numa única chamada HTTP. Cada item da resposta é
+entregue ao job dono dele; quando o item traz paging.next, a próxima página
+do job entra num dos lotes seguintes. Itens com erro transitório ou de
+throttling voltam para a fila sem afetar os demais; as tentativas contam
+por página e zeram a cada página lida. Quando o POST do lote inteiro falha
+(rede ou 5xx), todos os itens voltam para a fila como uma tentativa, sem
+mexer no limit.
+
+Com um PageSizeController (page_size.py), cada item sai com o limit atual
+da conta. O lote não tem latência por item: o limit cresce com páginas
+cheias e cai nos itens sem resposta (null) ou com "reduce the amount of
+data".
+"""
+
+import json
+import time
+import logging
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import metrics
+from graph_client import is_reduce_data_error, is_transient_error
+from page_size import with_limit
+from rate_limit import is_throttle_error
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 50
+
+
+class BatchItemResponse:
+    """Item da resposta em lote com a interface usada pelo rate_limit.py"""
+
+    def __init__(self, item):
+        self.status_code = item.get("code", 500)
+        self.text = item.get("body") or ""
+        self.headers = {
+            header["name"].lower(): header["value"]
+            for header in item.get("headers") or []
+        }
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def relative_url(client, url):
+    """Converte paging.next (URL absoluta) em relative_url, sem o token"""
+    parts = urlsplit(url)
+    base_path = urlsplit(client.base_url).path
+    path = parts.path[len(base_path):] if parts.path.startswith(base_path) else parts.path
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "access_token"]
+    return f"{path.lstrip('/')}?{urlencode(query)}"
+
+
+def run_batched(
+    client,
+    jobs,
+    on_page,
+    on_finish,
+    on_error,
+    governor,
+    executor=None,
+    batch_size=MAX_BATCH_SIZE,
+    max_attempts=3,
+    stop=None,
+    page_sizes=None,
+):
+    """
+    Cada job é um dict com "account_id" e "relative_url" (primeira página).
+    on_page(job, page, rows) recebe cada página, on_finish(job) é chamado
+    após a última e on_error(job, message) quando o job é abandonado (uma
+    mesma página falhou `max_attempts` vezes ou deu erro permanente).
+    Com um executor, os itens de um mesmo lote são processados em paralelo
+    (cada job aparece no máximo uma vez por lote). Um "usage"
+    (graph_client.ApiUsage) no job acumula o custo dos itens dele.
+    Em on_page, job["next_url"] já aponta para a página seguinte (None na
+    última) e job["started"] (time.monotonic()) marca o primeiro lote em que
+    o job entrou. Com `stop` (threading.Event) sinalizado, nenhum lote novo sai.
+    `page_sizes` (page_size.PageSizeController) ajusta o limit de cada item.
+    """
+    queue = deque()
+    for job in jobs:
+        job.update(next_url=job["relative_url"], page=0, attempts=0, started=None)
+        queue.append(job)
+
+    while queue and not (stop and stop.is_set()):
+        batch, deferred = [], deque()
+        while queue and len(batch) < min(batch_size, MAX_BATCH_SIZE):
+            job = queue.popleft()
+            if governor.delay_for(job["account_id"]) > 0:
+                deferred.append(job)
+            else:
+                batch.append(job)
+        queue.extend(deferred)
+
+        for job in batch:
+            if job["started"] is None:
+                job["started"] = time.monotonic()
+            if page_sizes:
+                job["limit"] = page_sizes.size(job["account_id"])
+                job["next_url"] = with_limit(job["next_url"], job["limit"])
+
+        if not batch:
+            # Todas as contas pendentes estão em pausa de rate limit
+            delay = min(governor.delay_for(job["account_id"]) for job in queue)
+            if stop:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+            continue
+
+        try:
+            response = client.post(
+                "",
+                data={
+                    "batch": json.dumps(
+                        [{"method": "GET", "relative_url": job["next_url"]} for job in batch]
+                    ),
+                    "include_headers": "true",
+                },
+            )
+            results = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            logger.error(f"❌ Erro na chamada em lote: {e}")
+            results = None
+
+        if not isinstance(results, list):
+            # Falha do transporte, não do volume pedido: o limit fica como está
+            logger.error(f"❌ Lote de {len(batch)} itens falhou por completo")
+            for job in batch:
+                if _retry(job, "lote falhou", on_error, max_attempts):
+                    queue.append(job)
+            continue
+
+        def handle(pair):
+            job, result = pair
+            return _handle_item(
+                job,
+                result,
+                client,
+                governor,
+                on_page,
+                on_finish,
+                on_error,
+                max_attempts,
+                page_sizes,
+            )
+
+        pairs = list(zip(batch, results))
+        outcomes = executor.map(handle, pairs) if executor else map(handle, pairs)
+        for job, keep in zip(batch, outcomes):
+            if keep:
+                queue.append(job)
+
+
+def _handle_item(
+    job, result, client, governor, on_page, on_finish, on_error, max_attempts, page_sizes=None
+):
+    """Processa um item do lote. Retorna True se o job volta para a fila."""
+    account_id = job["account_id"]
+
+    if result is None:
+        # A Graph API devolve null para itens que não terminaram a tempo
+        metrics.API_REQUESTS.labels("BATCH_ITEM", "null").inc()
+        if page_sizes:
+            page_sizes.shrink(account_id, job["limit"], "item do lote sem resposta")
+        return _retry(job, "item sem resposta (timeout)", on_error, max_attempts)
+
+    item = BatchItemResponse(result)
+    metrics.observe_api_response("BATCH_ITEM", item)
+    if job.get("usage"):
+        job["usage"].record(item)
+    if item.status_code != 200:
+        if is_throttle_error(item):
+            governor.handle_throttle_error(account_id, item)
+            return True
+        if page_sizes and is_reduce_data_error(item):
+            # Com limit menor não conta como tentativa; no mínimo, vira erro
+            if page_sizes.shrink(account_id, job["limit"], "a Meta pediu menos dados") < job["limit"]:
+                return True
+        if is_transient_error(item):
+            return _retry(job, f"HTTP {item.status_code}", on_error, max_attempts)
+        on_error(job, item.text)
+        return False
+
+    governor.observe(account_id, item.headers)
+    try:
+        data = item.json()
+        if page_sizes:
+            page_sizes.observe(
+                account_id, job["limit"], len(data.get("data", [])), None, len(item.content)
+            )
+        job["page"] += 1
+        job["attempts"] = 0
+        next_url = data.get("paging", {}).get("next")
+        job["next_url"] = relative_url(client, next_url) if next_url else None
+        on_page(job, job["page"], data.get("data", []))
+        if next_url:
+            return True
+        on_finish(job)
+    except Exception as e:
+        on_error(job, str(e))
+    return False
+
+
+def _retry(job, reason, on_error, max_attempts):
+    job["attempts"] += 1
+    if job.get("usage"):
+        job["usage"].retry()
+    if job["attempts"] >= max_attempts:
+        on_error(job, f"{reason} após {job['attempts']} tentativas")
+        return False
+    logger.warning(
+        f"🔁 {job['account_id']}: {reason} - item volta para o próximo lote"
+    )
+    return True
@@ -0,0 +1,242 @@
+"""
+Cliente HTTP compartilhado para a Graph API da Meta.
+
+- Sessão keep-alive com pool de conexões (evita um handshake TLS por página)
+- Respostas comprimidas (gzip)
+- Retry com backoff exponencial e jitter para GETs (idempotentes) em
+  falhas de rede, timeouts, 5xx e erros transitórios da Graph API
+- Latência, status e códigos de erro de cada chamada registrados para
+  diagnóstico e nas métricas Prometheus (metrics.py)
+- Integração opcional com o RateLimitGovernor (rate_limit.py)
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import governed_request, parse_usage_headers
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# Códigos de erro da Graph API marcados como temporários (API Unknown/Service)
+TRANSIENT_ERROR_CODES = (1, 2)
+
+
+def is_reduce_data_error(response):
+    """
+    "Please reduce the amount of data you're asking for": a mesma página
+    falha de novo com o mesmo limit (ver page_size.py)
+    """
+    if response.status_code in (200, 304):
+        return False
+    try:
+        message = response.json().get("error", {}).get("message") or ""
+    except ValueError:
+        return False
+    return "reduce the amount of data" in message
+
+
+def is_transient_error(response):
+    """5xx ou erro da Graph API marcado como temporário"""
+    if response.status_code in (200, 304) or is_reduce_data_error(response):
+        return False
+    if response.status_code in RETRY_STATUS_CODES:
+        return True
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return False
+    return error.get("code") in TRANSIENT_ERROR_CODES or bool(
+        error.get("is_transient")
+    )
+
+
+class ApiUsage:
+    """
+    Custo de API de um shard (histórico em etl_run_items): chamadas, bytes
+    recebidos (já descomprimidos), retries e pico de utilização informado
+    nos cabeçalhos de uso.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.retries = 0
+        self.peak_pct = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        usage = parse_usage_headers(response.headers)
+        pct = max(usage["app_pct"] or 0.0, usage["acc_pct"] or 0.0)
+        with self._lock:
+            self.calls += 1
+            self.bytes += len(response.content or b"")
+            self.peak_pct = max(self.peak_pct, pct)
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "api_calls": self.calls,
+                "bytes": self.bytes,
+                "retries": self.retries,
+                "peak_throttle_pct": self.peak_pct,
+            }
+
+
+class GraphClient:
+    def __init__(
+        self,
+        access_token,
+        api_version="v21.0",
+        base_url=None,
+        governor=None,
+        pool_size=10,
+        max_retries=4,
+        backoff_seconds=1.0,
+        timeout=60,
+    ):
+        self.access_token = access_token
+        self.base_url = base_url or f"https://graph.facebook.com/{api_version}"
+        self.governor = governor
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+        self.latencies = deque(maxlen=1000)
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        """Aceita caminho relativo (act_X/insights) ou URL completa (paging.next)"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _with_token(self, url, values):
+        values = dict(values or {})
+        if "access_token=" not in url:
+            values.setdefault("access_token", self.access_token)
+        return values
+
+    def get(
+        self,
+        path,
+        params=None,
+        account_id=None,
+        timeout=None,
+        headers=None,
+        usage=None,
+        retry_timeouts=True,
+    ):
+        # Com If-None-Match em `headers`, 304 volta como resposta normal (sem corpo).
+        # retry_timeouts=False devolve o Timeout na hora para quem ajusta o limit
+        url = self.url(path)
+        params = self._with_token(url, params)
+        return self._governed(
+            account_id,
+            lambda: self._send(
+                "GET",
+                url,
+                retry=True,
+                params=params,
+                timeout=timeout,
+                headers=headers,
+                usage=usage,
+                retry_timeouts=retry_timeouts,
+            ),
+        )
+
+    def post(self, path, data=None, account_id=None, timeout=None, usage=None):
+        # POST cria objetos (ex.: report runs) e não é repetido automaticamente
+        url = self.url(path)
+        data = self._with_token(url, data)
+        return self._governed(
+            account_id,
+            lambda: self._send(
+                "POST", url, retry=False, data=data, timeout=timeout, usage=usage
+            ),
+        )
+
+    def _governed(self, account_id, send):
+        if self.governor and account_id:
+            return governed_request(self.governor, account_id, send)
+        return send()
+
+    def _send(
+        self, method, url, retry, timeout=None, usage=None, retry_timeouts=True, **kwargs
+    ):
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            started = time.monotonic()
+            try:
+                response = self.session.request(
+                    method, url, timeout=timeout or self.timeout, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(time.monotonic() - started)
+                metrics.API_REQUESTS.labels(method, type(e).__name__).inc()
+                if attempt == attempts - 1 or (
+                    isinstance(e, requests.Timeout) and not retry_timeouts
+                ):
+                    raise
+                if usage:
+                    usage.retry()
+                self._sleep_before_retry(attempt, f"{type(e).__name__}")
+                continue
+
+            self._record(time.monotonic() - started)
+            metrics.observe_api_response(method, response)
+            if usage:
+                usage.record(response)
+            if attempt < attempts - 1 and is_transient_error(response):
+                if usage:
+                    usage.retry()
+                self._sleep_before_retry(attempt, f"HTTP {response.status_code}")
+                continue
+            return response
+
+    def _sleep_before_retry(self, attempt, reason):
+        delay = self.backoff_seconds * (2**attempt) * random.uniform(0.5, 1.5)
+        with self._lock:
+            self.retries += 1
+        metrics.API_RETRIES.labels(reason).inc()
+        logger.warning(f"🔁 {reason} - nova tentativa em {delay:.1f}s")
+        time.sleep(delay)
+
+    def _record(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(seconds)
+        metrics.API_LATENCY.observe(seconds)
+
+    def latency_stats(self):
+        """Resumo das últimas latências (segundos): média e p95"""
+        with self._lock:
+            values = sorted(self.latencies)
+            calls, retries = self.calls, self.retries
+        if not values:
+            return {"calls": calls, "retries": retries, "avg": 0.0, "p95": 0.0}
+        return {
+            "calls": calls,
+            "retries": retries,
+            "avg": sum(values) / len(values),
+            "p95": values[int(0.95 * (len(values) - 1))],
+        }
@@ -0,0 +1,237 @@
+"""
+Fila de shards no Postgres (etl_jobs) para rodar o ETL em várias réplicas.
+
+Com JOB_QUEUE=true, a execução planejada pela agenda não extrai nada: ela
+enfileira um job por shard (conta, since, until) e espera. Qualquer réplica
+rodando o worker pega jobs com FOR UPDATE SKIP LOCKED (duas réplicas nunca
+pegam o mesmo), extrai/carrega/publica pelo caminho normal e grava as
+estatísticas do shard no próprio job.
+
+- Lease: o job pego fica com o worker até lease_until, renovado por um
+  heartbeat enquanto ele roda.
+- Reclaim: job "running" com lease vencido (réplica morta, OOM, deploy)
+  volta para "pending" e segue do checkpoint em outra réplica; depois de
+  max_attempts tentativas vira "erro".
+- Dono: cada página e a publicação do shard travam a linha do job e
+  conferem se ele ainda é do worker (LeaseLost, senão). Um worker que
+  perdeu o lease (heartbeat falhou, processo travado) não grava por cima
+  de quem assumiu o job.
+- Um shard só pode estar na fila uma vez (índice único parcial em
+  pending/running): reenfileirar o que já está na fila não duplica nada.
+"""
+
+import json
+
+from sqlalchemy import text
+
+
+class LeaseLost(Exception):
+    """O job voltou para a fila (lease vencido) e não é mais deste worker"""
+
+
+_COLUMNS = (
+    "job_id, run_id, account_id, since, until, conditional, priority, expected_seconds, "
+    "status, attempts, max_attempts, worker_id, lease_until, started_at, finished_at, result"
+)
+
+
+def enqueue(conn, run_id, tasks, max_attempts=3):
+    """
+    Enfileira os shards (tarefas de main.plan_tasks). Retorna os job_ids
+    criados e os dos shards que já estavam na fila, para a execução esperar
+    por eles também.
+    """
+    created, existing = [], []
+    for task in tasks:
+        params = {
+            "run": run_id,
+            "acc": task["account_id"],
+            "s": task["since"],
+            "u": task["until"],
+            "conditional": task.get("conditional", False),
+            "priority": task.get("priority", 0),
+            "expected": round(task.get("expected_seconds", 0), 1),
+            "max_attempts": max_attempts,
+        }
+        row = conn.execute(
+            text(
+                "INSERT INTO etl_jobs (run_id, account_id, since, until, conditional, "
+                "priority, expected_seconds, max_attempts) VALUES (:run, :acc, :s, :u, "
+                ":conditional, :priority, :expected, :max_attempts) "
+                "ON CONFLICT (account_id, since, until) "
+                "WHERE status IN ('pending', 'running') DO NOTHING RETURNING job_id"
+            ),
+            params,
+        ).fetchone()
+        if row:
+            created.append(row[0])
+            continue
+        row = conn.execute(
+            text(
+                "SELECT job_id FROM etl_jobs WHERE account_id = :acc AND since = :s "
+                "AND until = :u AND status IN ('pending', 'running')"
+            ),
+            params,
+        ).fetchone()
+        # Sem linha: o job terminou entre o INSERT e o SELECT
+        if row:
+            existing.append(row[0])
+    return created, existing
+
+
+def claim(conn, worker_id, limit, lease_seconds):
+    """
+    Pega até `limit` jobs pendentes: maior prioridade primeiro e, nela, os
+    mais longos pela estimativa do histórico (LPT), para os shards grandes
+    não ficarem para o fim.
+    """
+    rows = conn.execute(
+        text(
+            "UPDATE etl_jobs j SET status = 'running', worker_id = :worker, "
+            "attempts = j.attempts + 1, started_at = CURRENT_TIMESTAMP, "
+            "lease_until = CURRENT_TIMESTAMP + make_interval(secs => :lease) "
+            "FROM (SELECT job_id FROM etl_jobs WHERE status = 'pending' "
+            "ORDER BY priority DESC, expected_seconds DESC, job_id "
+            "LIMIT :limit FOR UPDATE SKIP LOCKED) c "
+            "WHERE j.job_id = c.job_id "
+            "RETURNING j.job_id, j.run_id, j.account_id, j.since, j.until, "
+            "j.conditional, j.attempts"
+        ),
+        {"worker": worker_id, "limit": limit, "lease": lease_seconds},
+    ).mappings().all()
+    return sorted((dict(row) for row in rows), key=lambda job: job["job_id"])
+
+
+def heartbeat(conn, worker_id, jobs, lease_seconds):
+    """
+    Renova o lease dos jobs em andamento (dicts de claim); retorna os
+    job_ids que ainda são deste worker. `attempts` distingue o lease atual
+    de um job que voltou para a fila e foi pego de novo pelo mesmo worker.
+    """
+    rows = conn.execute(
+        text(
+            "UPDATE etl_jobs SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => :lease) "
+            "FROM unnest(CAST(:ids AS BIGINT[]), CAST(:attempts AS INTEGER[])) "
+            "AS mine(id, attempts) "
+            "WHERE job_id = mine.id AND etl_jobs.attempts = mine.attempts "
+            "AND worker_id = :worker AND status = 'running' RETURNING job_id"
+        ),
+        {
+            "ids": [job["job_id"] for job in jobs],
+            "attempts": [job["attempts"] for job in jobs],
+            "worker": worker_id,
+            "lease": lease_seconds,
+        },
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def lock_owned(conn, job, worker_id):
+    """
+    Trava a linha do job até o fim da transação (o reclaim a pula) e lança
+    LeaseLost se ele não é mais deste worker: a transação é desfeita.
+    """
+    owned = conn.execute(
+        text(
+            "SELECT 1 FROM etl_jobs WHERE job_id = :id AND attempts = :attempts "
+            "AND worker_id = :worker AND status = 'running' FOR UPDATE"
+        ),
+        {"id": job["job_id"], "attempts": job["attempts"], "worker": worker_id},
+    ).fetchone()
+    if not owned:
+        raise LeaseLost(job["job_id"])
+
+
+def finish(conn, job, worker_id, status, result):
+    """
+    Fecha o job com o status do shard e as estatísticas em `result`. Um
+    shard "cancelado" (SIGTERM) volta para a fila sem gastar tentativa.
+    Retorna False se o job não era mais deste worker (lease perdido).
+    """
+    updated = conn.execute(
+        text(
+            "UPDATE etl_jobs SET "
+            "status = CASE WHEN :status = 'cancelado' THEN 'pending' ELSE :status END, "
+            "attempts = CASE WHEN :status = 'cancelado' THEN attempts - 1 ELSE attempts END, "
+            "finished_at = CASE WHEN :status = 'cancelado' THEN NULL ELSE CURRENT_TIMESTAMP END, "
+            "worker_id = CASE WHEN :status = 'cancelado' THEN NULL ELSE worker_id END, "
+            "lease_until = NULL, result = CAST(:result AS JSONB) "
+            "WHERE job_id = :id AND attempts = :attempts AND worker_id = :worker "
+            "AND status = 'running'"
+        ),
+        {
+            "id": job["job_id"],
+            "attempts": job["attempts"],
+            "worker": worker_id,
+            "status": status,
+            "result": json.dumps(result, default=str),
+        },
+    )
+    return updated.rowcount > 0
+
+
+def reclaim_expired(conn):
+    """Devolve à fila os jobs com lease vencido; retorna (job, worker antigo)"""
+    return conn.execute(
+        text(
+            "UPDATE etl_jobs j SET worker_id = NULL, lease_until = NULL, "
+            "status = CASE WHEN j.attempts >= j.max_attempts THEN 'erro' ELSE 'pending' END, "
+            "finished_at = CASE WHEN j.attempts >= j.max_attempts THEN CURRENT_TIMESTAMP END "
+            "FROM (SELECT job_id, worker_id FROM etl_jobs WHERE status = 'running' "
+            "AND lease_until < CURRENT_TIMESTAMP FOR UPDATE SKIP LOCKED) old "
+            "WHERE j.job_id = old.job_id "
+            "RETURNING j.job_id, j.account_id, j.since, j.until, j.status, "
+            "old.worker_id AS previous_worker"
+        )
+    ).mappings().all()
+
+
+def count_active(conn, job_ids, worker_id=None):
+    """Jobs ainda na fila; com `worker_id`, só os que esse worker está rodando"""
+    if worker_id:
+        return conn.execute(
+            text(
+                "SELECT COUNT(*) FROM etl_jobs WHERE job_id = ANY(:ids) "
+                "AND status = 'running' AND worker_id = :worker"
+            ),
+            {"ids": list(job_ids), "worker": worker_id},
+        ).scalar()
+    return conn.execute(
+        text(
+            "SELECT COUNT(*) FROM etl_jobs WHERE job_id = ANY(:ids) "
+            "AND status IN ('pending', 'running')"
+        ),
+        {"ids": list(job_ids)},
+    ).scalar()
+
+
+def get_jobs(conn, job_ids):
+    rows = conn.execute(
+        text(f"SELECT {_COLUMNS} FROM etl_jobs WHERE job_id = ANY(:ids) ORDER BY job_id"),
+        {"ids": list(job_ids)},
+    ).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def queue_summary(conn):
+    """Jobs por status e worker (python main.py queue)"""
+    return conn.execute(
+        text(
+            "SELECT status, COALESCE(worker_id, '-') AS worker_id, COUNT(*) AS jobs, "
+            "MIN(enqueued_at) AS oldest, MAX(lease_until) AS lease_until "
+            "FROM etl_jobs WHERE status IN ('pending', 'running') "
+            "OR finished_at >= NOW() - INTERVAL '1 day' "
+            "GROUP BY 1, 2 ORDER BY 1, 2"
+        )
+    ).mappings().all()
+
+
+def purge_finished(conn, days=7):
+    """Apaga jobs terminados há mais de `days` dias (o histórico fica em etl_run_items)"""
+    return conn.execute(
+        text(
+            "DELETE FROM etl_jobs WHERE status NOT IN ('pending', 'running') "
+            "AND finished_at < NOW() - make_interval(days => :days)"
+        ),
+        {"days": days},
+    ).rowcount
@@ -0,0 +1,216 @@
+"""
+Zona de pouso (landing) das respostas brutas da API.
+
+Cada página extraída é gravada, como chegou, em JSONL comprimido com zstd:
+
+    <LANDING_DIR>/account_id=<conta>/date=<dia>/run=<execução>/<since>_<until>-p<página>.jsonl.zst
+
+As linhas de uma página são separadas pelo dia (date_start), então shards de
+vários dias caem nas partições diárias certas. Ao final da execução um
+manifesto (<LANDING_DIR>/manifests/run=<execução>.json) lista os shards, o
+status de cada um e seus arquivos, para que a transformação possa ser refeita
+sem chamar a API de novo (ver `latest_files` e o comando `replay`).
+
+A gravação roda numa thread própria, alimentada por uma fila limitada: a
+carga no banco não espera o disco, e a fila cheia só segura a extração se
+a gravação ficar para trás.
+"""
+
+import io
+import os
+import json
+import glob
+import queue
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = "manifests"
+
+
+def new_run_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+class LandingWriter:
+    def __init__(self, root, run_id=None, max_queue=100, level=3):
+        self.root = root
+        self.run_id = run_id or new_run_id()
+        self.level = level
+        self.shards = {}
+        self.errors = 0
+        self.started_at = datetime.now(timezone.utc)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(
+            target=self._run, name="landing-writer", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write_page(self, account_id, since, until, page, rows):
+        """Enfileira uma página bruta (bloqueia só com a fila cheia)"""
+        self._queue.put(("page", account_id, str(since), str(until), page, rows))
+
+    def finish_shard(self, account_id, since, until, status="ok"):
+        self._queue.put(("finish", account_id, str(since), str(until), status))
+
+    def close(self):
+        """Esvazia a fila, encerra a thread e grava o manifesto"""
+        self._queue.put(None)
+        self._thread.join()
+        return self._write_manifest()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == "page":
+                    self._write_page(*item[1:])
+                else:
+                    self._finish_shard(*item[1:])
+            except Exception as e:
+                # Falha no disco não pode derrubar a carga no banco, mas o
+                # shard fica fora do replay
+                self.errors += 1
+                self._shard(*item[1:4])["status"] = "erro"
+                logger.error(f"❌ Erro ao gravar landing ({item[1]}): {e}")
+
+    def _shard(self, account_id, since, until):
+        return self.shards.setdefault(
+            (account_id, since, until),
+            {
+                "account_id": account_id,
+                "since": since,
+                "until": until,
+                "status": "incompleto",
+                "pages": 0,
+                "rows": 0,
+                "files": [],
+            },
+        )
+
+    def _partition(self, account_id, day):
+        return os.path.join(
+            self.root, f"account_id={account_id}", f"date={day}", f"run={self.run_id}"
+        )
+
+    def _write_page(self, account_id, since, until, page, rows):
+        shard = self._shard(account_id, since, until)
+        if page == 1:
+            # Nova tentativa do shard: descarta as páginas da tentativa anterior
+            self._discard(account_id, since, until)
+            shard.update(status="incompleto", pages=0, rows=0, files=[])
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.get("date_start", since), []).append(row)
+
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        for day, day_rows in sorted(by_day.items()):
+            directory = self._partition(account_id, day)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{since}_{until}-p{page:05d}.jsonl.zst")
+            payload = "".join(
+                json.dumps(row, ensure_ascii=False) + "\n" for row in day_rows
+            )
+            with open(path, "wb") as f:
+                f.write(compressor.compress(payload.encode("utf-8")))
+            relative = os.path.relpath(path, self.root)
+            if relative not in shard["files"]:
+                # Página regravada ao retomar um shard na mesma execução
+                shard["files"].append(relative)
+        shard["pages"] = page
+        shard["rows"] += len(rows)
+
+    def _discard(self, account_id, since, until):
+        pattern = os.path.join(
+            self.root,
+            f"account_id={account_id}",
+            "date=*",
+            f"run={self.run_id}",
+            f"{since}_{until}-p*.jsonl.zst",
+        )
+        for path in glob.glob(pattern):
+            os.remove(path)
+
+    def _finish_shard(self, account_id, since, until, status):
+        shard = self._shard(account_id, since, until)
+        if shard["status"] != "erro":
+            shard["status"] = status
+
+    def _write_manifest(self):
+        directory = os.path.join(self.root, MANIFEST_DIR)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"run={self.run_id}.json")
+        manifest = {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "errors": self.errors,
+            "shards": sorted(
+                self.shards.values(),
+                key=lambda s: (s["account_id"], s["since"], s["until"]),
+            ),
+        }
+        # Grava e renomeia: um manifesto nunca fica pela metade
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+
+def read_rows(path):
+    """Lê em streaming as linhas (dicts) de um arquivo do landing"""
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        for line in io.TextIOWrapper(reader, encoding="utf-8"):
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_manifests(root):
+    manifests = {}
+    for path in glob.glob(os.path.join(root, MANIFEST_DIR, "run=*.json")):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifests[manifest["run_id"]] = manifest
+    return manifests
+
+
+def latest_files(root, accounts=None, since=None, until=None):
+    """
+    Arquivos a reprocessar por (conta, dia): os da execução mais recente em
+    que o shard que cobria o dia terminou com sucesso. Um dia coberto sem
+    arquivos (shard sem linhas naquele dia) volta com lista vazia. Execuções
+    sem manifesto (interrompidas) e shards incompletos são ignorados.
+    """
+    chosen = {}
+    for run_id, manifest in load_manifests(root).items():
+        for shard in manifest["shards"]:
+            if shard["status"] != "ok":
+                continue
+            account_id = shard["account_id"]
+            if accounts and account_id not in accounts:
+                continue
+            files_by_day = {}
+            for rel in shard["files"]:
+                day = rel.split(os.sep)[1].split("=", 1)[1]
+                files_by_day.setdefault(day, []).append(os.path.join(root, rel))
+
+            day = date.fromisoformat(shard["since"])
+            shard_until = date.fromisoformat(shard["until"])
+            while day <= shard_until:
+                if (not since or day >= since) and (not until or day <= until):
+                    key = (account_id, day)
+                    if key not in chosen or run_id > chosen[key][0]:
+                        chosen[key] = (run_id, sorted(files_by_day.get(str(day), [])))
+                day += timedelta(days=1)
+    return {key: files for key, (_, files) in sorted(chosen.items())}
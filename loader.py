@@ -0,0 +1,242 @@
+"""
+Estratégias de carga dos DataFrames transformados no PostgreSQL.
+
+- "copy"   (padrão): COPY ... FROM STDIN em CSV pelo psycopg2, sem montar SQL
+- "insert": DataFrame.to_sql(method="multi"), o caminho original
+
+As páginas são gravadas na tabela de staging (UNLOGGED) e a janela
+conta/período só é publicada em insights_meta_ads, numa transação curta,
+depois que a extração termina sem erro. A publicação pode ser:
+
+- "upsert"  (padrão): INSERT ... ON CONFLICT pela chave natural, gravando
+  só as linhas cujo row_hash mudou e removendo as que sumiram da API
+- "replace": apaga a janela e insere tudo de novo; com a tabela particionada
+  por mês (partitions.py), meses inteiros são esvaziados com TRUNCATE
+"""
+
+import io
+import threading
+
+from sqlalchemy import text
+
+import partitions
+
+LOAD_METHODS = ("copy", "insert")
+PUBLISH_MODES = ("upsert", "replace")
+
+TARGET_TABLE = "insights_meta_ads"
+STAGING_TABLE = "stg_insights_meta_ads"
+
+# Uma linha por anúncio/dia/posicionamento (índice único uq_insights_natural_key)
+NATURAL_KEY = ("account_id", "id_anuncio", "data_registro", "plataforma", "posicionamento")
+
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+TEXT_TYPES = ("character varying", "character", "text")
+
+_columns_cache = {}
+_cache_lock = threading.Lock()
+
+
+def table_columns(conn, table):
+    """{coluna: (tipo, aceita_nulo)} da tabela, cacheado por processo"""
+    with _cache_lock:
+        if table in _columns_cache:
+            return _columns_cache[table]
+    rows = conn.execute(
+        text(
+            "SELECT column_name, data_type, is_nullable = 'YES' "
+            "FROM information_schema.columns WHERE table_name = :t"
+        ),
+        {"t": table},
+    )
+    columns = {row[0]: (row[1], row[2]) for row in rows}
+    with _cache_lock:
+        _columns_cache[table] = columns
+    return columns
+
+
+def integer_columns(conn, table):
+    """Colunas inteiras da tabela, para formatar o CSV do COPY"""
+    return {
+        name
+        for name, (data_type, _) in table_columns(conn, table).items()
+        if data_type in INTEGER_TYPES
+    }
+
+
+def not_null_text_columns(conn, table):
+    """Colunas texto NOT NULL: no CSV do COPY, campo vazio não pode virar NULL"""
+    return {
+        name
+        for name, (data_type, nullable) in table_columns(conn, table).items()
+        if data_type in TEXT_TYPES and not nullable
+    }
+
+
+def has_row_hash(conn, table=None):
+    return "row_hash" in table_columns(conn, table or TARGET_TABLE)
+
+
+def copy_dataframe(conn, df, table):
+    """
+    Envia o DataFrame via COPY FROM STDIN usando a conexão (e a transação)
+    de `conn`. Métricas float destinadas a colunas inteiras são arredondadas,
+    já que o COPY não aceita "2.0" num INTEGER como o INSERT aceitava.
+    """
+    if df.empty:
+        return
+    ints = integer_columns(conn, table)
+    df = df.copy()
+    for col in df.columns:
+        if col in ints and df[col].dtype.kind == "f":
+            df[col] = df[col].round().astype("Int64")
+
+    buffer = io.BytesIO(df.to_csv(index=False, header=False).encode("utf-8"))
+
+    columns = ", ".join(df.columns)
+    options = "FORMAT csv, ENCODING 'UTF8'"
+    force_not_null = [col for col in df.columns if col in not_null_text_columns(conn, table)]
+    if force_not_null:
+        options += f", FORCE_NOT_NULL ({', '.join(force_not_null)})"
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH ({options})", buffer)
+    finally:
+        cursor.close()
+
+
+def insert_dataframe(conn, df, table):
+    df.to_sql(
+        table,
+        conn,
+        if_exists="append",
+        index=False,
+        method="multi",
+        chunksize=500,
+    )
+
+
+def load_dataframe(conn, df, table, method="copy"):
+    if method == "insert":
+        insert_dataframe(conn, df, table)
+    else:
+        copy_dataframe(conn, df, table)
+
+
+def ensure_partitions(conn, since, until):
+    return partitions.ensure_partitions(conn, TARGET_TABLE, since, until)
+
+
+def reset_staging(conn, account_id, since, until):
+    """Descarta sobras de execuções anteriores da mesma janela no staging"""
+    conn.execute(
+        text(
+            f"DELETE FROM {STAGING_TABLE} WHERE account_id = :acc "
+            "AND data_registro >= :s AND data_registro <= :u"
+        ),
+        {"acc": account_id, "s": since, "u": until},
+    )
+
+
+def publish_window(conn, account_id, since, until, columns, mode="upsert"):
+    """
+    Publica a janela do staging em insights_meta_ads e limpa o staging.
+    Deve rodar dentro de uma única transação: os leitores continuam vendo
+    os dados antigos até o commit. Retorna as contagens de linhas
+    inseridas, atualizadas, sem mudança e removidas.
+
+    Bancos sem row_hash (migração 002 não aplicada) usam sempre "replace".
+    """
+    params = {"acc": account_id, "s": since, "u": until}
+    if mode == "upsert" and has_row_hash(conn):
+        counts = _upsert_window(conn, params, columns)
+    else:
+        counts = _replace_window(conn, params, columns)
+    conn.execute(
+        text(
+            f"DELETE FROM {STAGING_TABLE} WHERE account_id = :acc "
+            "AND data_registro >= :s AND data_registro <= :u"
+        ),
+        params,
+    )
+    return counts
+
+
+def _row_hash(columns):
+    # Hash do conteúdo (fora a chave), calculado no banco com os tipos finais
+    values = [col for col in columns if col not in NATURAL_KEY]
+    return f"md5(ROW({', '.join(values)})::text)"
+
+
+def _upsert_window(conn, params, columns):
+    partitions.share_publish_lock(conn, TARGET_TABLE)
+    key = ", ".join(NATURAL_KEY)
+    cols = ", ".join(columns)
+    updates = ", ".join(
+        f"{col} = EXCLUDED.{col}" for col in columns if col not in NATURAL_KEY
+    )
+    same_key = " AND ".join(f"s.{col} = t.{col}" for col in NATURAL_KEY)
+
+    # Linhas que sumiram da API (ex.: anúncio sem entrega após reprocessamento)
+    deleted = conn.execute(
+        text(
+            f"DELETE FROM {TARGET_TABLE} t WHERE t.account_id = :acc "
+            "AND t.data_registro >= :s AND t.data_registro <= :u "
+            f"AND NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} s WHERE {same_key})"
+        ),
+        params,
+    ).rowcount
+
+    staged, existing, written = conn.execute(
+        text(
+            f"WITH src AS ("
+            f"  SELECT DISTINCT ON ({key}) {cols}, {_row_hash(columns)} AS row_hash"
+            f"  FROM {STAGING_TABLE} WHERE account_id = :acc"
+            f"  AND data_registro >= :s AND data_registro <= :u ORDER BY {key}"
+            f"), upserted AS ("
+            f"  INSERT INTO {TARGET_TABLE} AS t ({cols}, row_hash)"
+            f"  SELECT {cols}, row_hash FROM src"
+            f"  ON CONFLICT ({key}) DO UPDATE SET {updates},"
+            f"  row_hash = EXCLUDED.row_hash, updated_at = CURRENT_TIMESTAMP"
+            f"  WHERE t.row_hash IS DISTINCT FROM EXCLUDED.row_hash"
+            f"  RETURNING 1"
+            f") "
+            # Os CTEs leem o snapshot anterior ao INSERT: `existing` conta as
+            # chaves que já estavam publicadas (xmax não existe em tabela particionada)
+            f"SELECT (SELECT COUNT(*) FROM src), "
+            f"(SELECT COUNT(*) FROM src JOIN {TARGET_TABLE} USING ({key})), "
+            f"(SELECT COUNT(*) FROM upserted)"
+        ),
+        params,
+    ).fetchone()
+    inserted = staged - existing
+    updated = written - inserted
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": existing - updated,
+        "deleted": deleted,
+    }
+
+
+def _replace_window(conn, params, columns):
+    window = "account_id = :acc AND data_registro >= :s AND data_registro <= :u"
+    cols = ", ".join(columns)
+    target_cols, select_cols = cols, cols
+    if has_row_hash(conn):
+        target_cols += ", row_hash"
+        select_cols += f", {_row_hash(columns)}"
+    partitions.truncate_covered_partitions(
+        conn, TARGET_TABLE, params["acc"], params["s"], params["u"]
+    )
+    deleted = conn.execute(
+        text(f"DELETE FROM {TARGET_TABLE} WHERE {window}"), params
+    ).rowcount
+    inserted = conn.execute(
+        text(
+            f"INSERT INTO {TARGET_TABLE} ({target_cols}) "
+            f"SELECT {select_cols} FROM {STAGING_TABLE} WHERE {window}"
+        ),
+        params,
+    ).rowcount
+    return {"inserted": inserted, "updated": 0, "unchanged": 0, "deleted": deleted}
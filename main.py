@@ -1,15 +1,47 @@
 import os
 import time
-import requests
+import signal
+import socket
+import statistics
+import threading
+import numpy as np
 import pandas as pd
-import schedule
+import requests
 import logging
-from datetime import datetime, timedelta, timezone
-from sqlalchemy import create_engine, text
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import create_engine
 import json
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from itertools import repeat
+from urllib.parse import urlencode
+import async_reports
+import checkpoints
+import etag_cache
+import graph_batch
+import jobqueue
+import landing
+import loader
+import metrics
+import pipeline
+import planner
+import run_history
+import scheduler
+from graph_client import ApiUsage, GraphClient, is_reduce_data_error
+from page_size import PageSizeController, with_limit
+from rate_limit import RateLimitGovernor
 
 
 # --- CONFIGURAÇÃO DE LOGS (HORA BRASIL) ---
+BRAZIL_TZ = timezone(timedelta(hours=-3))
+
+
 class BrazilFormatter(logging.Formatter):
     def formatTime(self, record, datefmt=None):
         dt = datetime.fromtimestamp(record.created, timezone.utc) - timedelta(hours=3)
@@ -33,93 +65,369 @@ DB_PASS = os.getenv("DB_PASS")
 META_ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN")
 AD_ACCOUNT_ID_LIST = os.getenv("AD_ACCOUNTS", "").split(",")
 
+# "sync" pagina a borda /insights; "async" usa gerações de relatório (POST);
+# "batch" agrupa as páginas de vários shards em chamadas à Batch API
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "sync")
+MAX_ASYNC_REPORTS = int(os.getenv("MAX_ASYNC_REPORTS", "5"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "50"))
+# Quantas contas são extraídas/carregadas ao mesmo tempo
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+# Utilização (%) a partir da qual as chamadas passam a ser espaçadas
+RATE_LIMIT_SOFT_PCT = float(os.getenv("RATE_LIMIT_SOFT_PCT", "75"))
+RATE_LIMIT_HARD_PCT = float(os.getenv("RATE_LIMIT_HARD_PCT", "95"))
+# "copy" (COPY FROM STDIN) ou "insert" (to_sql multi, caminho antigo)
+LOAD_METHOD = os.getenv("LOAD_METHOD", "copy")
+# "upsert" (só grava linhas com row_hash diferente) ou "replace" (apaga e reinsere)
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "upsert")
+# Início do histórico (backfill) e dias reextraídos a cada execução
+BACKFILL_START = os.getenv("BACKFILL_START", "2025-12-01")
+ATTRIBUTION_LOOKBACK_DAYS = int(os.getenv("ATTRIBUTION_LOOKBACK_DAYS", "28"))
+# Divisão das janelas: day, week, adaptive (pelo histórico) ou none
+SHARD_MODE = os.getenv("SHARD_MODE", "adaptive")
+SHARD_TARGET_ROWS = int(os.getenv("SHARD_TARGET_ROWS", "5000"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+# Shards estimados abaixo disso nunca são divididos para equilibrar os workers
+SHARD_SPLIT_MIN_SECONDS = float(os.getenv("SHARD_SPLIT_MIN_SECONDS", "60"))
+# Agenda por conta (etl_schedules): cadência de contas novas, espalhamento e ciclo
+SCHEDULE_INTERVAL_MINUTES = int(os.getenv("SCHEDULE_INTERVAL_MINUTES", "240"))
+SCHEDULE_JITTER_SECONDS = int(os.getenv("SCHEDULE_JITTER_SECONDS", "300"))
+SCHEDULER_POLL_SECONDS = int(os.getenv("SCHEDULER_POLL_SECONDS", "60"))
+# Fila etl_jobs: a agenda só enfileira e as réplicas (worker) extraem os shards
+JOB_QUEUE = os.getenv("JOB_QUEUE", "false").lower() == "true"
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# Requisições condicionais (If-None-Match) para shards de página única
+ETAG_CACHE = os.getenv("ETAG_CACHE", "true").lower() == "true"
+# Páginas brutas em JSONL+zstd para reprocessar sem chamar a API (vazio desliga)
+LANDING_DIR = os.getenv("LANDING_DIR", "landing")
+LANDING_QUEUE_SIZE = int(os.getenv("LANDING_QUEUE_SIZE", "100"))
+# Limit da paginação de /insights: ponto de partida, faixa e latência alvo por página
+PAGE_SIZE_START = int(os.getenv("PAGE_SIZE_START", "25"))
+PAGE_SIZE_MIN = int(os.getenv("PAGE_SIZE_MIN", "5"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+PAGE_TARGET_SECONDS = float(os.getenv("PAGE_TARGET_SECONDS", "5"))
+# Páginas em espera entre busca, transformação e carga de cada shard
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+# Métricas Prometheus: porta do /metrics (0 desliga) e/ou arquivo .prom do node-exporter
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+
 API_VERSION = "v21.0"
-BASE_URL = f"https://graph.facebook.com/{API_VERSION}"
+# URL base da Graph API (ex.: http://localhost:8765/v21.0 com fake_graph_api.py)
+GRAPH_BASE_URL = os.getenv("GRAPH_BASE_URL")
 
 engine = create_engine(
-    f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+    pool_size=MAX_WORKERS,
+)
+
+governor = RateLimitGovernor(soft_pct=RATE_LIMIT_SOFT_PCT, hard_pct=RATE_LIMIT_HARD_PCT)
+page_sizes = PageSizeController(
+    start=PAGE_SIZE_START,
+    minimum=PAGE_SIZE_MIN,
+    maximum=PAGE_SIZE_MAX,
+    target_seconds=PAGE_TARGET_SECONDS,
+)
+graph = GraphClient(
+    META_ACCESS_TOKEN,
+    API_VERSION,
+    governor=governor,
+    pool_size=MAX_WORKERS,
+    base_url=GRAPH_BASE_URL or None,
 )
+# Aberto por run_etl quando LANDING_DIR está configurado
+landing_writer = None
+# Execução em andamento (etl_runs, landing e checkpoints)
+current_run_id = None
+# Sinalizado pelo SIGTERM: os shards param após a página em andamento
+SHUTDOWN = threading.Event()
 
 
-def get_date_range():
-    # Forçando o robô a buscar desde 01 de Dezembro até hoje
-    # Depois que ele rodar uma vez, você volta para a versão anterior
-    return "2025-12-01", datetime.today().strftime("%Y-%m-%d")
+def plan_tasks(accounts, full_refresh=False, since=None, lookback_days=None, priorities=None):
+    """
+    Uma tarefa por shard (conta, since, until). Incremental por padrão:
+    janela de atribuição + lacunas nunca carregadas, divididas conforme
+    SHARD_MODE (ver planner.py). `lookback_days` e `priorities` ({conta:
+    valor}, da agenda) substituem ATTRIBUTION_LOOKBACK_DAYS e a prioridade
+    na fila etl_jobs.
+    """
+    lookback_days = lookback_days or {}
+    priorities = priorities or {}
+    today = date.today()
+    backfill_start = planner.parse_date(since or BACKFILL_START)
+    tasks = []
+    if ETAG_CACHE and not full_refresh:
+        # Limit aprendido de cada conta: dimensiona os shards de página única
+        load_page_sizes()
+    # Transação: o planejamento também apaga os ETags que não serão mais usados
+    with engine.begin() as conn:
+        for account_id in accounts:
+            clean_id = normalize_account_id(account_id)
+            if full_refresh:
+                windows = [(backfill_start, today)]
+            else:
+                watermark = planner.get_watermark(conn, clean_id)
+                windows = planner.plan_windows(
+                    watermark,
+                    today,
+                    backfill_start,
+                    lookback_days.get(clean_id) or ATTRIBUTION_LOOKBACK_DAYS,
+                )
+                if ETAG_CACHE:
+                    # Chaves de antes da janela reextraída nunca mais são pedidas
+                    etag_cache.prune(conn, clean_id, windows[-1][0])
+            rows_per_day = None
+            if SHARD_MODE == "adaptive":
+                rows_per_day = planner.historical_rows_per_day(conn, clean_id)
+            days = planner.shard_days(SHARD_MODE, rows_per_day, SHARD_TARGET_ROWS)
+            recent_days = days
+            if ETAG_CACHE and not full_refresh and SHARD_MODE == "adaptive":
+                # O ETag só vale para shards de uma página: a janela de atribuição,
+                # reextraída a cada execução, vai em shards que cabem no limit da
+                # conta (com folga para os dias acima da média)
+                recent_days = planner.shard_days(
+                    SHARD_MODE,
+                    rows_per_day,
+                    min(SHARD_TARGET_ROWS, page_sizes.size(clean_id) * 3 // 4),
+                )
+            for window_since, window_until in windows:
+                window_days = recent_days if window_until == today else days
+                for shard_since, shard_until in planner.shard_window(
+                    window_since, window_until, window_days
+                ):
+                    tasks.append(
+                        {
+                            "account_id": clean_id,
+                            "since": shard_since,
+                            "until": shard_until,
+                            # O full refresh reescreve tudo, mesmo sem mudança na API
+                            "conditional": ETAG_CACHE and not full_refresh,
+                            "priority": priorities.get(clean_id, 0),
+                        }
+                    )
+    return tasks
 
 
-# def get_date_range():     # Versão anterior, voltar pra ele apartir de amanhã
-#     today = datetime.today()
-#     first = today.replace(day=1)
-#     previous_month = (first - timedelta(days=1)).replace(day=1)
-#     return previous_month.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+def ensure_partitions(since, until):
+    # Antes das threads de carga: criar partição bloqueia a tabela-mãe
+    with engine.begin() as conn:
+        created = loader.ensure_partitions(conn, since, until)
+    for name in created:
+        logger.info(f"🧱 Partição {name} criada")
 
 
-def clear_existing_data(account_id, since, until):
-    try:
-        with engine.begin() as conn:
-            conn.execute(
-                text(
-                    "DELETE FROM insights_meta_ads WHERE account_id = :acc AND data_registro >= :s AND data_registro <= :u"
-                ),
-                {"acc": account_id, "s": since, "u": until},
+def check_lease(conn, job):
+    # Shard da fila etl_jobs: só grava enquanto o job for deste worker
+    if job:
+        jobqueue.lock_owned(conn, job, WORKER_ID)
+
+
+def prepare_staging(account_id, since, until, job=None):
+    with engine.begin() as conn:
+        check_lease(conn, job)
+        loader.reset_staging(conn, account_id, since, until)
+        checkpoints.clear_overlapping(conn, account_id, since, until)
+
+
+def shard_signature(since, until):
+    # Checkpoints de outra consulta/mapeamento não são retomados
+    return etag_cache.query_signature(build_insights_params(since, until), ACTION_MAPPING)
+
+
+def load_checkpoint(account_id, since, until):
+    """Checkpoint do shard, se ainda vale para a consulta atual"""
+    with engine.begin() as conn:
+        checkpoint = checkpoints.get_checkpoint(conn, account_id, since, until)
+        if checkpoint and checkpoint["query_signature"] != shard_signature(since, until):
+            checkpoints.clear_checkpoint(conn, account_id, since, until)
+            logger.warning(
+                f"⚠️ Checkpoint de {account_id} [{since} a {until}] descartado: a consulta mudou"
             )
-        logger.info(f"🧹 Limpeza prévia realizada para a conta {account_id}")
-    except Exception as e:
-        logger.error(f"Erro ao limpar dados: {e}")
+            return None
+    return checkpoint
 
 
-def transform_and_load(raw_data_page, account_id):
-    if not raw_data_page:
-        return
+def page_checkpoint(account_id, since, until, next_url, pages, rows, report_run_id=None):
+    return {
+        "account_id": account_id,
+        "since": since,
+        "until": until,
+        "signature": shard_signature(since, until),
+        "run_id": current_run_id,
+        "next_url": next_url,
+        "pages": pages,
+        "rows": rows,
+        "report_run_id": report_run_id,
+    }
+
+
+def publish_window(
+    account_id, since, until, signature=None, etag=None, landing_status="ok", job=None
+):
+    # Troca a janela inteira numa transação: o dashboard nunca vê a janela vazia
+    started = time.monotonic()
+    with engine.begin() as conn:
+        check_lease(conn, job)
+        counts = loader.publish_window(
+            conn, account_id, since, until, FINAL_COLS, PUBLISH_MODE
+        )
+        planner.advance_watermark(conn, account_id, since, until)
+        if signature and etag:
+            etag_cache.save_etag(conn, account_id, since, until, signature, etag)
+        else:
+            etag_cache.forget_etag(conn, account_id, since, until, signature)
+        checkpoints.clear_checkpoint(conn, account_id, since, until)
+    if landing_writer:
+        landing_writer.finish_shard(account_id, since, until, landing_status)
+    seconds = time.monotonic() - started
+    metrics.STAGE_SECONDS.labels("publish").observe(seconds)
+    for name in PUBLISH_COUNTS:
+        metrics.PUBLISHED_ROWS.labels(name).inc(counts[name])
+    logger.info(
+        f"📤 Janela {since} a {until} publicada para a conta {account_id} "
+        f"(+{counts['inserted']} ~{counts['updated']} ={counts['unchanged']} "
+        f"-{counts['deleted']} em {seconds:.2f}s)"
+    )
+    return counts
+
+
+def keep_window(account_id, since, until):
+    # 304: a janela publicada continua valendo, só a marca d'água avança
+    with engine.begin() as conn:
+        planner.advance_watermark(conn, account_id, since, until)
+    logger.info(
+        f"♻️ Janela {since} a {until} sem alterações para a conta {account_id} (304)"
+    )
+
+
+# Mapeamento robusto baseado no diagnóstico de API realizado pelo Luan
+ACTION_MAPPING = {
+    "lead": [
+        "lead",
+        "onsite_conversion.lead_grouped",
+        "offsite_conversion.fb_pixel_lead",
+        "onsite_web_lead",
+        "onsite_conversion.lead",
+        "offsite_complete_registration_add_meta_leads",
+    ],
+    "lp_view": ["landing_page_view", "omni_landing_page_view"],
+    "conversas_iniciadas": ["onsite_conversion.messaging_conversation_started_7d"],
+    "novos_contatos_mensagem": ["onsite_conversion.messaging_first_reply"],
+    "compras": [
+        "purchase",
+        "onsite_web_purchase",
+        "offsite_conversion.fb_pixel_purchase",
+        "omni_purchase",
+    ],
+    "videoview_3s": ["video_view"],
+    "cliques_saida": ["outbound_click", "link_click"],
+}
+
+ACTION_COLUMNS = list(ACTION_MAPPING)
+
+# Índice invertido action_type -> posição da coluna de destino (consulta O(1))
+ACTION_TYPE_TO_COLUMN_INDEX = {
+    api_key: position
+    for position, api_keys in enumerate(ACTION_MAPPING.values())
+    for api_key in api_keys
+}
+
+COLUMN_RENAMES = {
+    "campaign_id": "id_campanha",
+    "campaign_name": "campanha",
+    "adset_id": "id_conjunto_anuncios",
+    "adset_name": "conjunto_anuncios",
+    "ad_id": "id_anuncio",
+    "ad_name": "anuncio",
+    "date_start": "data_registro",
+    "publisher_platform": "plataforma",
+    "platform_position": "posicionamento",
+    "spend": "valor_gasto",
+    "impressions": "impressoes",
+    "cliques_saida": "clique_link",  # Mapeado para clique_link no banco
+}
+
+FINAL_COLS = [
+    "account_id",
+    "nome_conta",
+    "id_campanha",
+    "id_conjunto_anuncios",
+    "id_anuncio",
+    "campanha",
+    "conjunto_anuncios",
+    "anuncio",
+    "impressoes",
+    "clique_link",
+    "lp_view",
+    "lead",
+    "contato",
+    "conversas_iniciadas",
+    "novos_contatos_mensagem",
+    "seguidores_instagram",
+    "visitas_perfil",
+    "initiate_checkout",
+    "compras",
+    "valor_compra",
+    "data_registro",
+    "videoview_3s",
+    "videoview_50",
+    "videoview_75",
+    "plataforma",
+    "posicionamento",
+    "valor_gasto",
+]
+
+
+def map_actions(df):
+    """
+    Soma os valores de `actions` em cada coluna de ACTION_MAPPING numa única
+    passada: explode as ações uma vez, traduz action_type pelo índice
+    invertido e agrega (linha, coluna) de todas as métricas num só bincount.
+    """
+    if "actions" not in df.columns:
+        df[ACTION_COLUMNS] = 0.0
+        return df
+
+    actions = df["actions"].explode().dropna()
+    positions = np.array(
+        [ACTION_TYPE_TO_COLUMN_INDEX.get(a.get("action_type"), -1) for a in actions],
+        dtype=np.int64,
+    )
+    matched = positions >= 0
+    values = np.array(
+        [a.get("value", 0) for a in actions[matched]], dtype=np.float64
+    )
+    rows = df.index.get_indexer(actions.index[matched])
+
+    n_cols = len(ACTION_COLUMNS)
+    sums = np.bincount(
+        rows * n_cols + positions[matched],
+        weights=values,
+        minlength=len(df) * n_cols,
+    ).reshape(len(df), n_cols)
+    df[ACTION_COLUMNS] = sums.astype(np.float64)
+    return df
+
+
+def transform_page(raw_data_page, account_id):
     df = pd.DataFrame(raw_data_page)
     df["account_id"] = account_id
     df["nome_conta"] = f"Conta {account_id}"
 
-    # Mapeamento robusto baseado no diagnóstico de API realizado pelo Luan
-    mapping = {
-        "lead": [
-            "lead",
-            "onsite_conversion.lead_grouped",
-            "offsite_conversion.fb_pixel_lead",
-            "onsite_web_lead",
-            "onsite_conversion.lead",
-            "offsite_complete_registration_add_meta_leads",
-        ],
-        "lp_view": ["landing_page_view", "omni_landing_page_view"],
-        "conversas_iniciadas": ["onsite_conversion.messaging_conversation_started_7d"],
-        "novos_contatos_mensagem": ["onsite_conversion.messaging_first_reply"],
-        "compras": [
-            "purchase",
-            "onsite_web_purchase",
-            "offsite_conversion.fb_pixel_purchase",
-            "omni_purchase",
-        ],
-        "videoview_3s": ["video_view"],
-        "cliques_saida": ["outbound_click", "link_click"],
-    }
-
     # Processamento de métricas numéricas simples
     for col in ["impressions", "spend"]:
         df[col] = pd.to_numeric(df.get(col, 0)).fillna(0)
 
     # Processamento de ações (Conversões) - Somando múltiplos tipos
-    if "actions" in df.columns:
-        for target_col, api_keys in mapping.items():
-            df[target_col] = df["actions"].apply(
-                lambda x: sum(
-                    [
-                        float(item.get("value", 0))
-                        for item in x
-                        if item.get("action_type") in api_keys
-                    ]
-                )
-                if isinstance(x, list)
-                else 0.0
-            )
-    else:
-        for target_col in mapping.keys():
-            df[target_col] = 0.0
+    map_actions(df)
+
+    return finalize_columns(df)
 
+
+def finalize_columns(df):
+    """Renomeia para os nomes do banco e devolve só FINAL_COLS, na ordem"""
     # Inicialização de colunas extras para manter compatibilidade com o banco
     df["valor_compra"] = 0.0
     df["videoview_50"] = 0.0
@@ -129,128 +437,1377 @@ def transform_and_load(raw_data_page, account_id):
     df["seguidores_instagram"] = 0.0
     df["visitas_perfil"] = 0.0
 
-    df.rename(
-        columns={
-            "campaign_id": "id_campanha",
-            "campaign_name": "campanha",
-            "adset_id": "id_conjunto_anuncios",
-            "adset_name": "conjunto_anuncios",
-            "ad_id": "id_anuncio",
-            "ad_name": "anuncio",
-            "date_start": "data_registro",
-            "publisher_platform": "plataforma",
-            "platform_position": "posicionamento",
-            "spend": "valor_gasto",
-            "impressions": "impressoes",
-            "cliques_saida": "clique_link",  # Mapeado para clique_link no banco
-        },
-        inplace=True,
-    )
-
-    final_cols = [
-        "account_id",
-        "nome_conta",
-        "id_campanha",
-        "id_conjunto_anuncios",
-        "id_anuncio",
-        "campanha",
-        "conjunto_anuncios",
-        "anuncio",
-        "impressoes",
-        "clique_link",
-        "lp_view",
-        "lead",
-        "contato",
-        "conversas_iniciadas",
-        "novos_contatos_mensagem",
-        "seguidores_instagram",
-        "visitas_perfil",
-        "initiate_checkout",
-        "compras",
-        "valor_compra",
-        "data_registro",
-        "videoview_3s",
-        "videoview_50",
-        "videoview_75",
-        "plataforma",
-        "posicionamento",
-        "valor_gasto",
-    ]
+    df.rename(columns=COLUMN_RENAMES, inplace=True)
 
-    for col in final_cols:
+    for col in FINAL_COLS:
         if col not in df.columns:
             df[col] = 0
 
+    # Fazem parte da chave natural (NOT NULL no banco)
+    df[["plataforma", "posicionamento"]] = df[["plataforma", "posicionamento"]].fillna("")
+
+    return df[FINAL_COLS]
+
+
+def load_dataframe(df, checkpoint=None, job=None):
+    # O checkpoint (page_checkpoint) vai na mesma transação da página
     try:
-        with engine.begin() as conn:
-            df[final_cols].to_sql(
-                "insights_meta_ads",
-                conn,
-                if_exists="append",
-                index=False,
-                method="multi",
-                chunksize=500,
-            )
+        with metrics.STAGE_SECONDS.labels("load").time(), engine.begin() as conn:
+            check_lease(conn, job)
+            loader.load_dataframe(conn, df, loader.STAGING_TABLE, LOAD_METHOD)
+            if checkpoint:
+                checkpoints.save_checkpoint(conn, **checkpoint)
+    except jobqueue.LeaseLost:
+        raise
     except Exception as e:
+        # Propaga para que a janela da conta não seja publicada incompleta
         logger.error(f"Erro ao salvar no banco: {e}")
+        raise
+
+
+def land_page(account_id, since, until, page, rows):
+    # Chamada também para páginas vazias: a página 1 reinicia o shard no landing
+    if landing_writer:
+        landing_writer.write_page(account_id, since, until, page, rows)
 
 
-def fetch_and_process(account_id, since, until):
+def transform_and_load(raw_data_page, account_id, checkpoint=None):
+    if not raw_data_page:
+        return
+    with metrics.STAGE_SECONDS.labels("transform").time():
+        df = transform_page(raw_data_page, account_id)
+    load_dataframe(df, checkpoint)
+
+
+def normalize_account_id(account_id):
     clean_id = account_id.strip()
     if not clean_id.startswith("act_"):
         clean_id = f"act_{clean_id}"
-    clear_existing_data(clean_id, since, until)
+    return clean_id
 
-    url = f"{BASE_URL}/{clean_id}/insights"
-    params = {
-        "access_token": META_ACCESS_TOKEN,
+
+def build_insights_params(since, until):
+    return {
         "level": "ad",
-        "time_range": json.dumps({"since": since, "until": until}),
+        "time_range": json.dumps({"since": str(since), "until": str(until)}),
         "time_increment": 1,
         "fields": "campaign_id,campaign_name,adset_id,adset_name,ad_id,ad_name,impressions,spend,actions",
         "breakdowns": "publisher_platform,platform_position",
-        "limit": 25,  # Mantido em 25 para evitar os timeouts que vimos na v2/v3
     }
 
-    page, total = 0, 0
+
+PUBLISH_COUNTS = ("inserted", "updated", "unchanged", "deleted")
+API_COUNTS = ("api_calls", "bytes", "retries")
+
+
+def new_account_stats(clean_id, since=None, until=None):
+    return {
+        "account_id": clean_id,
+        "since": since,
+        "until": until,
+        "started_at": datetime.now(timezone.utc),
+        "pages": 0,
+        "rows": 0,
+        "seconds": 0.0,
+        "attempts": 1,
+        "status": "ok",
+        **dict.fromkeys(PUBLISH_COUNTS, 0),
+        **ApiUsage().as_dict(),
+    }
+
+
+def stop_clock(stats, started):
+    """
+    Duração do shard desde o início dele (time.monotonic()), e não do lote
+    ou da execução: é o que entra em etl_run_items e estima os próximos.
+    """
+    stats["seconds"] = time.monotonic() - started if started is not None else 0.0
+    stats["started_at"] = datetime.now(timezone.utc) - timedelta(seconds=stats["seconds"])
+
+
+def add_api_usage(stats, usage):
+    """Soma o custo de API (ApiUsage.as_dict) às estatísticas do shard"""
+    for name in API_COUNTS:
+        stats[name] += usage[name]
+    stats["peak_throttle_pct"] = max(stats["peak_throttle_pct"], usage["peak_throttle_pct"])
+
+
+def fetch_insights_page(clean_id, url, params, headers, usage=None):
+    """
+    GET de uma página com o limit atual da conta (page_size.py). Timeout e
+    "reduce the amount of data" repetem a página com metade do limit, até
+    o mínimo; só no mínimo o timeout passa pelos retries do GraphClient.
+    Retorna a resposta e o corpo (None se não for 200).
+    """
     while True:
+        limit = page_sizes.size(clean_id)
+        if params:
+            params = {**params, "limit": limit}
+        else:
+            url = with_limit(url, limit)
+        retries = usage.retries if usage else 0
+        started = time.monotonic()
         try:
-            page += 1
-            response = requests.get(url, params=params, timeout=60)
-            if response.status_code != 200:
-                logger.error(f"❌ Erro API ({clean_id}): {response.text}")
-                break
-            data = response.json()
-            if "data" in data and len(data["data"]) > 0:
-                transform_and_load(data["data"], clean_id)
-                count = len(data["data"])
-                total += count
-                logger.info(
-                    f"   💾 Pág {page} salva (+{count} regs) | Total conta: {total}"
+            with metrics.STAGE_SECONDS.labels("fetch").time():
+                response = graph.get(
+                    url,
+                    params=params,
+                    account_id=clean_id,
+                    headers=headers,
+                    usage=usage,
+                    retry_timeouts=limit <= page_sizes.minimum,
+                )
+        except requests.Timeout:
+            if page_sizes.shrink(clean_id, limit, "timeout") < limit:
+                continue
+            raise
+        seconds = time.monotonic() - started
+        if is_reduce_data_error(response):
+            if page_sizes.shrink(clean_id, limit, "a Meta pediu menos dados") < limit:
+                continue
+        if response.status_code != 200:
+            return response, None
+        data = response.json()
+        page_sizes.observe(
+            clean_id,
+            limit,
+            len(data.get("data", [])),
+            seconds,
+            len(response.content),
+            retried=bool(usage) and usage.retries > retries,
+        )
+        return response, data
+
+
+def iter_insights_pages(clean_id, url, params, headers, state, usage=None):
+    """
+    Pagina a borda /insights (na thread de prefetch do pipeline) a partir de
+    `url` e da página state["page"], gerando (página, linhas, próxima URL).
+    O desfecho fica em `state`: "not_modified" (304), "complete" (última
+    página lida), "interrupted" (SIGTERM), "lease_lost" (job da fila
+    assumido por outro worker), "error_status" e "etag" (janela de página
+    única).
+    """
+    page = state["page"]
+    while True:
+        if SHUTDOWN.is_set():
+            state["interrupted"] = True
+            return
+        if state.get("job") and state["job"]["lease_lost"].is_set():
+            state["lease_lost"] = True
+            return
+        page += 1
+        state["page"] = page
+        response, data = fetch_insights_page(clean_id, url, params, headers, usage)
+        headers = {}
+        if response.status_code == 304:
+            state["not_modified"] = True
+            return
+        if response.status_code != 200:
+            logger.error(f"❌ Erro API ({clean_id}): {response.text}")
+            state["error_status"] = response.status_code
+            return
+        next_url = data.get("paging", {}).get("next")
+        if page == 1 and not next_url:
+            # O ETag só representa a janela inteira quando ela coube numa página
+            state["etag"] = response.headers.get("ETag")
+        yield page, data.get("data", []), next_url
+        if not next_url:
+            state["complete"] = True
+            return
+        url, params = next_url, {}
+
+
+def fetch_and_process(account_id, since, until, conditional=False, checkpoint=None, job=None):
+    """
+    Extrai, transforma e carrega um shard em pipeline: a próxima página já
+    está sendo buscada enquanto a anterior é transformada e gravada no
+    staging (ver pipeline.py). Com `checkpoint`, segue do cursor salvo sem
+    limpar o que já está no staging. Com `job` (run_worker), para assim que
+    o job deixa de ser deste worker.
+    """
+    clean_id = normalize_account_id(account_id)
+    stats = new_account_stats(clean_id, since, until)
+    started = time.monotonic()
+
+    # O limit entra página a página (fetch_insights_page) e fica fora da assinatura
+    params = build_insights_params(since, until)
+    signature = shard_signature(since, until)
+    url = f"{clean_id}/insights"
+    headers = {}
+    state = {"page": 0, "job": job}
+    usage = ApiUsage()
+    # Landing de uma execução anterior fica com as primeiras páginas: fora do replay
+    landing_status = "ok"
+
+    if checkpoint:
+        url, params = checkpoint["next_url"], {}
+        state["page"], stats["rows"] = checkpoint["pages"], checkpoint["rows"]
+        state["complete"] = url is None
+        if checkpoint["run_id"] != current_run_id:
+            landing_status = "retomado"
+        logger.info(
+            f"⏩ {clean_id} [{since} a {until}] retomado na pág {checkpoint['pages'] + 1} "
+            f"({checkpoint['rows']} regs já no staging)"
+        )
+    else:
+        prepare_staging(clean_id, since, until, job)
+        if conditional:
+            with engine.connect() as conn:
+                etag = etag_cache.get_etag(conn, clean_id, since, until, signature)
+            if etag:
+                headers["If-None-Match"] = etag
+
+    def transform(item):
+        page, rows, next_url = item
+        land_page(clean_id, since, until, page, rows)
+        metrics.record_page(clean_id, len(rows))
+        if not rows:
+            return None
+        with metrics.STAGE_SECONDS.labels("transform").time():
+            df = transform_page(rows, clean_id)
+        return page, len(rows), df, next_url
+
+    def load(item):
+        page, count, df, next_url = item
+        load_dataframe(
+            df,
+            page_checkpoint(clean_id, since, until, next_url, page, stats["rows"] + count),
+            job,
+        )
+        stats["rows"] += count
+        logger.info(
+            f"   💾 {clean_id} [{since} a {until}] Pág {page} salva (+{count} regs) | Total: {stats['rows']}"
+        )
+
+    try:
+        if not state.get("complete"):
+            pipeline.run_pipeline(
+                iter_insights_pages(clean_id, url, params, headers, state, usage),
+                [transform],
+                load,
+                queue_size=PIPELINE_QUEUE_SIZE,
+            )
+        stats["pages"] = state["page"]
+        if state.get("not_modified"):
+            keep_window(clean_id, since, until)
+        elif state.get("complete"):
+            stats.update(
+                publish_window(
+                    clean_id, since, until, signature, state.get("etag"), landing_status, job
                 )
+            )
+            logger.info(
+                f"🏁 Conta {clean_id} [{since} a {until}] finalizada. Total: {stats['rows']}"
+            )
+        elif state.get("interrupted"):
+            stats["status"] = "cancelado"
+            logger.warning(
+                f"🛑 {clean_id} [{since} a {until}] parado na pág {state['page']} - checkpoint salvo"
+            )
+        elif state.get("lease_lost"):
+            stats["status"] = "cancelado"
+            logger.warning(
+                f"🔒 {clean_id} [{since} a {until}] parado na pág {state['page']} - "
+                f"job {job['job_id']} assumido por outro worker"
+            )
+        else:
+            stats["status"] = "erro"
+            if checkpoint and state["page"] == checkpoint["pages"] + 1 and (
+                400 <= state.get("error_status", 0) < 500
+            ):
+                # Cursor expirado ou inválido: a próxima tentativa recomeça do zero
+                with engine.begin() as conn:
+                    checkpoints.clear_checkpoint(conn, clean_id, since, until)
+                logger.warning(f"⚠️ Cursor salvo de {clean_id} [{since} a {until}] rejeitado")
+    except jobqueue.LeaseLost:
+        # Página ou publicação desfeita: o job já é de outro worker
+        stats["status"] = "cancelado"
+        logger.warning(
+            f"🔒 {clean_id} [{since} a {until}] descartado na pág {state['page']} - "
+            f"job {job['job_id']} assumido por outro worker"
+        )
+    except Exception as e:
+        logger.error(
+            f"❌ Erro fatal ({clean_id} [{since} a {until}], {state['page']} págs lidas): {e}"
+        )
+        stats["status"] = "erro"
+
+    stats.update(usage.as_dict())
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+def fetch_async_reports(tasks, executor):
+    jobs = [
+        {
+            **task,
+            "params": build_insights_params(task["since"], task["until"]),
+            "usage": ApiUsage(),
+        }
+        for task in tasks
+    ]
+    summary = [
+        new_account_stats(job["account_id"], job["since"], job["until"])
+        for job in jobs
+    ]
+    for job, stats in zip(jobs, summary):
+        job["stats"] = stats
+        stats["status"] = "erro"  # vira "ok" quando o resultado é lido até o fim
+
+    def on_start(job):
+        prepare_staging(job["account_id"], job["since"], job["until"])
+        # Relatório pronto: um restart lê o resultado dele em vez de gerar outro
+        with engine.begin() as conn:
+            checkpoints.save_checkpoint(
+                conn,
+                **page_checkpoint(
+                    job["account_id"],
+                    job["since"],
+                    job["until"],
+                    job["next_url"],
+                    0,
+                    0,
+                    job["report_run_id"],
+                ),
+            )
+
+    def on_page(job, page, rows):
+        stats = job["stats"]
+        stats["pages"] = page
+        land_page(job["account_id"], job["since"], job["until"], page, rows)
+        metrics.record_page(job["account_id"], len(rows))
+        if rows:
+            transform_and_load(
+                rows,
+                job["account_id"],
+                page_checkpoint(
+                    job["account_id"],
+                    job["since"],
+                    job["until"],
+                    job["next_url"],
+                    page,
+                    stats["rows"] + len(rows),
+                    job["report_run_id"],
+                ),
+            )
+            stats["rows"] += len(rows)
+            logger.info(
+                f"   💾 {job['account_id']} [{job['since']} a {job['until']}] Pág {page} "
+                f"salva (+{len(rows)} regs) | Total: {stats['rows']}"
+            )
+
+    def on_finish(job):
+        stats = job["stats"]
+        stats.update(publish_window(job["account_id"], job["since"], job["until"]))
+        stats["status"] = "ok"
+        stop_clock(stats, job["started"])
+        logger.info(
+            f"🏁 Conta {job['account_id']} [{job['since']} a {job['until']}] "
+            f"finalizada. Total: {stats['rows']}"
+        )
+
+    pending = jobs
+    for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+        for job in pending:
+            job["stats"].update(pages=0, rows=0, attempts=attempt)
+        async_reports.run_report_runs(
+            graph,
+            pending,
+            on_start,
+            on_page,
+            on_finish,
+            max_in_flight=MAX_ASYNC_REPORTS,
+            executor=executor,
+            stop=SHUTDOWN,
+        )
+        pending = [job for job in pending if job["stats"]["status"] != "ok"]
+        if not pending or SHUTDOWN.is_set():
+            break
+        if attempt < SHARD_MAX_ATTEMPTS:
+            logger.warning(
+                f"🔁 {len(pending)} shards falharam (tentativa {attempt}/{SHARD_MAX_ATTEMPTS}) - recriando relatórios"
+            )
+    for job, stats in zip(jobs, summary):
+        stats.update(job["usage"].as_dict())
+        if stats["status"] != "ok":
+            stop_clock(stats, job.get("started"))
+            if SHUTDOWN.is_set():
+                stats["status"] = "cancelado"
+    return summary
+
+
+def fetch_batched(tasks, executor):
+    jobs = []
+    for task in tasks:
+        prepare_staging(task["account_id"], task["since"], task["until"])
+        params = {
+            **build_insights_params(task["since"], task["until"]),
+            "limit": page_sizes.size(task["account_id"]),
+        }
+        jobs.append(
+            {
+                **task,
+                "relative_url": f"{task['account_id']}/insights?{urlencode(params)}",
+                "stats": new_account_stats(task["account_id"], task["since"], task["until"]),
+                "usage": ApiUsage(),
+            }
+        )
+
+    def on_page(job, page, rows):
+        stats = job["stats"]
+        stats["pages"] = page
+        land_page(job["account_id"], job["since"], job["until"], page, rows)
+        metrics.record_page(job["account_id"], len(rows))
+        if rows:
+            transform_and_load(
+                rows,
+                job["account_id"],
+                page_checkpoint(
+                    job["account_id"],
+                    job["since"],
+                    job["until"],
+                    job["next_url"],
+                    page,
+                    stats["rows"] + len(rows),
+                ),
+            )
+            stats["rows"] += len(rows)
+            logger.info(
+                f"   💾 {job['account_id']} [{job['since']} a {job['until']}] Pág {page} "
+                f"salva (+{len(rows)} regs) | Total: {stats['rows']}"
+            )
+
+    def on_finish(job):
+        stats = job["stats"]
+        stats.update(publish_window(job["account_id"], job["since"], job["until"]))
+        stop_clock(stats, job["started"])
+        job["finished"] = True
+        logger.info(
+            f"🏁 Conta {job['account_id']} [{job['since']} a {job['until']}] "
+            f"finalizada. Total: {stats['rows']}"
+        )
+
+    def on_error(job, message):
+        logger.error(f"❌ Erro API ({job['account_id']}): {message}")
+        stats = job["stats"]
+        stats["status"] = "erro"
+        stop_clock(stats, job["started"])
+
+    pending = jobs
+    for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+        for job in pending:
+            if attempt > 1:
+                # Recomeça da primeira página: o staging parcial é descartado
+                prepare_staging(job["account_id"], job["since"], job["until"])
+            job["stats"].update(pages=0, rows=0, attempts=attempt, status="ok")
+        graph_batch.run_batched(
+            graph,
+            pending,
+            on_page,
+            on_finish,
+            on_error,
+            governor,
+            executor=executor,
+            batch_size=BATCH_SIZE,
+            max_attempts=SHARD_MAX_ATTEMPTS,
+            stop=SHUTDOWN,
+            page_sizes=page_sizes,
+        )
+        pending = [job for job in pending if job["stats"]["status"] == "erro"]
+        if not pending or SHUTDOWN.is_set() or attempt == SHARD_MAX_ATTEMPTS:
+            break
+        delay = 5 * 2 ** (attempt - 1)
+        logger.warning(
+            f"🔁 {len(pending)} shards falharam (tentativa {attempt}/{SHARD_MAX_ATTEMPTS}) - "
+            f"nova tentativa em {delay}s"
+        )
+        SHUTDOWN.wait(delay)
+        if SHUTDOWN.is_set():
+            break
+    for job in jobs:
+        stats = job["stats"]
+        stats.update(job["usage"].as_dict())
+        if stats["status"] == "ok" and not job.get("finished"):
+            # Parado pelo SIGTERM antes da última página
+            stats["status"] = "cancelado"
+            stop_clock(stats, job["started"])
+    return [job["stats"] for job in jobs]
+
+
+def fetch_with_retries(task):
+    """
+    Cada shard é repetido isoladamente, sem afetar os demais da conta. As
+    tentativas seguem do checkpoint da última página gravada, se houver.
+    """
+    # Job da fila etl_jobs (run_worker): para quando o lease é perdido
+    job = task if task.get("job_id") else None
+    # Custo de API das tentativas que falharam também entra no histórico
+    spent = ApiUsage().as_dict()
+    for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+        if SHUTDOWN.is_set() or (job and job["lease_lost"].is_set()):
+            stats = new_account_stats(task["account_id"], task["since"], task["until"])
+            stats.update(status="cancelado", attempts=attempt - 1)
+            add_api_usage(stats, spent)
+            return stats
+        try:
+            stats = fetch_and_process(
+                task["account_id"],
+                task["since"],
+                task["until"],
+                conditional=task.get("conditional", False),
+                checkpoint=load_checkpoint(task["account_id"], task["since"], task["until"]),
+                job=job,
+            )
+        except jobqueue.LeaseLost:
+            # Staging não foi preparado: o job já é de outro worker
+            logger.warning(
+                f"🔒 Job {job['job_id']} ({task['account_id']} [{task['since']} a "
+                f"{task['until']}]) assumido por outro worker antes de começar"
+            )
+            stats = new_account_stats(task["account_id"], task["since"], task["until"])
+            stats.update(status="cancelado", attempts=attempt)
+            add_api_usage(stats, spent)
+            return stats
+        stats["attempts"] = attempt
+        if stats["status"] != "erro" or attempt == SHARD_MAX_ATTEMPTS:
+            add_api_usage(stats, spent)
+            return stats
+        add_api_usage(spent, stats)
+        delay = 5 * 2 ** (attempt - 1)
+        logger.warning(
+            f"🔁 Shard {task['account_id']} [{task['since']} a {task['until']}] "
+            f"falhou (tentativa {attempt}/{SHARD_MAX_ATTEMPTS}) - nova tentativa em {delay}s"
+        )
+        SHUTDOWN.wait(delay)
+
+
+def fetch_tasks_concurrently(tasks, executor):
+    futures = {executor.submit(fetch_with_retries, task): task for task in tasks}
+    summary = []
+    for future in as_completed(futures):
+        task = futures[future]
+        try:
+            summary.append(future.result())
+        except Exception as e:
+            # Uma conta com falha não derruba as demais
+            logger.error(f"❌ Falha inesperada na conta {task['account_id']}: {e}")
+            stats = new_account_stats(task["account_id"], task["since"], task["until"])
+            stats["status"] = "erro"
+            summary.append(stats)
+    return summary
+
+
+def settle_watermarks(summary):
+    # Shards publicados fora de ordem entram na marca d'água quando o vizinho termina
+    published = {}
+    for stats in summary:
+        if stats["status"] == "ok":
+            published.setdefault(stats["account_id"], []).append(
+                (stats["since"], stats["until"])
+            )
+    with engine.begin() as conn:
+        for account_id, windows in published.items():
+            planner.settle_watermark(conn, account_id, windows)
+
+
+def summarize_by_account(summary):
+    """Agrupa as estatísticas das janelas de cada conta"""
+    accounts = {}
+    for stats in summary:
+        acc = accounts.setdefault(
+            stats["account_id"], new_account_stats(stats["account_id"])
+        )
+        acc["pages"] += stats["pages"]
+        acc["rows"] += stats["rows"]
+        acc["seconds"] += stats["seconds"]
+        for name in PUBLISH_COUNTS:
+            acc[name] += stats[name]
+        add_api_usage(acc, stats)
+        if stats["status"] != "ok":
+            acc["status"] = stats["status"]
+    return list(accounts.values())
 
-            if "paging" in data and "next" in data["paging"]:
-                url = data["paging"]["next"]
-                params = {}
+
+def log_run_summary(summary, seconds):
+    logger.info("📊 RESUMO DA EXECUÇÃO")
+    accounts = summarize_by_account(summary)
+    for stats in sorted(accounts, key=lambda s: s["seconds"], reverse=True):
+        logger.info(
+            f"   {stats['account_id']} | {stats['rows']} regs | {stats['pages']} págs | "
+            f"{stats['seconds']:.1f}s | {stats['status']}"
+        )
+    failed = sum(1 for stats in accounts if stats["status"] != "ok")
+    logger.info(
+        f"   Total: {sum(s['rows'] for s in accounts)} regs em {len(accounts)} contas "
+        f"({failed} com erro) | {seconds:.1f}s"
+    )
+    log_publish_counts(
+        {name: sum(s[name] for s in accounts) for name in PUBLISH_COUNTS}
+    )
+
+
+def log_publish_counts(counts):
+    logger.info(
+        f"🧮 Gravação: {counts['inserted']} novas | {counts['updated']} atualizadas | "
+        f"{counts['unchanged']} sem mudança | {counts['deleted']} removidas"
+    )
+
+
+def start_run_history(run_id, mode):
+    # Sem o histórico (ex.: schema.sql antigo) o ETL segue normalmente
+    try:
+        with engine.begin() as conn:
+            run_history.start_run(
+                conn, run_id, mode, EXTRACTION_MODE, datetime.now(timezone.utc)
+            )
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao registrar a execução {run_id} em etl_runs: {e}")
+        return False
+
+
+def save_run_history(run_id, summary):
+    try:
+        with engine.begin() as conn:
+            run_history.record_items(conn, run_id, summary)
+            run_history.finish_run(conn, run_id, datetime.now(timezone.utc))
+    except Exception as e:
+        logger.error(f"Erro ao gravar o histórico da execução {run_id}: {e}")
+
+
+def load_page_sizes():
+    # Sem etl_page_sizes cada conta começa em PAGE_SIZE_START
+    try:
+        with engine.connect() as conn:
+            page_sizes.load(conn)
+    except Exception as e:
+        logger.error(f"Erro ao ler os tamanhos de página de etl_page_sizes: {e}")
+
+
+def save_page_sizes():
+    try:
+        with engine.begin() as conn:
+            page_sizes.save(conn)
+    except Exception as e:
+        logger.error(f"Erro ao gravar os tamanhos de página em etl_page_sizes: {e}")
+
+
+def run_local(tasks, run_id, extraction_mode):
+    """Extrai os shards neste processo, com até MAX_WORKERS em paralelo"""
+    global landing_writer, current_run_id
+    current_run_id = run_id
+    load_page_sizes()
+    if LANDING_DIR:
+        landing_writer = landing.LandingWriter(
+            LANDING_DIR, run_id=run_id, max_queue=LANDING_QUEUE_SIZE
+        ).start()
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            if extraction_mode == "async":
+                summary = fetch_async_reports(tasks, executor)
+            elif extraction_mode == "batch":
+                summary = fetch_batched(tasks, executor)
             else:
-                logger.info(f"🏁 Conta {clean_id} finalizada. Total: {total}")
+                summary = fetch_tasks_concurrently(tasks, executor)
+    finally:
+        if landing_writer:
+            manifest = landing_writer.close()
+            landing_writer = None
+            logger.info(f"🛬 Páginas brutas salvas - manifesto: {manifest}")
+    save_page_sizes()
+    return summary
+
+
+def job_stats(job):
+    """Estatísticas do shard gravadas pelo worker (ou o desfecho do job, sem elas)"""
+    stats = new_account_stats(job["account_id"], job["since"], job["until"])
+    result = job["result"]
+    if result:
+        stats.update(result)
+        stats.update(
+            since=job["since"],
+            until=job["until"],
+            started_at=datetime.fromisoformat(result["started_at"]),
+        )
+    if job["status"] in ("pending", "running"):
+        stats["status"] = "cancelado"
+    elif not result:
+        stats["status"] = job["status"]
+    stats["attempts"] = max(stats["attempts"], job["attempts"])
+    return stats
+
+
+def reclaim_expired_jobs():
+    with engine.begin() as conn:
+        reclaimed = jobqueue.reclaim_expired(conn)
+    for job in reclaimed:
+        logger.warning(
+            f"♻️ {job['account_id']} [{job['since']} a {job['until']}] sem heartbeat de "
+            f"{job['previous_worker']} - job {job['job_id']} voltou como {job['status']}"
+        )
+
+
+def run_queued(tasks, run_id):
+    """
+    Enfileira os shards em etl_jobs e espera as réplicas terminarem. Shards
+    que já estavam na fila (execução interrompida ou concorrente) não são
+    duplicados: a execução espera pelo job existente.
+    """
+    with engine.begin() as conn:
+        created, existing = jobqueue.enqueue(conn, run_id, tasks, JOB_MAX_ATTEMPTS)
+    job_ids = created + existing
+    logger.info(
+        f"📬 {len(created)} shard(s) na fila etl_jobs ({len(existing)} já estavam na fila)"
+    )
+    if not job_ids:
+        return []
+    while not SHUTDOWN.is_set():
+        reclaim_expired_jobs()
+        with engine.connect() as conn:
+            if not jobqueue.count_active(conn, job_ids):
                 break
+        SHUTDOWN.wait(JOB_POLL_SECONDS)
+    # SIGTERM: os shards desta réplica param na página em andamento; o resumo
+    # espera o desfecho deles (os das outras réplicas seguem sem esta execução)
+    while SHUTDOWN.is_set():
+        with engine.connect() as conn:
+            if not jobqueue.count_active(conn, job_ids, WORKER_ID):
+                break
+        time.sleep(1)
+    with engine.begin() as conn:
+        jobs = jobqueue.get_jobs(conn, job_ids)
+        jobqueue.purge_finished(conn)
+    return [job_stats(job) for job in jobs]
+
+
+def open_worker_cycle():
+    """Jobs pegos com o worker ocioso abrem um ciclo: run_id, landing e tamanhos de página"""
+    global landing_writer, current_run_id
+    current_run_id = landing.new_run_id()
+    load_page_sizes()
+    if LANDING_DIR:
+        landing_writer = landing.LandingWriter(
+            LANDING_DIR, run_id=current_run_id, max_queue=LANDING_QUEUE_SIZE
+        ).start()
+
+
+def close_worker_cycle():
+    global landing_writer
+    save_page_sizes()
+    if landing_writer:
+        manifest = landing_writer.close()
+        landing_writer = None
+        logger.info(f"🛬 Páginas brutas salvas - manifesto: {manifest}")
+
+
+def finish_job(job, future):
+    """Grava no job o status e as estatísticas do shard"""
+    try:
+        stats = future.result()
+    except Exception as e:
+        logger.error(f"❌ Falha inesperada no job {job['job_id']} ({job['account_id']}): {e}")
+        stats = new_account_stats(job["account_id"], job["since"], job["until"])
+        stats["status"] = "erro"
+    try:
+        with engine.begin() as conn:
+            owned = jobqueue.finish(conn, job, WORKER_ID, stats["status"], stats)
+    except Exception as e:
+        logger.error(f"Erro ao fechar o job {job['job_id']} em etl_jobs: {e}")
+        return
+    if not owned:
+        # Lease venceu e o job voltou para a fila: o resultado fica com quem o pegou
+        logger.warning(
+            f"⚠️ Job {job['job_id']} ({job['account_id']} [{job['since']} a {job['until']}]) "
+            "não é mais deste worker - resultado descartado"
+        )
+
+
+def run_worker(stop=None):
+    """
+    Réplica da fila etl_jobs: pega até MAX_WORKERS shards por vez, renova o
+    lease deles a cada JOB_LEASE_SECONDS/3 e grava o resultado no job. Com
+    `stop` (ou SIGTERM) não pega mais nada e sai depois dos shards em
+    andamento. Shard cujo lease foi perdido (outro worker o assumiu, ou o
+    heartbeat não conseguiu renovar dentro do prazo) para na próxima página.
+    """
+    stop = stop or SHUTDOWN
+    running = {}
+    running_lock = threading.Lock()
+    done_beating = threading.Event()
+
+    def lose(job, reason):
+        if not job["lease_lost"].is_set():
+            job["lease_lost"].set()
+            logger.warning(
+                f"🔒 Job {job['job_id']} ({job['account_id']} [{job['since']} a "
+                f"{job['until']}]) {reason} - shard será abandonado"
+            )
+
+    def beat():
+        while not done_beating.wait(JOB_LEASE_SECONDS / 3):
+            with running_lock:
+                active = [job for future, job in running.items() if not future.done()]
+            if not active:
+                continue
+            try:
+                with engine.begin() as conn:
+                    owned = jobqueue.heartbeat(conn, WORKER_ID, active, JOB_LEASE_SECONDS)
+            except Exception as e:
+                logger.error(f"Erro ao renovar o lease dos jobs: {e}")
+                # Sem renovar dentro do prazo o reclaim de outra réplica já pode pegá-lo
+                for job in active:
+                    if time.monotonic() - job["renewed_at"] > JOB_LEASE_SECONDS:
+                        lose(job, "sem renovar o lease no prazo")
+                continue
+            now = time.monotonic()
+            for job in active:
+                if job["job_id"] in owned:
+                    job["renewed_at"] = now
+                else:
+                    lose(job, "voltou para a fila (lease vencido)")
+
+    def stopping():
+        return stop.is_set() or SHUTDOWN.is_set()
+
+    logger.info(f"👷 Worker {WORKER_ID} na fila etl_jobs ({MAX_WORKERS} shards por vez)")
+    threading.Thread(target=beat, name="heartbeat", daemon=True).start()
+    in_cycle = False
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            while running or not stopping():
+                jobs = []
+                if not stopping() and len(running) < MAX_WORKERS:
+                    try:
+                        reclaim_expired_jobs()
+                        with engine.begin() as conn:
+                            jobs = jobqueue.claim(
+                                conn, WORKER_ID, MAX_WORKERS - len(running), JOB_LEASE_SECONDS
+                            )
+                    except Exception as e:
+                        # Banco fora do ar, por exemplo: tenta de novo na próxima volta
+                        logger.error(f"❌ Erro ao pegar jobs de etl_jobs: {e}")
+                if jobs and not in_cycle:
+                    open_worker_cycle()
+                    in_cycle = True
+                for job in jobs:
+                    job.update(lease_lost=threading.Event(), renewed_at=time.monotonic())
+                    logger.info(
+                        f"📥 Job {job['job_id']}: {job['account_id']} "
+                        f"[{job['since']} a {job['until']}] (tentativa {job['attempts']})"
+                    )
+                    future = executor.submit(fetch_with_retries, job)
+                    with running_lock:
+                        running[future] = job
+                if not running:
+                    if in_cycle:
+                        close_worker_cycle()
+                        in_cycle = False
+                    stop.wait(JOB_POLL_SECONDS)
+                    continue
+                done, _ = wait(list(running), JOB_POLL_SECONDS, FIRST_COMPLETED)
+                for future in done:
+                    with running_lock:
+                        job = running.pop(future)
+                    finish_job(job, future)
+    finally:
+        done_beating.set()
+        if in_cycle:
+            close_worker_cycle()
+
+
+def with_local_worker(job, *args, **kwargs):
+    """Com JOB_QUEUE, esta réplica também extrai da fila enquanto `job` roda"""
+    if not JOB_QUEUE:
+        return job(*args, **kwargs)
+    stop = threading.Event()
+    worker = threading.Thread(target=run_worker, args=(stop,), name="worker")
+    worker.start()
+    try:
+        return job(*args, **kwargs)
+    finally:
+        stop.set()
+        worker.join()
+
+
+def show_queue():
+    """Jobs ativos e do último dia por status e worker (etl_jobs)"""
+    with engine.connect() as conn:
+        rows = jobqueue.queue_summary(conn)
+    print(f"{'status':<10} {'worker':<30} {'jobs':>5} {'mais antigo':>16} {'lease até':>16}")
+    for row in rows:
+        lease = row["lease_until"]
+        print(
+            f"{row['status']:<10} {row['worker_id']:<30} {row['jobs']:>5} "
+            f"{row['oldest'].astimezone(BRAZIL_TZ):%d/%m/%Y %H:%M} "
+            f"{lease.astimezone(BRAZIL_TZ).strftime('%d/%m/%Y %H:%M') if lease else '-':>16}"
+        )
+
+
+def order_tasks(tasks, workers, split=True):
+    """
+    Estima a duração de cada shard pelo histórico (etl_run_items) e ordena
+    do mais longo para o mais curto, para a execução não terminar esperando
+    uma conta grande que começou por último. Com `split`, divide antes os
+    shards que passariam sozinhos da fatia de cada worker.
+    """
+    if not tasks:
+        return tasks
+    # Sem histórico (ex.: schema.sql antigo) os shards seguem na ordem planejada
+    try:
+        with engine.connect() as conn:
+            per_day, per_row = planner.historical_costs(conn)
+            for account_id in {task["account_id"] for task in tasks} - set(per_day):
+                rows_per_day = planner.historical_rows_per_day(conn, account_id)
+                if per_row and rows_per_day:
+                    per_day[account_id] = per_row * rows_per_day
+    except Exception as e:
+        logger.error(f"Erro ao estimar a duração dos shards por etl_run_items: {e}")
+        return tasks
+    if not per_day:
+        return tasks
+
+    # Conta sem histórico nenhum: mediana das demais
+    default = statistics.median(per_day.values())
+    tasks = [
+        {
+            **task,
+            "expected_seconds": planner.estimate_seconds(
+                task["since"], task["until"], per_day.get(task["account_id"], default)
+            ),
+        }
+        for task in tasks
+    ]
+    if split:
+        planned = len(tasks)
+        tasks = planner.split_outliers(tasks, workers, SHARD_SPLIT_MIN_SECONDS)
+        if len(tasks) > planned:
+            logger.info(f"✂️ Shards mais longos divididos: {planned} → {len(tasks)}")
+    tasks = planner.longest_first(tasks)
+    total = sum(task["expected_seconds"] for task in tasks)
+    longest = max(tasks, key=lambda task: task["expected_seconds"])
+    logger.info(
+        f"⏱️ Estimativa: {total:.0f}s de shards em {workers} workers (~{total / workers:.0f}s) | "
+        f"mais longo {longest['account_id']} [{longest['since']} a {longest['until']}] "
+        f"~{longest['expected_seconds']:.0f}s"
+    )
+    return tasks
+
+
+def run_tasks(tasks, history_mode, extraction_mode=None):
+    """Executa os shards (extração, carga, publicação) e registra a execução"""
+    started = time.monotonic()
+    run_id = landing.new_run_id()
+    history = start_run_history(run_id, history_mode)
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    # Shards retomados não mudam de janela: o checkpoint é por (conta, since, until)
+    tasks = order_tasks(
+        tasks,
+        MAX_ASYNC_REPORTS if extraction_mode == "async" and not JOB_QUEUE else MAX_WORKERS,
+        split=history_mode != "resume",
+    )
+    for account_id in dict.fromkeys(task["account_id"] for task in tasks):
+        shards = [task for task in tasks if task["account_id"] == account_id]
+        logger.info(
+            f"🗓️ {account_id}: {min(task['since'] for task in shards)} a "
+            f"{max(task['until'] for task in shards)} em {len(shards)} shard(s)"
+        )
+    if tasks:
+        ensure_partitions(
+            min(task["since"] for task in tasks), max(task["until"] for task in tasks)
+        )
+    if JOB_QUEUE:
+        summary = run_queued(tasks, run_id)
+    else:
+        summary = run_local(tasks, run_id, extraction_mode)
+    settle_watermarks(summary)
+    if history:
+        save_run_history(run_id, summary)
+    seconds = time.monotonic() - started
+    log_run_summary(summary, seconds)
+    metrics.record_run(summary, seconds, time.time())
+    if METRICS_TEXTFILE:
+        metrics.write_textfile(METRICS_TEXTFILE)
+    if not JOB_QUEUE:
+        latency = graph.latency_stats()
+        logger.info(
+            f"🌐 API: {latency['calls']} chamadas | {latency['retries']} retries | "
+            f"latência média {latency['avg']:.2f}s | p95 {latency['p95']:.2f}s"
+        )
+    return summary
+
+
+def resume(accounts=None):
+    """
+    Retoma os shards com checkpoint (interrompidos por queda, deploy ou erro)
+    do cursor salvo, sem limpar o staging. Checkpoints de qualquer modo de
+    extração seguem pela paginação direta: o cursor de um relatório
+    assíncrono também é uma URL de página.
+    """
+    if accounts:
+        accounts = [normalize_account_id(account_id) for account_id in accounts]
+    with engine.connect() as conn:
+        pending = checkpoints.pending_checkpoints(conn, accounts)
+    if not pending:
+        return []
+    logger.info(f"⏩ Retomando {len(pending)} shard(s) interrompido(s)")
+    tasks = [
+        {"account_id": cp["account_id"], "since": cp["since"], "until": cp["until"]}
+        for cp in pending
+    ]
+    return run_tasks(tasks, "resume", extraction_mode="sync")
+
+
+def run_etl(full_refresh=False, accounts=None, since=None, lookback_days=None, priorities=None):
+    """Retoma os checkpoints (exceto no full refresh) e roda as contas; retorna os shards"""
+    mode = "FULL REFRESH" if full_refresh else "incremental"
+    logger.info(f"🚀 INICIANDO ETL (v6 - Mapeamento de Leads Otimizado) - {mode}")
+    accounts = accounts or [acc.strip() for acc in AD_ACCOUNT_ID_LIST if acc.strip()]
+    summary = []
+    if not full_refresh:
+        # Antes do planejamento: a marca d'água já considera o que foi retomado
+        summary += resume(accounts)
+    if not SHUTDOWN.is_set():
+        tasks = plan_tasks(
+            accounts,
+            full_refresh=full_refresh,
+            since=since,
+            lookback_days=lookback_days,
+            priorities=priorities,
+        )
+        summary += run_tasks(tasks, "full_refresh" if full_refresh else "incremental")
+    if SHUTDOWN.is_set():
+        logger.warning("🛑 JOB INTERROMPIDO - checkpoints salvos para o próximo início")
+    else:
+        logger.info("✅ JOB FINALIZADO")
+    return summary
+
+
+def run_schedules(schedules, started_at):
+    """Roda numa execução as contas vencidas (já com lock) e agenda a próxima de cada uma"""
+    for schedule in schedules:
+        late = (started_at - schedule["next_run_at"]).total_seconds() / 60
+        if late >= schedule["interval_minutes"]:
+            logger.info(
+                f"⏰ {schedule['account_id']} atrasada {late:.0f} min - "
+                "uma execução de recuperação"
+            )
+    accounts = [schedule["account_id"] for schedule in schedules]
+    with engine.begin() as conn:
+        scheduler.mark_started(conn, accounts, started_at)
+
+    summary = run_etl(
+        accounts=accounts,
+        lookback_days={
+            schedule["account_id"]: schedule["lookback_days"] for schedule in schedules
+        },
+        priorities={schedule["account_id"]: schedule["priority"] for schedule in schedules},
+    )
+
+    statuses = {}
+    for stats in summary:
+        if stats["status"] != "ok":
+            # "erro" prevalece sobre "cancelado"
+            current = statuses.get(stats["account_id"])
+            statuses[stats["account_id"]] = current if current == "erro" else stats["status"]
+    finished_at = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        for schedule in schedules:
+            account_id = schedule["account_id"]
+            status = statuses.get(account_id, "cancelado" if SHUTDOWN.is_set() else "ok")
+            next_run_at = scheduler.next_run_time(
+                schedule, started_at, status, SCHEDULE_JITTER_SECONDS
+            )
+            scheduler.mark_finished(conn, account_id, status, finished_at, next_run_at)
+            logger.info(
+                f"🗓️ {account_id}: {status} | próxima execução "
+                f"{next_run_at.astimezone(BRAZIL_TZ):%d/%m %H:%M}"
+            )
+    return summary
+
+
+def run_due_accounts():
+    """
+    Um ciclo da agenda: registra as contas novas de AD_ACCOUNTS e roda as
+    vencidas que nenhum outro processo está rodando. Retorna quantas rodaram.
+    """
+    accounts = [normalize_account_id(acc) for acc in AD_ACCOUNT_ID_LIST if acc.strip()]
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        scheduler.register_accounts(conn, accounts, SCHEDULE_INTERVAL_MINUTES, now)
+        due = scheduler.due_schedules(conn, now, accounts)
+    if not due:
+        return 0
+
+    # Conexão própria: os locks de sessão valem até o unlock, fora das transações
+    with engine.connect() as lock_conn:
+        locked = []
+        for schedule in due:
+            account_id = schedule["account_id"]
+            if not scheduler.try_lock(lock_conn, account_id):
+                logger.info(f"⏭️ {account_id} já está rodando em outro processo")
+                continue
+            # Outro processo pode ter terminado a conta entre a leitura e o lock
+            schedule = scheduler.get_due_schedule(lock_conn, account_id, now)
+            if schedule:
+                locked.append(schedule)
+            else:
+                scheduler.unlock(lock_conn, account_id)
+                logger.info(f"⏭️ {account_id} acabou de rodar em outro processo")
+        lock_conn.commit()
+        try:
+            if locked:
+                run_schedules(locked, now)
+        finally:
+            for schedule in locked:
+                scheduler.unlock(lock_conn, schedule["account_id"])
+            lock_conn.commit()
+    return len(locked)
+
+
+def run_scheduler(once=False):
+    """Worker da agenda (etl_schedules); com `once`, um ciclo só (job do Swarm/cron)"""
+    if once:
+        if not run_due_accounts():
+            logger.info("💤 Nenhuma conta vencida na agenda")
+        return
+    logger.info(f"🗓️ Agenda por conta ativa - verificando a cada {SCHEDULER_POLL_SECONDS}s")
+    while not SHUTDOWN.is_set():
+        try:
+            run_due_accounts()
         except Exception as e:
-            logger.error(f"❌ Erro fatal pág {page}: {e}")
-            break
+            # Banco fora do ar, por exemplo: tenta de novo no próximo ciclo
+            logger.error(f"❌ Erro no ciclo da agenda: {e}")
+        SHUTDOWN.wait(SCHEDULER_POLL_SECONDS)
+
+
+def transform_landed_file(path, account_id):
+    # Roda nos processos do replay: lê o arquivo bruto e aplica o mapeamento atual
+    return transform_page(list(landing.read_rows(path)), account_id)
+
+
+def replay(accounts=None, since=None, until=None, workers=None):
+    """
+    Reconstrói insights_meta_ads a partir do landing, sem chamar a API.
+    Para cada conta/dia usa a execução mais recente com o shard completo,
+    transforma os arquivos em paralelo (processos) e publica cada trecho
+    contínuo de dias pelo mesmo staging da extração.
+    """
+    logger.info(f"⏪ REPLAY do landing ({LANDING_DIR})")
+    started = time.monotonic()
+    accounts = {normalize_account_id(acc) for acc in accounts} if accounts else None
+    files = landing.latest_files(
+        LANDING_DIR, accounts, planner.parse_date(since), planner.parse_date(until)
+    )
+    if not files:
+        logger.warning("⚠️ Nada encontrado no landing para os filtros informados")
+        return
+
+    by_account = {}
+    for (account_id, day), paths in files.items():
+        by_account.setdefault(account_id, {})[day] = paths
+
+    ensure_partitions(min(day for _, day in files), max(day for _, day in files))
+    total, failed = 0, 0
+    written = dict.fromkeys(PUBLISH_COUNTS, 0)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for account_id, days in by_account.items():
+            for window_since, window_until in planner.contiguous_windows(days):
+                paths = [
+                    path
+                    for day, day_paths in sorted(days.items())
+                    if window_since <= day <= window_until
+                    for path in day_paths
+                ]
+                try:
+                    prepare_staging(account_id, window_since, window_until)
+                    rows = 0
+                    for df in executor.map(
+                        transform_landed_file, paths, repeat(account_id)
+                    ):
+                        load_dataframe(df)
+                        rows += len(df)
+                    counts = publish_window(account_id, window_since, window_until)
+                    for name in PUBLISH_COUNTS:
+                        written[name] += counts[name]
+                    total += rows
+                    logger.info(
+                        f"   ⏪ {account_id} [{window_since} a {window_until}] "
+                        f"{len(paths)} arquivos → {rows} regs"
+                    )
+                except Exception as e:
+                    failed += 1
+                    logger.error(
+                        f"❌ Replay falhou para {account_id} [{window_since} a {window_until}]: {e}"
+                    )
+    log_publish_counts(written)
+    logger.info(
+        f"✅ REPLAY FINALIZADO - {total} regs em {len(by_account)} contas "
+        f"({failed} janelas com erro) | {time.monotonic() - started:.1f}s"
+    )
+
 
+def report(days=30, limit=10):
+    """Tendência diária das execuções e contas mais lentas (etl_runs / etl_run_items)"""
+    with engine.connect() as conn:
+        trend = run_history.daily_trend(conn, days)
+        slowest = run_history.slowest_accounts(conn, days, limit)
+
+    print(f"📈 Execuções dos últimos {days} dias")
+    print(
+        f"{'dia':<10} {'execs':>5} {'erros':>5} {'média s':>8} {'máx s':>8} {'linhas':>9} "
+        f"{'págs':>6} {'MB':>7} {'chamadas':>8} {'retries':>7} {'pico %':>6}"
+    )
+    for row in trend:
+        print(
+            f"{row['day']!s:<10} {row['runs']:>5} {row['failed_runs']:>5} "
+            f"{row['avg_seconds']:>8.1f} {row['max_seconds']:>8.1f} {row['rows']:>9} "
+            f"{row['pages']:>6} {row['bytes'] / 1024 / 1024:>7.1f} {row['api_calls']:>8} "
+            f"{row['retries']:>7} {row['peak_throttle_pct']:>6.0f}"
+        )
+
+    print("\n🐢 Contas mais lentas (tempo somado dos shards)")
+    print(
+        f"{'conta':<22} {'shards':>6} {'erros':>5} {'total s':>8} {'média s':>8} {'p95 s':>7} "
+        f"{'linhas/s':>8} {'MB':>7} {'chamadas':>8} {'retries':>7} {'pico %':>6}"
+    )
+    for row in slowest:
+        print(
+            f"{row['account_id']:<22} {row['shards']:>6} {row['failed']:>5} "
+            f"{row['total_seconds']:>8.1f} {row['avg_seconds']:>8.1f} {row['p95_seconds']:>7.1f} "
+            f"{row['rows_per_s'] or 0:>8.0f} {row['bytes'] / 1024 / 1024:>7.1f} "
+            f"{row['api_calls']:>8} {row['retries']:>7} {row['peak_throttle_pct']:>6.0f}"
+        )
+
+
+def manage_schedules(accounts=None, **changes):
+    """Altera a agenda das contas (se houver mudanças) e lista etl_schedules"""
+    with engine.begin() as conn:
+        if accounts and any(value is not None for value in changes.values()):
+            for account_id in accounts:
+                scheduler.upsert_schedule(
+                    conn,
+                    normalize_account_id(account_id),
+                    default_interval=SCHEDULE_INTERVAL_MINUTES,
+                    **changes,
+                )
+        rows = scheduler.list_schedules(conn)
+    configured = {normalize_account_id(acc) for acc in AD_ACCOUNT_ID_LIST if acc.strip()}
+
+    print(
+        f"{'conta':<22} {'ativa':>5} {'cada min':>8} {'janela d':>8} {'prior.':>6} "
+        f"{'próxima':>16} {'última':>16} {'status':>9}"
+    )
+    for row in rows:
+        last = row["last_started_at"]
+        print(
+            f"{row['account_id']:<22} "
+            # "fora": conta ativa na agenda, mas fora de AD_ACCOUNTS (não roda)
+            f"{('sim' if row['account_id'] in configured else 'fora') if row['enabled'] else 'não':>5} "
+            f"{row['interval_minutes']:>8} {row['lookback_days'] or ATTRIBUTION_LOOKBACK_DAYS:>8} "
+            f"{row['priority']:>6} {row['next_run_at'].astimezone(BRAZIL_TZ):%d/%m/%Y %H:%M} "
+            f"{last.astimezone(BRAZIL_TZ).strftime('%d/%m/%Y %H:%M') if last else '-':>16} "
+            f"{row['last_status'] or '-':>9}"
+        )
+
+
+def request_shutdown(signum, frame):
+    # Swarm manda SIGTERM no redeploy: termina a página em andamento e para
+    logger.warning(
+        "🛑 SIGTERM recebido - parando após as páginas em andamento (checkpoints salvos)"
+    )
+    SHUTDOWN.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL Meta Ads")
+    commands = parser.add_subparsers(dest="command")
+    run_cmd = commands.add_parser(
+        "run", help="Worker da agenda por conta (etl_schedules) (padrão)"
+    )
+    run_cmd.add_argument(
+        "--once", action="store_true", help="Roda as contas vencidas e sai (job do Swarm/cron)"
+    )
+    full = commands.add_parser(
+        "full-refresh", help="Reextrai todo o histórico, ignorando a marca d'água"
+    )
+    full.add_argument("--accounts", help="Contas separadas por vírgula (padrão: AD_ACCOUNTS)")
+    full.add_argument("--since", help=f"Início do histórico (padrão: {BACKFILL_START})")
+    resume_cmd = commands.add_parser(
+        "resume", help="Retoma do checkpoint os shards interrompidos e sai"
+    )
+    resume_cmd.add_argument("--accounts", help="Contas separadas por vírgula (padrão: todas)")
+    replay_cmd = commands.add_parser(
+        "replay", help="Recarrega a partir do landing com o mapeamento atual, sem chamar a API"
+    )
+    replay_cmd.add_argument("--accounts", help="Contas separadas por vírgula (padrão: todas)")
+    replay_cmd.add_argument("--since", help="Primeiro dia a reprocessar")
+    replay_cmd.add_argument("--until", help="Último dia a reprocessar")
+    replay_cmd.add_argument(
+        "--workers", type=int, help="Processos de transformação (padrão: CPUs)"
+    )
+    report_cmd = commands.add_parser(
+        "report", help="Histórico das execuções: tendência diária e contas mais lentas"
+    )
+    report_cmd.add_argument("--days", type=int, default=30, help="Período analisado")
+    report_cmd.add_argument("--limit", type=int, default=10, help="Quantas contas listar")
+    schedule_cmd = commands.add_parser(
+        "schedule", help="Lista ou altera a agenda por conta (etl_schedules)"
+    )
+    schedule_cmd.add_argument("--accounts", help="Contas separadas por vírgula")
+    schedule_cmd.add_argument("--every", type=int, help="Cadência em minutos")
+    schedule_cmd.add_argument("--lookback", type=int, help="Dias reextraídos a cada execução")
+    schedule_cmd.add_argument("--priority", type=int, help="Maior roda primeiro")
+    schedule_cmd.add_argument("--enable", dest="enabled", action="store_const", const=True)
+    schedule_cmd.add_argument("--disable", dest="enabled", action="store_const", const=False)
+    schedule_cmd.add_argument(
+        "--now", action="store_true", help="Vence já (roda no próximo ciclo do worker)"
+    )
+    commands.add_parser(
+        "worker", help="Só extrai shards da fila etl_jobs (réplicas extras, JOB_QUEUE=true)"
+    )
+    commands.add_parser("queue", help="Jobs da fila etl_jobs por status e worker")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.days, args.limit)
+        return
+    if args.command == "queue":
+        show_queue()
+        return
+    if args.command == "schedule":
+        manage_schedules(
+            args.accounts.split(",") if args.accounts else None,
+            interval_minutes=args.every,
+            lookback_days=args.lookback,
+            priority=args.priority,
+            enabled=args.enabled,
+            next_run_at=datetime.now(timezone.utc) if args.now else None,
+        )
+        return
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    if args.command == "full-refresh":
+        accounts = args.accounts.split(",") if args.accounts else None
+        with_local_worker(run_etl, full_refresh=True, accounts=accounts, since=args.since)
+        return
+    if args.command == "resume":
+        with_local_worker(resume, args.accounts.split(",") if args.accounts else None)
+        return
+    if args.command == "replay":
+        accounts = args.accounts.split(",") if args.accounts else None
+        replay(accounts, args.since, args.until, args.workers)
+        return
+
+    if args.command == "worker":
+        run_worker()
+        return
 
-def run_etl():
-    logger.info("🚀 INICIANDO ETL (v6 - Mapeamento de Leads Otimizado)")
-    since, until = get_date_range()
-    accounts = [acc.strip() for acc in AD_ACCOUNT_ID_LIST if acc.strip()]
-    for account_id in accounts:
-        fetch_and_process(account_id, since, until)
-    logger.info("✅ JOB FINALIZADO - Próxima execução em 4h")
+    with_local_worker(run_scheduler, once=getattr(args, "once", False))
 
 
-run_etl()
-schedule.every(4).hours.do(run_etl)
-while True:
-    schedule.run_pending()
-    time.sleep(60)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Métricas Prometheus do ETL.
+
+Exposição (ver main.py):
+- METRICS_PORT:     servidor HTTP com /metrics no worker (scrape do Prometheus)
+- METRICS_TEXTFILE: arquivo .prom reescrito ao fim de cada execução, para o
+                    textfile collector do node-exporter (execuções avulsas)
+
+Tudo fica no registro padrão do prometheus_client, junto das métricas de
+processo (memória, CPU) que ele já publica.
+"""
+
+import logging
+
+from prometheus_client import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server,
+    write_to_textfile,
+)
+
+logger = logging.getLogger(__name__)
+
+# Latências de uma página (API, transformação, COPY) até a publicação de uma janela
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PAGES = Counter("meta_etl_pages", "Páginas lidas da API", ["account_id"])
+ROWS = Counter("meta_etl_rows", "Linhas gravadas no staging", ["account_id"])
+STAGE_SECONDS = Histogram(
+    "meta_etl_stage_seconds",
+    "Duração por etapa: fetch (página da API), transform, load (COPY/INSERT "
+    "no staging) e publish (janela no destino)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+PUBLISHED_ROWS = Counter(
+    "meta_etl_published_rows", "Linhas na publicação por resultado", ["result"]
+)
+
+API_REQUESTS = Counter(
+    "meta_etl_api_requests", "Chamadas à Graph API por método e status", ["method", "status"]
+)
+API_ERRORS = Counter(
+    "meta_etl_api_errors", "Erros da Graph API por código (error.code)", ["code"]
+)
+API_RETRIES = Counter("meta_etl_api_retries", "Novas tentativas por motivo", ["reason"])
+API_LATENCY = Histogram(
+    "meta_etl_api_latency_seconds", "Latência das chamadas HTTP", buckets=LATENCY_BUCKETS
+)
+
+PAGE_SIZE = Gauge(
+    "meta_etl_page_size", "Limit atual da paginação de /insights (page_size.py)", ["account_id"]
+)
+
+THROTTLE_APP_PCT = Gauge("meta_etl_throttle_app_pct", "Última utilização do app (%)")
+THROTTLE_ACCOUNT_PCT = Gauge(
+    "meta_etl_throttle_account_pct", "Última utilização da conta (%)", ["account_id"]
+)
+THROTTLE_PAUSES = Counter(
+    "meta_etl_throttle_pauses", "Pausas por erro de throttling", ["account_id", "code"]
+)
+THROTTLE_PAUSE_SECONDS = Counter(
+    "meta_etl_throttle_pause_seconds", "Segundos de pausa pedidos pela Meta", ["account_id"]
+)
+
+SHARDS = Counter("meta_etl_shards", "Shards finalizados por status", ["status"])
+RUNS = Counter("meta_etl_runs", "Execuções do ETL por status", ["status"])
+RUN_SECONDS = Gauge("meta_etl_run_duration_seconds", "Duração da última execução")
+LAST_SUCCESS = Gauge(
+    "meta_etl_last_success_timestamp_seconds", "Fim da última execução sem shards com erro"
+)
+
+
+def observe_api_response(method, response):
+    """Conta a resposta (requests.Response ou item de lote) e o error.code, se houver"""
+    status = response.status_code
+    API_REQUESTS.labels(method, str(status)).inc()
+    if status < 400:
+        return
+    try:
+        code = response.json().get("error", {}).get("code")
+    except (ValueError, AttributeError):
+        code = None
+    API_ERRORS.labels(str(code) if code is not None else "http").inc()
+
+
+def record_page(account_id, rows):
+    PAGES.labels(account_id).inc()
+    if rows:
+        ROWS.labels(account_id).inc(rows)
+
+
+def record_run(summary, seconds, finished_at):
+    failed = 0
+    for stats in summary:
+        SHARDS.labels(stats["status"]).inc()
+        failed += stats["status"] != "ok"
+    RUNS.labels("erro" if failed else "ok").inc()
+    RUN_SECONDS.set(seconds)
+    if not failed:
+        LAST_SUCCESS.set(finished_at)
+
+
+def serve(port):
+    try:
+        start_http_server(port)
+    except OSError as e:
+        # Ex.: full-refresh rodando no mesmo container do worker
+        logger.warning(f"⚠️ Métricas não expostas na porta {port}: {e}")
+        return False
+    logger.info(f"📈 Métricas em http://0.0.0.0:{port}/metrics")
+    return True
+
+
+def write_textfile(path):
+    try:
+        write_to_textfile(path, REGISTRY)
+    except OSError as e:
+        logger.error(f"Erro ao gravar métricas em {path}: {e}")
@@ -0,0 +1,57 @@
+-- Migração: insights_meta_ads (tabela única) → particionada por mês em data_registro
+--
+-- Pare o serviço do ETL antes de rodar (docker service scale etl-meta-ads_meta_etl_worker=0)
+-- e execute numa janela sem carga dos dashboards:
+--   psql -h patroni-primary -U postgres -d relatorio_meta_ads -f migrations/001_partition_insights_by_month.sql
+--
+-- A cópia roda numa única transação: se algo falhar, nada muda.
+
+BEGIN;
+
+ALTER TABLE insights_meta_ads RENAME TO insights_meta_ads_old;
+ALTER INDEX IF EXISTS idx_account_date RENAME TO idx_account_date_old;
+ALTER INDEX IF EXISTS idx_campaign RENAME TO idx_campaign_old;
+ALTER INDEX IF EXISTS idx_adset RENAME TO idx_adset_old;
+ALTER INDEX IF EXISTS idx_ad RENAME TO idx_ad_old;
+ALTER INDEX IF EXISTS idx_data_registro RENAME TO idx_data_registro_old;
+
+CREATE TABLE insights_meta_ads (
+    LIKE insights_meta_ads_old INCLUDING DEFAULTS INCLUDING COMMENTS
+) PARTITION BY RANGE (data_registro);
+
+-- Uma partição por mês entre o dado mais antigo e o mês corrente
+DO $$
+DECLARE
+    month DATE;
+    last_month DATE;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(data_registro), CURRENT_DATE))::date,
+           date_trunc('month', GREATEST(COALESCE(MAX(data_registro), CURRENT_DATE), CURRENT_DATE))::date
+      INTO month, last_month
+      FROM insights_meta_ads_old;
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF insights_meta_ads FOR VALUES FROM (%L) TO (%L)',
+            'insights_meta_ads_p' || to_char(month, 'YYYY_MM'),
+            month,
+            (month + INTERVAL '1 month')::date
+        );
+        month := (month + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO insights_meta_ads SELECT * FROM insights_meta_ads_old;
+
+CREATE INDEX idx_account_date ON insights_meta_ads(account_id, data_registro);
+CREATE INDEX idx_campaign ON insights_meta_ads(id_campanha);
+CREATE INDEX idx_adset ON insights_meta_ads(id_conjunto_anuncios);
+CREATE INDEX idx_ad ON insights_meta_ads(id_anuncio);
+CREATE INDEX idx_data_registro ON insights_meta_ads(data_registro);
+
+COMMENT ON TABLE insights_meta_ads IS 'Dados de insights da API Meta Ads com janela de atribuição de 28 dias';
+
+DROP TABLE insights_meta_ads_old;
+
+COMMIT;
+
+ANALYZE insights_meta_ads;
@@ -0,0 +1,37 @@
+-- Migração: chave natural única + row_hash em insights_meta_ads
+--
+-- Pré-requisito para a publicação por upsert (PUBLISH_MODE=upsert). Pare o
+-- serviço do ETL antes de rodar:
+--   psql -h patroni-primary -U postgres -d relatorio_meta_ads -f migrations/002_natural_key_and_row_hash.sql
+--
+-- row_hash começa vazio: a primeira execução de cada janela regrava as
+-- linhas uma vez e, dali em diante, só o que mudar.
+
+BEGIN;
+
+-- Duplicatas pela chave natural (sobras de cargas antigas): fica a mais recente
+DELETE FROM insights_meta_ads a
+ USING insights_meta_ads b
+ WHERE a.account_id = b.account_id
+   AND a.id_anuncio = b.id_anuncio
+   AND a.data_registro = b.data_registro
+   AND COALESCE(a.plataforma, '') = COALESCE(b.plataforma, '')
+   AND COALESCE(a.posicionamento, '') = COALESCE(b.posicionamento, '')
+   AND a.tableoid = b.tableoid
+   AND (COALESCE(a.created_at, '-infinity'), a.ctid) < (COALESCE(b.created_at, '-infinity'), b.ctid);
+
+-- Nulos na chave não colidem num índice único: vira string vazia
+UPDATE insights_meta_ads SET plataforma = '' WHERE plataforma IS NULL;
+UPDATE insights_meta_ads SET posicionamento = '' WHERE posicionamento IS NULL;
+ALTER TABLE insights_meta_ads
+    ALTER COLUMN plataforma SET DEFAULT '',
+    ALTER COLUMN plataforma SET NOT NULL,
+    ALTER COLUMN posicionamento SET DEFAULT '',
+    ALTER COLUMN posicionamento SET NOT NULL;
+
+ALTER TABLE insights_meta_ads ADD COLUMN IF NOT EXISTS row_hash CHAR(32);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_insights_natural_key
+    ON insights_meta_ads(account_id, id_anuncio, data_registro, plataforma, posicionamento);
+
+COMMIT;
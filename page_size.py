@@ -0,0 +1,125 @@
+"""
+Tamanho de página (limit) adaptativo por conta na paginação de /insights.
+
+O limit fixo em 25 evitava timeouts nos dias ruins, mas nos dias bons
+custava várias vezes mais chamadas do que o necessário. O controlador
+ajusta o limit de cada conta a partir das páginas lidas:
+
+- cresce 50% quando uma página cheia volta em menos de target_seconds
+- cai pela metade quando a página passa do dobro de target_seconds ou de
+  max_bytes, precisou de retry, deu timeout ou a Meta pediu para reduzir
+  o volume ("Please reduce the amount of data you're asking for")
+- fica sempre entre minimum e maximum
+
+O cursor do paging.next continua valendo com outro limit, então a página
+seguinte já sai com o tamanho novo. O tamanho aprendido fica em
+etl_page_sizes e é o ponto de partida da conta nas próximas execuções.
+"""
+
+import math
+import logging
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import text
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def with_limit(url, limit):
+    """URL de página (absoluta ou relative_url do lote) com outro limit"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "limit"]
+    query.append(("limit", str(limit)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class PageSizeController:
+    """Limit de cada conta, compartilhado entre as threads de extração"""
+
+    def __init__(
+        self, start=25, minimum=5, maximum=500, target_seconds=5.0, max_bytes=8 * 1024 * 1024
+    ):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.sizes = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def size(self, account_id):
+        with self._lock:
+            return self.sizes.get(account_id, self.start)
+
+    def _set(self, account_id, size):
+        size = max(self.minimum, min(self.maximum, int(size)))
+        if size != self.sizes.get(account_id, self.start):
+            self.sizes[account_id] = size
+            self._changed.add(account_id)
+        metrics.PAGE_SIZE.labels(account_id).set(size)
+        return size
+
+    def observe(self, account_id, limit, rows, seconds, size_bytes, retried=False):
+        """
+        Ajusta o limit a partir de uma página pedida com `limit`. `seconds`
+        None (item da Batch API, sem latência própria) não impede o
+        crescimento. Retorna o limit da próxima página.
+        """
+        if retried:
+            return self.shrink(account_id, limit, "página precisou de retry")
+        if seconds is not None and seconds > 2 * self.target_seconds:
+            return self.shrink(account_id, limit, f"página levou {seconds:.1f}s")
+        if size_bytes > self.max_bytes:
+            return self.shrink(
+                account_id, limit, f"página de {size_bytes / 1024 / 1024:.1f} MB"
+            )
+        with self._lock:
+            current = self.sizes.get(account_id, self.start)
+            fast = seconds is None or seconds < self.target_seconds
+            # Página parcial (a última) não diz se cabia mais; limit antigo
+            # é de outra thread que ainda não viu o ajuste
+            if not fast or rows < limit or limit < current or current >= self.maximum:
+                return current
+            size = self._set(account_id, math.ceil(current * 1.5))
+        logger.info(f"📈 Página de {account_id}: {current} → {size} linhas")
+        return size
+
+    def shrink(self, account_id, limit, reason):
+        """Metade do limit que deu problema (o mínimo, no pior caso)"""
+        with self._lock:
+            current = self.sizes.get(account_id, self.start)
+            size = self._set(account_id, min(current, limit // 2))
+        if size < current:
+            logger.warning(f"📉 Página de {account_id}: {current} → {size} linhas ({reason})")
+        return size
+
+    def load(self, conn):
+        rows = conn.execute(text("SELECT account_id, page_size FROM etl_page_sizes")).fetchall()
+        with self._lock:
+            for account_id, size in rows:
+                self._set(account_id, size)
+            self._changed.clear()
+
+    def save(self, conn):
+        """Grava os tamanhos que mudaram desde o último load/save"""
+        with self._lock:
+            changed = [
+                {"acc": account_id, "size": self.sizes[account_id]}
+                for account_id in self._changed
+            ]
+        if not changed:
+            return
+        conn.execute(
+            text(
+                "INSERT INTO etl_page_sizes (account_id, page_size) VALUES (:acc, :size) "
+                "ON CONFLICT (account_id) DO UPDATE SET "
+                "page_size = EXCLUDED.page_size, updated_at = CURRENT_TIMESTAMP"
+            ),
+            changed,
+        )
+        with self._lock:
+            self._changed.difference_update(row["acc"] for row in changed)
@@ -0,0 +1,166 @@
+"""
+Partições mensais de insights_meta_ads (RANGE em data_registro).
+
+Cada mês vive numa partição própria (insights_meta_ads_p2026_10), criada
+antes da carga por `ensure_partitions`. Os filtros de data dos dashboards
+passam a ler só os meses pedidos, e a troca de um mês inteiro de uma conta
+vira TRUNCATE da partição em vez de DELETE linha a linha.
+
+Bancos que ainda não rodaram migrations/001_partition_insights_by_month.sql
+continuam funcionando: sem tabela particionada, tudo aqui vira no-op.
+"""
+
+import threading
+from datetime import timedelta
+
+from sqlalchemy import text
+
+# Chave do advisory lock que coordena as publicações com TRUNCATE
+PUBLISH_LOCK_KEY = 7361400
+# Chave do advisory lock da criação de partições (réplicas na virada do mês)
+PARTITION_LOCK_KEY = 7361402
+
+_partitioned_cache = {}
+_cache_lock = threading.Lock()
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def months_between(since, until):
+    """Primeiro dia de cada mês que toca [since, until]"""
+    months = []
+    month = month_start(since)
+    while month <= until:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def covered_months(since, until):
+    """Meses inteiramente contidos em [since, until]"""
+    return [
+        month
+        for month in months_between(since, until)
+        if month >= since and next_month(month) - timedelta(days=1) <= until
+    ]
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(conn, table):
+    with _cache_lock:
+        if table in _partitioned_cache:
+            return _partitioned_cache[table]
+    partitioned = (
+        conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+            ),
+            {"t": table},
+        ).fetchone()
+        is not None
+    )
+    with _cache_lock:
+        _partitioned_cache[table] = partitioned
+    return partitioned
+
+
+def partition_exists(conn, name):
+    # pg_class (e não to_regclass, que usa o cache de catálogo da sessão):
+    # enxerga a partição que outro processo acabou de criar
+    return (
+        conn.execute(text("SELECT 1 FROM pg_class WHERE relname = :n"), {"n": name}).fetchone()
+        is not None
+    )
+
+
+def ensure_partitions(conn, table, since, until):
+    """
+    Cria as partições mensais que faltam entre since e until. Deve rodar
+    uma vez antes da extração, fora das threads de carga: CREATE TABLE ...
+    PARTITION OF bloqueia a tabela-mãe e não é seguro em paralelo. Entre
+    processos (réplicas, execuções --once na virada do mês), quem cria
+    segura um advisory lock até o commit e confere de novo o que falta.
+    """
+    if not is_partitioned(conn, table):
+        return []
+    missing = [
+        month
+        for month in months_between(since, until)
+        if not partition_exists(conn, partition_name(table, month))
+    ]
+    if not missing:
+        return []
+    conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": PARTITION_LOCK_KEY})
+    created = []
+    for month in missing:
+        name = partition_name(table, month)
+        if partition_exists(conn, name):
+            continue
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            )
+        )
+        created.append(name)
+    return created
+
+
+def holds_only_account(conn, partition, account_id):
+    """True se a partição não tem linhas de outras contas"""
+    return (
+        conn.execute(
+            text(f"SELECT 1 FROM {partition} WHERE account_id <> :acc LIMIT 1"),
+            {"acc": account_id},
+        ).fetchone()
+        is None
+    )
+
+
+def share_publish_lock(conn, table):
+    """Publicação sem TRUNCATE: só impede que outra trunque por baixo dela"""
+    if is_partitioned(conn, table):
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock_shared(:k)"), {"k": PUBLISH_LOCK_KEY}
+        )
+
+
+def truncate_covered_partitions(conn, table, account_id, since, until):
+    """
+    Esvazia com TRUNCATE os meses inteiros da janela cujas partições só têm
+    dados desta conta. Retorna os nomes truncados; o restante da janela
+    continua sendo removido com DELETE.
+
+    Publicações comuns seguram o advisory lock em modo compartilhado até o
+    commit; a que pode truncar espera por ele exclusivo. Assim nenhuma
+    carga de outra conta ainda não commitada cai num TRUNCATE. Como as
+    partições são de todas as contas, o lock exclusivo só é pedido quando
+    algum mês já commitado tem só esta conta; a conferência é refeita com
+    ele, para enxergar as cargas que estavam em andamento.
+    """
+    if not is_partitioned(conn, table):
+        return []
+    months = [
+        month
+        for month in covered_months(since, until)
+        if holds_only_account(conn, partition_name(table, month), account_id)
+    ]
+    lock = "pg_advisory_xact_lock" if months else "pg_advisory_xact_lock_shared"
+    conn.execute(text(f"SELECT {lock}(:k)"), {"k": PUBLISH_LOCK_KEY})
+    truncated = []
+    for month in months:
+        name = partition_name(table, month)
+        if holds_only_account(conn, name, account_id):
+            conn.execute(text(f"TRUNCATE {name}"))
+            truncated.append(name)
+    return truncated
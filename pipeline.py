@@ -0,0 +1,104 @@
+"""
+Pipeline em estágios ligados por filas limitadas.
+
+    fonte (thread)  →  fila  →  estágio 1 (thread)  →  fila  →  ...  →  destino
+
+A fonte (ex.: paginação da API) roda à frente, buscando a próxima página
+enquanto as anteriores são transformadas e gravadas; cada estágio roda na
+sua thread. Com as filas limitadas a `queue_size` itens, um estágio lento
+segura os anteriores (backpressure) e a memória não cresce sem limite.
+
+O destino roda na thread de quem chamou. Um erro em qualquer ponto para
+todos os estágios e é relançado por `run_pipeline`.
+"""
+
+import queue
+import threading
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+def run_pipeline(source, stages, sink, queue_size=4):
+    """
+    source: iterável consumido numa thread própria (prefetch)
+    stages: funções item -> item, uma thread cada; retornar None descarta o item
+    sink:   função chamada, na thread atual, com cada item que sai do último estágio
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def fail(error):
+        errors.append(error)
+        stop.set()
+
+    def put(q, item):
+        # Espera por espaço, mas desiste se algum estágio falhou
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def produce():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            fail(e)
+            return
+        put(queues[0], _DONE)
+
+    def work(fn, inbox, outbox):
+        while True:
+            item = get(inbox)
+            if item is _DONE:
+                put(outbox, _DONE)
+                return
+            try:
+                result = fn(item)
+            except Exception as e:
+                fail(e)
+                return
+            if result is not None and not put(outbox, result):
+                return
+
+    threads = [threading.Thread(target=produce, name="pipeline-source", daemon=True)]
+    for i, fn in enumerate(stages):
+        threads.append(
+            threading.Thread(
+                target=work,
+                args=(fn, queues[i], queues[i + 1]),
+                name=f"pipeline-stage-{i + 1}",
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _DONE:
+                break
+            sink(item)
+    except Exception as e:
+        fail(e)
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
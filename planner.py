@@ -0,0 +1,256 @@
+"""
+Planejamento das janelas de extração por conta.
+
+Cada conta tem uma marca d'água (etl_watermarks) com o intervalo contínuo
+de datas já publicado em insights_meta_ads. Numa execução incremental só
+são extraídos:
+- os últimos N dias da janela de atribuição (os números ainda mudam), e
+- os trechos nunca carregados entre o início do backfill e a marca d'água.
+Dados com mais de 28 dias não mudam mais na Meta e não são reextraídos.
+
+Cada janela é então dividida em shards (por dia, semana ou tamanho
+adaptativo pelo histórico de linhas/dia da conta), extraídos e publicados
+de forma independente. Os shards seguem fronteiras fixas de calendário
+(blocos de ALIGNED_SHARD_DAYS dias contados de SHARD_EPOCH): só o primeiro e o
+último são cortados pela janela, e os do meio têm o mesmo (since, until)
+de uma execução para outra, o que mantém válidos o cache de ETags e os
+checkpoints.
+
+A duração de cada shard é estimada pelo histórico de etl_run_items
+(segundos por dia de dados da conta). Os shards são despachados do mais
+longo para o mais curto (LPT), e os que sozinhos passariam da fatia ideal
+de cada worker são divididos, para uma conta grande não ficar na cauda da
+execução.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+ONE_DAY = timedelta(days=1)
+
+# Fronteiras dos shards: blocos de N dias contados desta segunda-feira
+SHARD_EPOCH = date(2024, 1, 1)
+# Tamanhos permitidos: o adaptativo só muda de fronteira quando o volume da
+# conta muda de faixa, não a cada variação do histórico
+ALIGNED_SHARD_DAYS = (1, 2, 3, 7, 14, 28)
+
+
+def get_watermark(conn, account_id):
+    row = conn.execute(
+        text(
+            "SELECT loaded_since, loaded_until FROM etl_watermarks "
+            "WHERE account_id = :acc"
+        ),
+        {"acc": account_id},
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def advance_watermark(conn, account_id, since, until):
+    """
+    Estende a marca d'água com a janela publicada, desde que ela encoste no
+    intervalo já carregado (shards terminam fora de ordem e um buraco não
+    pode ser marcado como carregado). Retorna True se aplicou.
+    """
+    result = conn.execute(
+        text(
+            "INSERT INTO etl_watermarks (account_id, loaded_since, loaded_until) "
+            "VALUES (:acc, :s, :u) "
+            "ON CONFLICT (account_id) DO UPDATE SET "
+            "loaded_since = LEAST(etl_watermarks.loaded_since, EXCLUDED.loaded_since), "
+            "loaded_until = GREATEST(etl_watermarks.loaded_until, EXCLUDED.loaded_until), "
+            "updated_at = CURRENT_TIMESTAMP "
+            "WHERE EXCLUDED.loaded_since <= etl_watermarks.loaded_until + 1 "
+            "AND EXCLUDED.loaded_until >= etl_watermarks.loaded_since - 1"
+        ),
+        {"acc": account_id, "s": since, "u": until},
+    )
+    return result.rowcount > 0
+
+
+def settle_watermark(conn, account_id, windows):
+    """
+    Aplica as janelas publicadas que ficaram de fora por terem terminado
+    antes do shard vizinho. Repete até nenhuma encostar mais.
+    """
+    pending = sorted(windows)
+    applied = True
+    while pending and applied:
+        applied = False
+        for window in list(pending):
+            if advance_watermark(conn, account_id, *window):
+                pending.remove(window)
+                applied = True
+    return pending
+
+
+def plan_windows(watermark, today, backfill_start, lookback_days):
+    """
+    Janelas (since, until) a extrair para uma conta, em ordem cronológica.
+
+    - Sem marca d'água: backfill completo desde backfill_start.
+    - Com marca d'água: lacuna antes de loaded_since (se houver) + dos
+      últimos lookback_days (ou do dia seguinte a loaded_until, se for
+      mais antigo) até hoje.
+    """
+    if watermark is None:
+        return [(backfill_start, today)]
+
+    loaded_since, loaded_until = watermark
+    lookback_start = today - timedelta(days=lookback_days - 1)
+    recent_since = max(min(lookback_start, loaded_until + ONE_DAY), backfill_start)
+
+    windows = []
+    if loaded_since > backfill_start:
+        windows.append((backfill_start, loaded_since - ONE_DAY))
+    windows.append((recent_since, today))
+
+    # Junta janelas que se tocam (ex.: marca d'água muito curta)
+    merged = [windows[0]]
+    for since, until in windows[1:]:
+        last_since, last_until = merged[-1]
+        if since <= last_until + ONE_DAY:
+            merged[-1] = (last_since, max(last_until, until))
+        else:
+            merged.append((since, until))
+    return merged
+
+
+def historical_rows_per_day(conn, account_id, days=90):
+    """Média de linhas por dia publicadas recentemente (None sem histórico)"""
+    row = conn.execute(
+        text(
+            "SELECT COUNT(*), COUNT(DISTINCT data_registro) FROM insights_meta_ads "
+            "WHERE account_id = :acc AND data_registro >= CURRENT_DATE - :days"
+        ),
+        {"acc": account_id, "days": days},
+    ).fetchone()
+    rows, distinct_days = row
+    return rows / distinct_days if distinct_days else None
+
+
+def historical_costs(conn, days=30):
+    """
+    Custo de extração pelo histórico dos shards ok: segundos por dia de dados
+    de cada conta e a média geral de segundos por linha (para estimar contas
+    que ainda não têm tempo registrado). Ficam de fora as execuções async e
+    batch sem etl_runs.shard_seconds, que gravavam em cada shard o tempo
+    desde o início da execução.
+    """
+    rows = conn.execute(
+        text(
+            "SELECT i.account_id, SUM(i.seconds) AS seconds, "
+            "SUM(i.until - i.since + 1) AS days, SUM(i.rows) AS rows "
+            "FROM etl_run_items i JOIN etl_runs r ON r.run_id = i.run_id "
+            "WHERE i.status = 'ok' AND (r.shard_seconds OR r.extraction_mode = 'sync') "
+            "AND i.started_at >= NOW() - make_interval(days => :days) GROUP BY i.account_id"
+        ),
+        {"days": days},
+    ).fetchall()
+    per_day = {
+        account_id: float(seconds) / shard_days_total
+        for account_id, seconds, shard_days_total, _ in rows
+        if shard_days_total
+    }
+    total_seconds = sum(float(row[1]) for row in rows)
+    total_rows = sum(row[3] or 0 for row in rows)
+    per_row = total_seconds / total_rows if total_rows else None
+    return per_day, per_row
+
+
+def estimate_seconds(since, until, seconds_per_day):
+    return seconds_per_day * ((until - since).days + 1)
+
+
+def split_outliers(tasks, workers, min_seconds=60):
+    """
+    Divide os shards estimados acima da fatia ideal de cada worker
+    (total / workers) nos blocos fixos do próximo tamanho menor de
+    ALIGNED_SHARD_DAYS, até caberem ou terem um dia só. Como os cortes caem
+    sempre nas mesmas datas, os pedaços repetem as chaves de ETag, de
+    checkpoint e da fila entre execuções. Shards abaixo de `min_seconds`
+    nunca são divididos: o custo fixo por shard (staging, publicação,
+    primeira página) passaria do ganho.
+    """
+    total = sum(task["expected_seconds"] for task in tasks)
+    limit = max(total / max(workers, 1), min_seconds)
+    result = []
+    pending = list(tasks)
+    while pending:
+        task = pending.pop()
+        days = (task["until"] - task["since"]).days + 1
+        if task["expected_seconds"] <= limit or days == 1:
+            result.append(task)
+            continue
+        per_day = task["expected_seconds"] / days
+        for size in sorted((d for d in ALIGNED_SHARD_DAYS if d < days), reverse=True):
+            pieces = shard_window(task["since"], task["until"], size)
+            if len(pieces) > 1:
+                break
+        for since, until in pieces:
+            pending.append(
+                {
+                    **task,
+                    "since": since,
+                    "until": until,
+                    "expected_seconds": per_day * ((until - since).days + 1),
+                }
+            )
+    return sorted(result, key=lambda task: (task["account_id"], task["since"]))
+
+
+def longest_first(tasks):
+    """Maior prioridade da agenda primeiro; dentro dela, os shards mais longos (LPT)"""
+    return sorted(
+        tasks, key=lambda task: (-task.get("priority", 0), -task.get("expected_seconds", 0))
+    )
+
+
+def shard_days(mode, rows_per_day=None, target_rows=5000, max_days=31):
+    """
+    Tamanho do shard em dias para o modo escolhido:
+    "day" = 1, "week" = 7, "none" = janela inteira (None) e "adaptive" =
+    o maior de ALIGNED_SHARD_DAYS que cabe em ~target_rows linhas pelo
+    histórico da conta (semana, se a conta ainda não tem histórico).
+    """
+    if mode == "none":
+        return None
+    if mode == "day":
+        return 1
+    if mode == "week" or not rows_per_day:
+        return 7
+    fits = min(max_days, target_rows // rows_per_day)
+    return max(days for days in ALIGNED_SHARD_DAYS if days <= max(fits, 1))
+
+
+def shard_window(since, until, days):
+    """
+    Divide [since, until] nos blocos fixos de `days` dias contados de
+    SHARD_EPOCH; só o primeiro e o último são cortados pela janela.
+    """
+    if not days:
+        return [(since, until)]
+    shards = []
+    start = since
+    while start <= until:
+        offset = (start - SHARD_EPOCH).days % days
+        end = min(start + timedelta(days=days - offset - 1), until)
+        shards.append((start, end))
+        start = end + ONE_DAY
+    return shards
+
+
+def contiguous_windows(days):
+    """Agrupa datas em intervalos (since, until) de dias consecutivos"""
+    windows = []
+    for day in sorted(days):
+        if windows and day == windows[-1][1] + ONE_DAY:
+            windows[-1] = (windows[-1][0], day)
+        else:
+            windows.append((day, day))
+    return windows
+
+
+def parse_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
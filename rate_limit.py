@@ -0,0 +1,198 @@
+"""
+Controle de rate limit da Meta Ads API a partir dos cabeçalhos de uso.
+
+Cada resposta traz a utilização do app e da conta em:
+- x-fb-ads-insights-throttle  -> app_id_util_pct / acc_id_util_pct
+- x-ad-account-usage          -> acc_id_util_pct / reset_time_duration
+- x-business-use-case-usage   -> call_count / total_cputime / total_time /
+                                 estimated_time_to_regain_access (minutos)
+
+O governador guarda a última leitura por conta, espaça as próximas chamadas
+conforme a utilização se aproxima do teto e, nos erros de throttling
+(4, 17, 80000), pausa exatamente pelo tempo informado pela Meta.
+"""
+
+import json
+import time
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_ERROR_CODES = (4, 17, 80000)
+
+# Pausa usada quando a Meta não informa o tempo para recuperar o acesso
+DEFAULT_BLOCK_SECONDS = 120
+# Pausa quando todos os tempos informados pela Meta são 0
+MIN_BLOCK_SECONDS = 5
+
+
+def _parse_json_header(headers, name):
+    raw = headers.get(name)
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+def parse_usage_headers(headers):
+    """
+    Extrai a utilização (%) do app e da conta e o tempo estimado (segundos)
+    para recuperar o acesso. Valores ausentes voltam como None.
+    """
+    insights = _parse_json_header(headers, "x-fb-ads-insights-throttle")
+    account = _parse_json_header(headers, "x-ad-account-usage")
+    business = _parse_json_header(headers, "x-business-use-case-usage")
+
+    app_pct = insights.get("app_id_util_pct")
+    acc_candidates = [
+        insights.get("acc_id_util_pct"),
+        account.get("acc_id_util_pct"),
+    ]
+    regain_candidates = [account.get("reset_time_duration")]
+    for usages in business.values():
+        for usage in usages if isinstance(usages, list) else []:
+            acc_candidates.extend(
+                usage.get(key)
+                for key in ("call_count", "total_cputime", "total_time")
+            )
+            minutes = usage.get("estimated_time_to_regain_access")
+            if minutes is not None:
+                regain_candidates.append(float(minutes) * 60)
+
+    acc_values = [float(v) for v in acc_candidates if v is not None]
+    # O maior tempo informado vale: a Meta manda 0 nos casos de uso que não
+    # estão bloqueados, e isso não pode encobrir o reset_time_duration da conta
+    regain_values = [float(v) for v in regain_candidates if v is not None]
+    regain_seconds = None
+    if regain_values:
+        regain_seconds = max(max(regain_values), MIN_BLOCK_SECONDS)
+
+    return {
+        "app_pct": float(app_pct) if app_pct is not None else None,
+        "acc_pct": max(acc_values) if acc_values else None,
+        "regain_seconds": regain_seconds,
+    }
+
+
+def parse_error(response):
+    """Retorna (code, subcode, message) do corpo de erro da Graph API"""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return None, None, response.text
+    return error.get("code"), error.get("error_subcode"), error.get("message")
+
+
+def is_throttle_error(response):
+    code, _, _ = parse_error(response)
+    return code in THROTTLE_ERROR_CODES
+
+
+class RateLimitGovernor:
+    """Estado compartilhado de utilização entre as threads de extração"""
+
+    def __init__(self, soft_pct=75, hard_pct=95, max_delay=60):
+        self.soft_pct = soft_pct
+        self.hard_pct = hard_pct
+        self.max_delay = max_delay
+        self.app_pct = 0.0
+        self.app_blocked_until = 0.0
+        self.accounts = {}
+        self._lock = threading.Lock()
+
+    def _account(self, account_id):
+        return self.accounts.setdefault(
+            account_id, {"pct": 0.0, "blocked_until": 0.0}
+        )
+
+    def observe(self, account_id, headers):
+        """Atualiza a utilização a partir dos cabeçalhos de uma resposta"""
+        usage = parse_usage_headers(headers)
+        with self._lock:
+            if usage["app_pct"] is not None:
+                self.app_pct = usage["app_pct"]
+            if usage["acc_pct"] is not None:
+                self._account(account_id)["pct"] = usage["acc_pct"]
+            app_pct = self.app_pct
+            acc_pct = self._account(account_id)["pct"]
+        metrics.THROTTLE_APP_PCT.set(app_pct)
+        metrics.THROTTLE_ACCOUNT_PCT.labels(account_id).set(acc_pct)
+        if max(app_pct, acc_pct) >= self.hard_pct:
+            logger.warning(
+                f"⚠️ Rate limit próximo do teto: {max(app_pct, acc_pct):.0f}% ({account_id})"
+            )
+        return usage
+
+    def block(self, account_id, seconds, app_wide=False):
+        """Bloqueia novas chamadas da conta (ou do app) por `seconds`"""
+        until = time.monotonic() + seconds
+        with self._lock:
+            if app_wide:
+                self.app_blocked_until = max(self.app_blocked_until, until)
+            else:
+                acc = self._account(account_id)
+                acc["blocked_until"] = max(acc["blocked_until"], until)
+
+    def delay_for(self, account_id):
+        """Quanto esperar antes da próxima chamada desta conta"""
+        now = time.monotonic()
+        with self._lock:
+            acc = self._account(account_id)
+            blocked = max(self.app_blocked_until, acc["blocked_until"]) - now
+            pct = max(self.app_pct, acc["pct"])
+        if blocked > 0:
+            return blocked
+        if pct < self.soft_pct:
+            return 0.0
+        # Espaçamento linear entre o limite suave e o teto
+        ratio = min((pct - self.soft_pct) / max(self.hard_pct - self.soft_pct, 1), 1)
+        return ratio * self.max_delay
+
+    def wait_for_slot(self, account_id):
+        delay = self.delay_for(account_id)
+        if delay > 0:
+            logger.info(
+                f"⏳ Rate limit - App: {self.app_pct:.0f}% | Account: "
+                f"{self._account(account_id)['pct']:.0f}% → aguardando {delay:.0f}s ({account_id})"
+            )
+            time.sleep(delay)
+
+    def handle_throttle_error(self, account_id, response):
+        """
+        Registra o bloqueio informado pela Meta para um erro 4/17/80000.
+        O código 4 é limite do app e bloqueia todas as contas.
+        """
+        code, subcode, message = parse_error(response)
+        usage = self.observe(account_id, response.headers)
+        seconds = usage["regain_seconds"]
+        if seconds is None:
+            seconds = DEFAULT_BLOCK_SECONDS
+        logger.warning(
+            f"🚦 Throttling ({code}/{subcode}) em {account_id}: {message} "
+            f"→ pausa de {seconds:.0f}s"
+        )
+        self.block(account_id, seconds, app_wide=(code == 4))
+        metrics.THROTTLE_PAUSES.labels(account_id, str(code)).inc()
+        metrics.THROTTLE_PAUSE_SECONDS.labels(account_id).inc(seconds)
+        return seconds
+
+
+def governed_request(governor, account_id, send, max_throttle_retries=5):
+    """
+    Executa `send()` (que retorna um requests.Response) respeitando o
+    governador: espera o espaçamento antes de cada chamada, registra os
+    cabeçalhos de uso e repete após a pausa nos erros de throttling.
+    """
+    for _ in range(max_throttle_retries + 1):
+        governor.wait_for_slot(account_id)
+        response = send()
+        if response.status_code in (200, 304) or not is_throttle_error(response):
+            governor.observe(account_id, response.headers)
+            return response
+        governor.handle_throttle_error(account_id, response)
+    return response
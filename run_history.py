@@ -0,0 +1,129 @@
+"""
+Histórico de execuções do ETL (etl_runs / etl_run_items).
+
+Cada execução grava uma linha em etl_runs ao começar (status "running") e,
+ao terminar, uma linha por shard em etl_run_items: início/fim, tentativas,
+páginas, linhas, bytes recebidos, chamadas à API, retries, pico de
+utilização do rate limit e o resultado da publicação. Os totais da
+execução são somados a partir dos shards.
+
+`python main.py report` lê daqui a tendência diária e as contas mais lentas.
+"""
+
+from datetime import timedelta
+
+from sqlalchemy import text
+
+ITEM_COUNTS = (
+    "pages",
+    "rows",
+    "bytes",
+    "api_calls",
+    "retries",
+    "inserted",
+    "updated",
+    "unchanged",
+    "deleted",
+)
+
+
+def start_run(conn, run_id, mode, extraction_mode, started_at):
+    conn.execute(
+        text(
+            "INSERT INTO etl_runs (run_id, mode, extraction_mode, started_at, shard_seconds) "
+            "VALUES (:run, :mode, :extraction, :started, TRUE)"
+        ),
+        {"run": run_id, "mode": mode, "extraction": extraction_mode, "started": started_at},
+    )
+
+
+def record_items(conn, run_id, summary):
+    """Grava os shards da execução (estatísticas de main.new_account_stats)"""
+    if not summary:
+        return
+    conn.execute(
+        text(
+            "INSERT INTO etl_run_items (run_id, account_id, since, until, started_at, "
+            "finished_at, seconds, attempts, status, peak_throttle_pct, "
+            f"{', '.join(ITEM_COUNTS)}) VALUES (:run, :account_id, :since, :until, "
+            ":started_at, :finished_at, :seconds, :attempts, :status, :peak_throttle_pct, "
+            f"{', '.join(':' + name for name in ITEM_COUNTS)}) "
+            "ON CONFLICT (run_id, account_id, since) DO NOTHING"
+        ),
+        [
+            {
+                **{name: stats.get(name, 0) for name in ITEM_COUNTS},
+                "run": run_id,
+                "account_id": stats["account_id"],
+                "since": stats["since"],
+                "until": stats["until"],
+                "started_at": stats["started_at"],
+                "finished_at": stats["started_at"] + timedelta(seconds=stats["seconds"]),
+                "seconds": round(stats["seconds"], 3),
+                "attempts": stats["attempts"],
+                "status": stats["status"],
+                "peak_throttle_pct": min(stats.get("peak_throttle_pct", 0.0), 999.99),
+            }
+            for stats in summary
+            if stats.get("since")
+        ],
+    )
+
+
+def finish_run(conn, run_id, finished_at):
+    """Fecha a execução com os totais dos shards; "erro" se algum falhou"""
+    conn.execute(
+        text(
+            "UPDATE etl_runs r SET finished_at = :finished, "
+            "status = CASE WHEN t.failed > 0 THEN 'erro' ELSE 'ok' END, "
+            "accounts = t.accounts, shards = t.shards, failed_shards = t.failed, "
+            "pages = t.pages, rows = t.rows, bytes = t.bytes, api_calls = t.api_calls, "
+            "retries = t.retries, peak_throttle_pct = t.peak "
+            "FROM (SELECT COUNT(DISTINCT account_id) AS accounts, COUNT(*) AS shards, "
+            "COUNT(*) FILTER (WHERE status <> 'ok') AS failed, "
+            "COALESCE(SUM(pages), 0) AS pages, COALESCE(SUM(rows), 0) AS rows, "
+            "COALESCE(SUM(bytes), 0) AS bytes, COALESCE(SUM(api_calls), 0) AS api_calls, "
+            "COALESCE(SUM(retries), 0) AS retries, "
+            "COALESCE(MAX(peak_throttle_pct), 0) AS peak "
+            "FROM etl_run_items WHERE run_id = :run) t "
+            "WHERE r.run_id = :run"
+        ),
+        {"run": run_id, "finished": finished_at},
+    )
+
+
+def daily_trend(conn, days=30):
+    """Execuções por dia: duração média/máxima, volume, custo de API e falhas"""
+    return conn.execute(
+        text(
+            "SELECT started_at::date AS day, COUNT(*) AS runs, "
+            "COUNT(*) FILTER (WHERE status <> 'ok') AS failed_runs, "
+            "AVG(EXTRACT(EPOCH FROM finished_at - started_at)) AS avg_seconds, "
+            "MAX(EXTRACT(EPOCH FROM finished_at - started_at)) AS max_seconds, "
+            "SUM(rows) AS rows, SUM(pages) AS pages, SUM(bytes) AS bytes, "
+            "SUM(api_calls) AS api_calls, SUM(retries) AS retries, "
+            "MAX(peak_throttle_pct) AS peak_throttle_pct "
+            "FROM etl_runs WHERE started_at >= NOW() - make_interval(days => :days) "
+            "AND finished_at IS NOT NULL "
+            "GROUP BY 1 ORDER BY 1"
+        ),
+        {"days": days},
+    ).mappings().all()
+
+
+def slowest_accounts(conn, days=30, limit=10):
+    """Contas que mais somaram tempo de shard no período"""
+    return conn.execute(
+        text(
+            "SELECT account_id, COUNT(*) AS shards, "
+            "COUNT(*) FILTER (WHERE status <> 'ok') AS failed, "
+            "SUM(seconds) AS total_seconds, AVG(seconds) AS avg_seconds, "
+            "percentile_cont(0.95) WITHIN GROUP (ORDER BY seconds) AS p95_seconds, "
+            "SUM(rows) AS rows, SUM(rows) / NULLIF(SUM(seconds), 0) AS rows_per_s, "
+            "SUM(bytes) AS bytes, SUM(api_calls) AS api_calls, SUM(retries) AS retries, "
+            "MAX(peak_throttle_pct) AS peak_throttle_pct "
+            "FROM etl_run_items WHERE started_at >= NOW() - make_interval(days => :days) "
+            "GROUP BY account_id ORDER BY total_seconds DESC LIMIT :limit"
+        ),
+        {"days": days, "limit": limit},
+    ).mappings().all()
@@ -0,0 +1,171 @@
+"""
+Agenda persistente por conta (etl_schedules).
+
+Cada conta tem sua cadência (interval_minutes), janela de reextração
+(lookback_days, senão ATTRIBUTION_LOOKBACK_DAYS) e prioridade. O worker
+acorda a cada SCHEDULER_POLL_SECONDS e roda, numa única execução, todas as
+contas com next_run_at vencido, das mais prioritárias para as menos.
+
+- Atraso: uma conta vencida há horas (worker parado, execução longa) roda
+  uma vez só e volta para a cadência normal, sem acumular execuções.
+- Jitter: o próximo horário ganha até jitter_seconds aleatórios, para as
+  contas com a mesma cadência não dispararem todas juntas.
+- Sobreposição: cada conta roda segurando um advisory lock de sessão; um
+  segundo worker (ou uma execução avulsa com --once) pula a conta até o
+  lock ser liberado. Com o lock na mão a conta é lida de novo: se outro
+  worker acabou de rodá-la, já não está vencida.
+- AD_ACCOUNTS continua sendo a lista de contas: agendas de contas que
+  saíram da variável ficam na tabela, mas não rodam.
+- Falha: a conta volta em no máximo retry_minutes (os checkpoints evitam
+  baixar de novo o que já foi gravado). Interrompida por SIGTERM, continua
+  vencida para o próximo início.
+"""
+
+import random
+from datetime import timedelta
+
+from sqlalchemy import text
+
+# Namespace dos advisory locks por conta (pg_try_advisory_lock(int, int))
+SCHEDULE_LOCK_KEY = 7361401
+
+_COLUMNS = (
+    "account_id, interval_minutes, lookback_days, priority, enabled, next_run_at, "
+    "last_started_at, last_finished_at, last_status"
+)
+
+
+def register_accounts(conn, accounts, interval_minutes, now):
+    """Contas novas (AD_ACCOUNTS) entram com a cadência padrão, vencidas em `now`"""
+    if not accounts:
+        return
+    conn.execute(
+        text(
+            "INSERT INTO etl_schedules (account_id, interval_minutes, next_run_at) "
+            "VALUES (:acc, :every, :now) ON CONFLICT (account_id) DO NOTHING"
+        ),
+        [
+            {"acc": account_id, "every": interval_minutes, "now": now}
+            for account_id in accounts
+        ],
+    )
+
+
+def upsert_schedule(
+    conn,
+    account_id,
+    interval_minutes=None,
+    lookback_days=None,
+    priority=None,
+    enabled=None,
+    next_run_at=None,
+    default_interval=240,
+):
+    """Cria ou altera a agenda da conta; campos None ficam como estão"""
+    conn.execute(
+        text(
+            "INSERT INTO etl_schedules (account_id, interval_minutes, lookback_days, "
+            "priority, enabled, next_run_at) VALUES (:acc, COALESCE(:every, :default_every), "
+            ":lookback, COALESCE(:priority, 0), COALESCE(:enabled, TRUE), "
+            "COALESCE(:next, CURRENT_TIMESTAMP)) "
+            "ON CONFLICT (account_id) DO UPDATE SET "
+            "interval_minutes = COALESCE(:every, etl_schedules.interval_minutes), "
+            "lookback_days = COALESCE(:lookback, etl_schedules.lookback_days), "
+            "priority = COALESCE(:priority, etl_schedules.priority), "
+            "enabled = COALESCE(:enabled, etl_schedules.enabled), "
+            "next_run_at = COALESCE(:next, etl_schedules.next_run_at), "
+            "updated_at = CURRENT_TIMESTAMP"
+        ),
+        {
+            "acc": account_id,
+            "every": interval_minutes,
+            "default_every": default_interval,
+            "lookback": lookback_days,
+            "priority": priority,
+            "enabled": enabled,
+            "next": next_run_at,
+        },
+    )
+
+
+def list_schedules(conn):
+    return conn.execute(
+        text(
+            f"SELECT {_COLUMNS} FROM etl_schedules "
+            "ORDER BY enabled DESC, priority DESC, next_run_at"
+        )
+    ).mappings().all()
+
+
+def due_schedules(conn, now, accounts):
+    """Contas de `accounts` vencidas, da maior prioridade e do maior atraso primeiro"""
+    rows = conn.execute(
+        text(
+            f"SELECT {_COLUMNS} FROM etl_schedules "
+            "WHERE enabled AND next_run_at <= :now AND account_id = ANY(:accounts) "
+            "ORDER BY priority DESC, next_run_at"
+        ),
+        {"now": now, "accounts": list(accounts)},
+    ).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def get_due_schedule(conn, account_id, now):
+    """Agenda da conta se ainda estiver vencida (releitura depois do lock)"""
+    row = conn.execute(
+        text(
+            f"SELECT {_COLUMNS} FROM etl_schedules "
+            "WHERE account_id = :acc AND enabled AND next_run_at <= :now"
+        ),
+        {"acc": account_id, "now": now},
+    ).mappings().fetchone()
+    return dict(row) if row else None
+
+
+def try_lock(conn, account_id):
+    """Advisory lock de sessão da conta; False se outro processo já a roda"""
+    return conn.execute(
+        text("SELECT pg_try_advisory_lock(:k, hashtext(:acc))"),
+        {"k": SCHEDULE_LOCK_KEY, "acc": account_id},
+    ).scalar()
+
+
+def unlock(conn, account_id):
+    conn.execute(
+        text("SELECT pg_advisory_unlock(:k, hashtext(:acc))"),
+        {"k": SCHEDULE_LOCK_KEY, "acc": account_id},
+    )
+
+
+def mark_started(conn, account_ids, started_at):
+    conn.execute(
+        text(
+            "UPDATE etl_schedules SET last_started_at = :started, last_status = 'running' "
+            "WHERE account_id = :acc"
+        ),
+        [{"acc": account_id, "started": started_at} for account_id in account_ids],
+    )
+
+
+def next_run_time(schedule, started_at, status, jitter_seconds=0, retry_minutes=30, rng=random):
+    """
+    Próximo horário contado do início da execução (a cadência não escorrega
+    com a duração). Se já passou, a conta roda de novo no próximo ciclo.
+    """
+    if status == "cancelado":
+        return schedule["next_run_at"]
+    minutes = schedule["interval_minutes"]
+    if status != "ok":
+        minutes = min(minutes, retry_minutes)
+    jitter = rng.uniform(0, jitter_seconds) if jitter_seconds else 0
+    return started_at + timedelta(minutes=minutes, seconds=jitter)
+
+
+def mark_finished(conn, account_id, status, finished_at, next_run_at):
+    conn.execute(
+        text(
+            "UPDATE etl_schedules SET last_finished_at = :finished, last_status = :status, "
+            "next_run_at = :next WHERE account_id = :acc"
+        ),
+        {"acc": account_id, "status": status, "finished": finished_at, "next": next_run_at},
+    )
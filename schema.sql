@@ -42,24 +42,180 @@ CREATE TABLE IF NOT EXISTS insights_meta_ads (
     
     -- Dimensões
     data_registro DATE NOT NULL,
-    plataforma VARCHAR(50),
-    posicionamento VARCHAR(100),
+    plataforma VARCHAR(50) NOT NULL DEFAULT '',
+    posicionamento VARCHAR(100) NOT NULL DEFAULT '',
     
     -- Custos
     valor_gasto NUMERIC(12, 2) DEFAULT 0,
     
+    -- md5 do conteúdo da linha: a publicação só regrava o que mudou
+    row_hash CHAR(32),
+
     -- Timestamps de controle
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+) PARTITION BY RANGE (data_registro);
 
--- Índices para performance
+-- Uma partição por mês (insights_meta_ads_pAAAA_MM), criadas pelo ETL antes
+-- de cada carga (partitions.py). Bancos criados com a tabela sem partições:
+-- ver migrations/001_partition_insights_by_month.sql
+
+-- Índices para performance (criados em cada partição automaticamente)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_insights_natural_key
+    ON insights_meta_ads(account_id, id_anuncio, data_registro, plataforma, posicionamento);
 CREATE INDEX IF NOT EXISTS idx_account_date ON insights_meta_ads(account_id, data_registro);
 CREATE INDEX IF NOT EXISTS idx_campaign ON insights_meta_ads(id_campanha);
 CREATE INDEX IF NOT EXISTS idx_adset ON insights_meta_ads(id_conjunto_anuncios);
 CREATE INDEX IF NOT EXISTS idx_ad ON insights_meta_ads(id_anuncio);
 CREATE INDEX IF NOT EXISTS idx_data_registro ON insights_meta_ads(data_registro);
 
+-- Staging da carga: as páginas extraídas entram aqui e a janela conta/período
+-- é publicada em insights_meta_ads numa única transação ao final da conta.
+-- UNLOGGED: sem WAL nem replicação para os dados intermediários.
+CREATE UNLOGGED TABLE IF NOT EXISTS stg_insights_meta_ads (
+    LIKE insights_meta_ads INCLUDING DEFAULTS
+);
+
+CREATE INDEX IF NOT EXISTS idx_stg_account_date ON stg_insights_meta_ads(account_id, data_registro);
+
+-- Marca d'água por conta: intervalo contínuo de datas já publicado.
+-- A execução incremental só reextrai a janela de atribuição e as lacunas.
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+    account_id VARCHAR(50) PRIMARY KEY,
+    loaded_since DATE NOT NULL,
+    loaded_until DATE NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ETags das fatias de página única já publicadas (requisições condicionais).
+-- query_signature = hash dos parâmetros da consulta e do mapeamento de actions.
+CREATE TABLE IF NOT EXISTS etl_etags (
+    account_id VARCHAR(50) NOT NULL,
+    since DATE NOT NULL,
+    until DATE NOT NULL,
+    query_signature VARCHAR(32) NOT NULL,
+    etag TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account_id, since, until, query_signature)
+);
+
+-- Agenda por conta (python main.py run / schedule). Contas de AD_ACCOUNTS entram
+-- com SCHEDULE_INTERVAL_MINUTES; lookback_days NULL = ATTRIBUTION_LOOKBACK_DAYS.
+CREATE TABLE IF NOT EXISTS etl_schedules (
+    account_id VARCHAR(50) PRIMARY KEY,
+    interval_minutes INTEGER NOT NULL DEFAULT 240,
+    lookback_days INTEGER,
+    priority INTEGER NOT NULL DEFAULT 0,
+    enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    next_run_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_started_at TIMESTAMPTZ,
+    last_finished_at TIMESTAMPTZ,
+    last_status VARCHAR(10),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Fila de shards entre réplicas (JOB_QUEUE=true, jobqueue.py). Um shard só fica
+-- uma vez em pending/running; jobs terminados são apagados depois de 7 dias.
+CREATE TABLE IF NOT EXISTS etl_jobs (
+    job_id BIGSERIAL PRIMARY KEY,
+    run_id VARCHAR(32) NOT NULL,
+    account_id VARCHAR(50) NOT NULL,
+    since DATE NOT NULL,
+    until DATE NOT NULL,
+    conditional BOOLEAN NOT NULL DEFAULT FALSE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    -- Duração estimada pelo histórico (etl_run_items): mais longos saem primeiro
+    expected_seconds NUMERIC(10, 1) NOT NULL DEFAULT 0,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker_id VARCHAR(100),
+    lease_until TIMESTAMPTZ,
+    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    result JSONB
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_shard
+    ON etl_jobs(account_id, since, until) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_pending
+    ON etl_jobs(priority DESC, expected_seconds DESC, job_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_jobs_run ON etl_jobs(run_id);
+
+-- Limit aprendido da paginação de /insights por conta (page_size.py)
+CREATE TABLE IF NOT EXISTS etl_page_sizes (
+    account_id VARCHAR(50) PRIMARY KEY,
+    page_size INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Cursor de paginação dos shards em andamento (python main.py resume).
+-- next_url sem access_token; NULL = todas as páginas no staging, falta publicar.
+CREATE TABLE IF NOT EXISTS etl_checkpoints (
+    account_id VARCHAR(50) NOT NULL,
+    since DATE NOT NULL,
+    until DATE NOT NULL,
+    query_signature VARCHAR(32) NOT NULL,
+    run_id VARCHAR(32) NOT NULL,
+    report_run_id VARCHAR(50),
+    next_url TEXT,
+    pages INTEGER NOT NULL DEFAULT 0,
+    rows INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account_id, since, until)
+);
+
+-- Histórico de execuções (python main.py report). run_id é o mesmo do landing.
+CREATE TABLE IF NOT EXISTS etl_runs (
+    run_id VARCHAR(32) PRIMARY KEY,
+    mode VARCHAR(20) NOT NULL,
+    extraction_mode VARCHAR(10) NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ,
+    status VARCHAR(10) NOT NULL DEFAULT 'running',
+    accounts INTEGER DEFAULT 0,
+    shards INTEGER DEFAULT 0,
+    failed_shards INTEGER DEFAULT 0,
+    pages INTEGER DEFAULT 0,
+    rows BIGINT DEFAULT 0,
+    bytes BIGINT DEFAULT 0,
+    api_calls INTEGER DEFAULT 0,
+    retries INTEGER DEFAULT 0,
+    peak_throttle_pct NUMERIC(5, 2) DEFAULT 0,
+    -- Duração de cada shard medida desde o início dele; execuções async/batch
+    -- antigas gravavam o tempo desde o início da execução
+    shard_seconds BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+ALTER TABLE etl_runs ADD COLUMN IF NOT EXISTS shard_seconds BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Uma linha por shard (conta, janela) de cada execução
+CREATE TABLE IF NOT EXISTS etl_run_items (
+    run_id VARCHAR(32) NOT NULL REFERENCES etl_runs(run_id) ON DELETE CASCADE,
+    account_id VARCHAR(50) NOT NULL,
+    since DATE NOT NULL,
+    until DATE NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL,
+    seconds NUMERIC(10, 3) NOT NULL,
+    attempts INTEGER NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    pages INTEGER DEFAULT 0,
+    rows INTEGER DEFAULT 0,
+    bytes BIGINT DEFAULT 0,
+    api_calls INTEGER DEFAULT 0,
+    retries INTEGER DEFAULT 0,
+    peak_throttle_pct NUMERIC(5, 2) DEFAULT 0,
+    inserted INTEGER DEFAULT 0,
+    updated INTEGER DEFAULT 0,
+    unchanged INTEGER DEFAULT 0,
+    deleted INTEGER DEFAULT 0,
+    PRIMARY KEY (run_id, account_id, since)
+);
+
+CREATE INDEX IF NOT EXISTS idx_run_items_account ON etl_run_items(account_id, started_at);
+
 -- Comentários para documentação
 COMMENT ON TABLE insights_meta_ads IS 'Dados de insights da API Meta Ads com janela de atribuição de 28 dias';
 COMMENT ON COLUMN insights_meta_ads.account_id IS 'ID da conta de anúncios (formato: act_123456789)';
@@ -1,13 +1,12 @@
-import requests
 import json
+from graph_client import GraphClient
 
 # --- COLOQUE SEUS DADOS AQUI ---
 TOKEN = "SEU_TOKEN_AQUI"  # Certifique-se de que o token está entre aspas
 CONTA = "act_213844638058297"
 
-url = f"https://graph.facebook.com/v21.0/{CONTA}/insights"
+client = GraphClient(TOKEN, "v21.0", timeout=15)
 params = {
-    "access_token": "TOKEN",
     "level": "account",
     "date_preset": "last_30d",
     "fields": "actions,impressions,spend",
@@ -15,7 +14,7 @@ params = {
 
 print(f"DEBUG: Tentando conectar na Meta...")
 try:
-    resp = requests.get(url, params=params, timeout=15)
+    resp = client.get(f"{CONTA}/insights", params=params)
     print(f"DEBUG: Status Code: {resp.status_code}")
 
     data = resp.json()